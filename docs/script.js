@@ -18,19 +18,65 @@ document.addEventListener('click', function (e) {
     img.src = src;
   }
 });
-
-/* static-site.js (generated) */
+/* static-site.js (bundled) */
 document.addEventListener("DOMContentLoaded", function(){
-  // Projects client-side search
+  // Projects client-side search, ranked with the BM25 index exported to search-index.json
   const search = document.querySelector('input[placeholder="Search projects..."]');
   if (search) {
     const list = document.getElementById('projects-list');
+    const tokenRe = /[a-z0-9]+(?:[.+#][a-z0-9]+)*[+#]*/g;
+    let index = null;
+    fetch('search-index.json').then(r => r.json()).then(function(data){
+      data.vocab = Object.keys(data.postings).sort();
+      const total = data.lengths.reduce((a, b) => a + b, 0);
+      data.avgLen = data.lengths.length ? total / data.lengths.length : 1;
+      index = data;
+    }).catch(err => console.error('Search index unavailable', err));
+
+    function expand(term, prefix) {
+      if (!prefix) return index.postings[term] ? [term] : [];
+      const out = [];
+      for (const t of index.vocab) {
+        if (t.startsWith(term)) out.push(t);
+      }
+      return out;
+    }
+
+    function rank(q) {
+      const terms = q.toLowerCase().match(tokenRe) || [];
+      if (!terms.length) return null;
+      const n = index.docs.length;
+      const scores = {};
+      let matched = null;
+      terms.forEach(function(term, i){
+        const hits = new Set();
+        expand(term, i === terms.length - 1).forEach(function(t){
+          const row = index.postings[t];
+          const df = Object.keys(row).length;
+          const idf = Math.log(1 + (n - df + 0.5) / (df + 0.5));
+          Object.keys(row).forEach(function(d){
+            const tf = row[d];
+            const norm = tf + index.k1 * (1 - index.b + index.b * index.lengths[d] / (index.avgLen || 1));
+            scores[d] = (scores[d] || 0) + idf * tf * (index.k1 + 1) / norm;
+            hits.add(d);
+          });
+        });
+        matched = matched === null ? hits : new Set([...matched].filter(d => hits.has(d)));
+      });
+      return [...matched].sort((a, b) => scores[b] - scores[a] || a - b).map(d => index.docs[d]);
+    }
+
     search.addEventListener('input', function(){
-      const q = this.value.toLowerCase();
-      Array.from(list.querySelectorAll('.project-card')).forEach(function(card){
-        const text = card.textContent.toLowerCase();
-        card.parentElement.style.display = text.indexOf(q) !== -1 ? '' : 'none';
+      if (!index) return;
+      const ranked = rank(this.value);
+      const cards = Array.from(list.querySelectorAll('.project-card'));
+      const bySlug = {};
+      cards.forEach(card => { bySlug[card.dataset.slug] = card.parentElement; });
+      cards.forEach(card => {
+        card.parentElement.style.display = ranked === null || ranked.indexOf(card.dataset.slug) !== -1 ? '' : 'none';
       });
+      // show best matches first
+      (ranked || []).forEach(slug => { if (bySlug[slug]) list.appendChild(bySlug[slug]); });
     });
   }
   // simple contact form fallback: replace form action placeholder note
@@ -1,360 +1,1005 @@
-from fastapi import FastAPI, Request, Form, HTTPException, BackgroundTasks, File, UploadFile, Response
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import APIRouter, FastAPI, Request, Form, HTTPException, File, UploadFile, Response, Query
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 from pathlib import Path
+import asyncio
+import itertools
 import json
 import logging
 from datetime import datetime
 import os
-import smtplib
-from email.message import EmailMessage
-from typing import Optional
-from .utils.images import generate_responsive_images
+import threading
+from typing import Callable, List, Optional
+import math
+import weakref
+from .utils.images import (DERIVATIVE_CACHE_CONTROL, DERIVATIVE_FORMATS, DERIVATIVE_SOURCE_EXTS, DerivativeCache,
+                           ImagePipeline, derivative, negotiate_format, record_files, snap_width)
+from .utils.leads import JsonlLeadStore, open_lead_store
+from .utils.leadstats import LeadIndex, LeadIndexStale
+from .utils.pubsub import hub_from_env
+from .utils.comments import CommentStore
+from .utils.catalog import ProjectCatalog
+from .utils.datasource import JsonSource
+from .utils.search import SearchIndex
+from .utils.pagecache import PageCache, _etag_matches
+from .utils.media import MediaManifest
+from .utils.bulk import BulkError, BulkImport, BulkImports, is_bulk_image, parse_manifest
+from .utils.uploads import (MULTIPART_OVERHEAD, UploadLimitMiddleware, UploadTooLarge, max_bytes_from_env,
+                            store_upload, store_upload_as)
+from .utils.mail import MailConfig, MailDispatcher
+from .utils.assets import AssetManifest, PrecompressedStaticFiles
+from .utils.export import FORMATS as EXPORT_FORMATS, encode, parse_fields
+from .utils.executors import Executors, ExecutorSaturated
+from .utils.ratelimit import Rate, RateLimited, RateLimiter, limiter_from_env, parse_rate
+from .utils.coalesce import WriteCoalescer
+from .utils.storage import recover
+from .utils import metrics
 
 BASE_DIR = Path(__file__).resolve().parent
-DATA_DIR = BASE_DIR / "data"
-DATA_DIR.mkdir(exist_ok=True)
 
-UPLOADS_DIR = BASE_DIR / "static" / "img" / "uploads"
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+logger = logging.getLogger("portfolio")
+logger.setLevel(logging.INFO)
 
-app = FastAPI(title="Aman Singhal — Portfolio")
-app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
-# Live lead subscribers (for SSE broadcast to admin)
-import asyncio
-LEADS_SUBSCRIBERS = []
+DEFAULT_RATE_LIMITS = {
+    "contact_ip": "5/600",
+    "contact_email": "3/600",
+    "comment_ip": "10/600",
+    "comment_slug": "60/600",
+}
+
+
+class Config:
+    """Where the app keeps its files, plus limits. `from_env` reads the usual environment variables."""
+
+    def __init__(self, data_dir: Optional[Path] = None, static_dir: Optional[Path] = None,
+                 templates_dir: Optional[Path] = None, jinja_cache_dir: Optional[str] = "",
+                 max_upload_bytes: int = 20 << 20, max_resume_bytes: int = 10 << 20,
+                 rate_limit_backend: str = "memory", rate_limits: Optional[dict] = None,
+                 coalesce_window: float = 0.05, derivative_dir: Optional[Path] = None,
+                 derivative_max_bytes: int = 256 << 20, max_bulk_files: int = 200,
+                 max_bulk_bytes: int = 200 << 20):
+        self.data_dir = Path(data_dir or BASE_DIR / "data")
+        self.static_dir = Path(static_dir or BASE_DIR / "static")
+        self.templates_dir = Path(templates_dir or BASE_DIR / "templates")
+        self.uploads_dir = self.static_dir / "img" / "uploads"
+        # "" = Jinja's default per-user temp dir, None = no bytecode cache
+        self.jinja_cache_dir = jinja_cache_dir
+        self.max_upload_bytes = max_upload_bytes
+        self.max_resume_bytes = max_resume_bytes
+        self.rate_limit_backend = rate_limit_backend
+        # "<count>/<seconds>" per key; "off" disables a limit
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.coalesce_window = coalesce_window
+        self.derivative_dir = Path(derivative_dir or self.data_dir / "cache" / "img")
+        self.derivative_max_bytes = derivative_max_bytes
+        self.max_bulk_files = max_bulk_files
+        self.max_bulk_bytes = max_bulk_bytes
+
+    def body_limit(self, path: str) -> Optional[int]:
+        """Largest request body accepted on upload routes (checked before the multipart body is parsed)."""
+        limits = {
+            "/admin/upload": self.max_upload_bytes + MULTIPART_OVERHEAD,
+            "/admin/upload_resume": self.max_resume_bytes + MULTIPART_OVERHEAD,
+            "/admin/bulk_upload": self.max_bulk_bytes,
+        }
+        return limits.get(path)
+
+    def rate(self, name: str) -> Optional[Rate]:
+        return parse_rate(self.rate_limits.get(name), name)
+
+    @classmethod
+    def from_env(cls, **overrides) -> "Config":
+        env = os.environ
+        cache_dir = env.get("JINJA_CACHE_DIR", "")
+        kwargs = dict(
+            # PORTFOLIO_DATA_DIR points the app at another data directory (e.g. the benchmark's synthetic data)
+            data_dir=env.get("PORTFOLIO_DATA_DIR") or None,
+            # JINJA_CACHE_DIR=off disables the bytecode cache
+            jinja_cache_dir=None if cache_dir == "off" else cache_dir,
+            # Upload size limits, enforced while streaming to disk
+            max_upload_bytes=max_bytes_from_env("MAX_UPLOAD_MB", 20),
+            max_resume_bytes=max_bytes_from_env("MAX_RESUME_MB", 10),
+            # Token buckets for contact/comment submissions, e.g. RATE_CONTACT_IP=5/600
+            rate_limit_backend=env.get("RATE_LIMIT_BACKEND", "memory"),
+            rate_limits={name: env[f"RATE_{name.upper()}"] for name in DEFAULT_RATE_LIMITS if f"RATE_{name.upper()}" in env},
+            # submissions arriving within this window share one fsync and one email
+            coalesce_window=float(env.get("COALESCE_WINDOW_MS", 50)) / 1000,
+            # on-disk LRU of /img derivatives
+            derivative_dir=env.get("IMAGE_CACHE_DIR") or None,
+            derivative_max_bytes=max_bytes_from_env("IMAGE_CACHE_MB", 256),
+            # images per /admin/bulk_upload batch (each also capped by MAX_UPLOAD_MB)
+            max_bulk_files=int(env.get("MAX_BULK_FILES", 200)),
+            max_bulk_bytes=max_bytes_from_env("MAX_BULK_MB", 200),
+        )
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
+
+class lazy:
+    """Like ``functools.cached_property``, but thread-safe and timed into ``Services.init_ms``."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.name = fn.__name__
+        self.__doc__ = fn.__doc__
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        with obj._init_lock:
+            if self.name not in obj.__dict__:
+                t0 = time.perf_counter()
+                obj.__dict__[self.name] = self.fn(obj)
+                obj.init_ms[self.name] = round((time.perf_counter() - t0) * 1000, 2)
+        return obj.__dict__[self.name]
+
+
+class Services:
+    """Everything the routes use. Each subsystem is created on first use, so a cold
+    start only pays for what its first requests actually touch."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._init_lock = threading.RLock()
+        self.init_ms: dict = {}
+
+    def peek(self, name: str):
+        """The subsystem `name` if it has been created, else None (never creates it)."""
+        return self.__dict__.get(name)
+
+    @lazy
+    def storage_report(self) -> dict:
+        # undo what a crash mid-write can leave in the data dir (stale temp files, torn log tails)
+        return recover(self.config.data_dir)
+
+    @lazy
+    def executors(self) -> Executors:
+        # Handlers are async; blocking work goes to separately sized disk/cpu/net pools
+        # (DISK_WORKERS, CPU_WORKERS, NET_WORKERS) instead of Starlette's shared threadpool
+        return Executors.from_env()
+
+    @lazy
+    def templates(self) -> Jinja2Templates:
+        templates = Jinja2Templates(directory=str(self.config.templates_dir))
+        if self.config.jinja_cache_dir is not None:
+            # compiled templates survive restarts, so a cold worker skips Jinja's parser
+            if self.config.jinja_cache_dir:
+                Path(self.config.jinja_cache_dir).mkdir(parents=True, exist_ok=True)
+            templates.env.bytecode_cache = FileSystemBytecodeCache(self.config.jinja_cache_dir or None)
+        metrics.instrument_templates(templates.env)
+        templates.env.globals["static_url"] = lambda path: self.assets.static_url(path)
+        # the image pipeline's result cache doubles as the srcset/dimension metadata used by _picture.html
+        templates.env.globals["image_meta"] = lambda url: self.image_pipeline.meta.get(url)
+        # everything else under /static/img is resized on demand by /img
+        templates.env.globals["derivative"] = derivative
+        return templates
+
+    @lazy
+    def assets(self) -> AssetManifest:
+        # Fingerprinted, precompressed CSS/JS built at deploy time (python -m portfolio.utils.assets);
+        # templates link them via static_url(), which falls back to plain /static paths without a build
+        return AssetManifest.load(self.config.static_dir)
+
+    @lazy
+    def lead_store(self):
+        # Leads live in an append-only store (LEAD_STORE=jsonl|sqlite); a legacy
+        # leads.json is migrated on first start and can be exported from /admin/leads.json
+        self.config.data_dir.mkdir(parents=True, exist_ok=True)
+        return open_lead_store(self.config.data_dir)
+
+    @lazy
+    def lead_index(self) -> LeadIndex:
+        # built by one scan on first use (from the disk pool), then kept current incrementally
+        index = LeadIndex(self.lead_store)
+        index.refresh(force=True)
+        return index
+
+    @lazy
+    def lead_hub(self):
+        # Live lead fan-out for the admin SSE stream (LEAD_HUB_BACKEND=local|filetail)
+        store = self.lead_store
+        return hub_from_env(store.path if isinstance(store, JsonlLeadStore) else None, executor=self.executors.disk)
+
+    @lazy
+    def profile_source(self) -> JsonSource:
+        # Re-read when the file changes on disk, checked at most once a second;
+        # its version feeds the page cache keys
+        return JsonSource(self.config.data_dir / "profile.json", default={})
+
+    @lazy
+    def catalog(self) -> ProjectCatalog:
+        # Projects are owned by the catalog (slug/tag indexes, atomic persistence, hot reload)
+        catalog = ProjectCatalog(self.config.data_dir / "projects.json")
+        catalog.subscribe(self._catalog_changed)
+        return catalog
+
+    def _catalog_changed(self, catalog: ProjectCatalog) -> None:
+        # only refresh what exists; an index nobody has used yet is built on first use
+        index = self.peek("search_index")
+        if index is not None:
+            index.build(catalog.projects)
+        # page keys include the catalog version; also drop stale pages eagerly
+        cache = self.peek("page_cache")
+        if cache is not None:
+            cache.clear()
+
+    @lazy
+    def search_index(self) -> SearchIndex:
+        # Full-text index over the catalog, rebuilt whenever the catalog changes
+        index = SearchIndex()
+        index.build(self.catalog.projects)
+        return index
+
+    @lazy
+    def page_cache(self) -> PageCache:
+        return PageCache()
+
+    @lazy
+    def mailer(self) -> MailDispatcher:
+        # Contact emails go through a queue-backed dispatcher with pooled connections;
+        # undeliverable messages are kept in data/outbox and retried later
+        config = MailConfig.from_env(self.profile.get("email"))
+        return MailDispatcher(config, self.config.data_dir / "outbox", executor=self.executors.net,
+                              disk_executor=self.executors.disk)
+
+    @lazy
+    def comment_store(self) -> CommentStore:
+        # Comments: append-only log per project with an in-memory tail + cursor index
+        self.config.data_dir.mkdir(parents=True, exist_ok=True)
+        return CommentStore(self.config.data_dir)
+
+    # Image manifests (rescanned only when the directory mtime changes)
+    @lazy
+    def gallery_media(self) -> MediaManifest:
+        return MediaManifest(self.config.static_dir / "img", "/static/img")
+
+    @lazy
+    def uploads_media(self) -> MediaManifest:
+        return MediaManifest(self.config.uploads_dir, "/static/img/uploads")
+
+    @lazy
+    def image_pipeline(self) -> ImagePipeline:
+        # Responsive variants are generated in a process pool; uploads return a job id
+        self.config.uploads_dir.mkdir(parents=True, exist_ok=True)
+        return ImagePipeline(self.config.uploads_dir, self.config.data_dir / "image_cache.json")
+
+    @lazy
+    def bulk_imports(self) -> BulkImports:
+        return BulkImports()
+
+    @lazy
+    def rate_limiter(self) -> RateLimiter:
+        return limiter_from_env(self.config.data_dir, self.config.rate_limit_backend)
+
+    # Contact and comment submissions are buffered for a few ms so a burst
+    # becomes one append+fsync (and, for leads, one digest email)
+    @lazy
+    def lead_writes(self) -> WriteCoalescer:
+        return WriteCoalescer(lambda entries: save_leads(self, entries), self.config.coalesce_window)
+
+    @lazy
+    def comment_writes(self) -> WriteCoalescer:
+        return WriteCoalescer(lambda items: save_comments(self, items), self.config.coalesce_window)
+
+    @lazy
+    def derivatives(self) -> DerivativeCache:
+        # shares the upload pipeline's process pool
+        return DerivativeCache(self.config.derivative_dir, self.config.derivative_max_bytes, self.image_pipeline.pool)
+
+    @property
+    def profile(self) -> dict:
+        return self.profile_source.data or {}
+
+    async def aclose(self) -> None:
+        for name in ("lead_writes", "comment_writes"):
+            writes = self.peek(name)
+            if writes is not None:
+                await writes.drain()
+        mailer = self.peek("mailer")
+        if mailer is not None:
+            await mailer.aclose()
+        for name in ("image_pipeline", "executors"):
+            sub = self.peek(name)
+            if sub is not None:
+                sub.shutdown(wait=False)
+        for name in ("lead_store", "rate_limiter"):
+            store = self.peek(name)
+            if store is not None:
+                store.close()
+
+
+def _services(request: Request) -> Services:
+    return request.app.state.services
 
-def broadcast_lead(entry: dict):
-    # Push to all subscriber queues (best-effort)
-    for q in list(LEADS_SUBSCRIBERS):
-        try:
-            q.put_nowait(entry)
-        except Exception:
-            logger.exception("Failed to broadcast lead to subscriber")
+# Simple admin auth helper
+def _is_admin(request: Request) -> bool:
+    # simple cookie-based admin; set via /admin/login
+    return request.cookies.get("_is_admin") == "1"
 
-# Add a helper filter for responsive srcset generation
-templates.env.filters['responsive_srcset'] = lambda image_path: ', '.join([f"{image_path.replace('.webp', f'-{w}.webp')} {w}w" for w in (600,1200,1800)])
 
-logger = logging.getLogger("portfolio")
-logger.setLevel(logging.INFO)
+def contact_email_message(s: Services, entries: List[dict]) -> dict:
+    """One email for the leads saved together: the lead itself, or a digest of the burst."""
+    def describe(entry):
+        return f"Name: {entry.get('name')}\nEmail: {entry.get('email')}\nMessage:\n{entry.get('message')}\n\nReceived: {entry.get('ts')}"
+    if len(entries) == 1:
+        return s.mailer.build(f"Portfolio contact form: {entries[0].get('name')}", describe(entries[0]))
+    subject = f"Portfolio contact form: {len(entries)} new messages"
+    return s.mailer.build(subject, "\n\n----------\n\n".join(describe(e) for e in entries))
 
-# Load profile and projects
-PROFILE_PATH = DATA_DIR / "profile.json"
-PROJECTS_PATH = DATA_DIR / "projects.json"
-LEADS_PATH = DATA_DIR / "leads.json"
-if not LEADS_PATH.exists():
-    LEADS_PATH.write_text("[]")
+async def send_contact_email(s: Services, entries: List[dict]) -> None:
+    """Queue the notification email for a batch of leads."""
+    await s.mailer.enqueue(contact_email_message(s, entries))
 
-def load_json(path: Path):
-    try:
-        return json.loads(path.read_text())
-    except Exception:
-        return None
+def broadcast_lead(s: Services, entry: dict):
+    s.lead_hub.publish(entry)
 
-profile = load_json(PROFILE_PATH) or {}
-projects = load_json(PROJECTS_PATH) or []
+def append_leads(s: Services, entries: List[dict]) -> List[dict]:
+    saved = s.lead_store.append_many(entries)
+    index = s.peek("lead_index")
+    if index is not None:
+        # fold the new leads into the dashboard aggregates while they're hot; only new bytes are read
+        try:
+            index.refresh(force=True)
+        except Exception:
+            logger.exception("Lead index update failed")
+    return saved
 
-# Helpers
-def find_project(slug: str):
-    for p in projects:
-        if p.get("slug") == slug:
-            return p
-    return None
+async def save_leads(s: Services, entries: List[dict]) -> List[dict]:
+    """Flush of `Services.lead_writes`: one append for the batch, then email and SSE."""
+    saved = await s.executors.disk.run(append_leads, s, entries)
+    for entry in saved:
+        logger.info(f"Lead saved: {entry.get('name')} <{entry.get('email')}>")
 
-# --- Email sending helpers -----------------------------------------
-def send_email_via_sendgrid(api_key: str, to_email: str, subject: str, content: str, from_email: str) -> bool:
-    # Import httpx lazily so the app can start even if httpx is not installed in some environments
+    # Queue the notification email; delivery happens off the request path
     try:
-        import httpx as _httpx
+        await send_contact_email(s, saved)
     except Exception:
-        logger.exception("httpx not available")
-        return False
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    payload = {
-        "personalizations": [{"to": [{"email": to_email}]}],
-        "from": {"email": from_email},
-        "subject": subject,
-        "content": [{"type": "text/plain", "value": content}]
-    }
-    try:
-        r = _httpx.post("https://api.sendgrid.com/v3/mail/send", json=payload, headers=headers, timeout=10.0)
-        r.raise_for_status()
-        return True
-    except Exception:
-        logger.exception("SendGrid send failed")
-        return False
+        logger.exception("Failed to queue contact email")
 
-
-def send_email_via_smtp(host: str, port: int, user: Optional[str], password: Optional[str], from_email: str, to_email: str, subject: str, content: str, use_tls: bool = True, use_ssl: bool = False) -> bool:
+    # Broadcast to admin subscribers (SSE) if any
+    for entry in saved:
+        try:
+            broadcast_lead(s, entry)
+        except Exception:
+            logger.exception("Broadcast failed")
+    return saved
+
+async def save_comments(s: Services, items: List[tuple]) -> List[object]:
+    """Flush of `Services.comment_writes`: one append per project for the batch."""
+    def write():
+        by_slug: dict = {}
+        for i, (slug, entry) in enumerate(items):
+            by_slug.setdefault(slug, []).append(i)
+        results: List[object] = [None] * len(items)
+        for slug, indexes in by_slug.items():
+            try:
+                saved = s.comment_store.add_many(slug, [items[i][1] for i in indexes])
+            except Exception as exc:  # an invalid slug only fails its own submissions
+                saved = [exc] * len(indexes)
+            for i, entry in zip(indexes, saved):
+                results[i] = entry
+        return results
+    return await s.executors.disk.run(write)
+
+async def check_rate(s: Services, limits: List[tuple]) -> None:
+    """Take a token for each ``(key, rate)`` or raise RateLimited (answered with a 429)."""
+    if s.rate_limiter.blocking:
+        await s.executors.disk.run(s.rate_limiter.acquire, limits)
+    else:
+        s.rate_limiter.acquire(limits)
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def page_context(s: Services, request: Request, **extra) -> dict:
+    return {"request": request, "profile": s.profile, "year": datetime.now().year, **extra}
+
+async def render_cached(request: Request, key: tuple, template: str, context: dict) -> Response:
+    """Serve `template` from the page cache (ETag/304, precompressed bodies).
+
+    `key` must capture everything the page depends on besides the data versions and year.
+    Cache hits are answered on the event loop; misses render and compress on the cpu pool.
+    """
+    s = _services(request)
+    year = datetime.now().year
+    full_key = (template, key, s.catalog.version, s.profile_source.version, year)
+    page = s.page_cache.get(full_key)
+    if page is None:
+        page = await s.executors.cpu.run(
+            s.page_cache.get_or_render,
+            full_key,
+            lambda: s.templates.get_template(template).render({"request": request, "profile": s.profile, "year": year, **context}),
+        )
+    return s.page_cache.respond(request, page)
+
+async def json_cached(request: Request, key: tuple, build: Callable[[], object]) -> Response:
+    """Serve `build()` as JSON bytes serialized once per `key` (which must include the data version).
+
+    Shares the page cache, so repeat calls skip serialization and get the same ETag/304 and gzip handling.
+    """
+    s = _services(request)
+    key = ("json",) + key
+    page = s.page_cache.get(key)
+    if page is None:
+        page = await s.executors.cpu.run(
+            s.page_cache.get_or_render, key,
+            lambda: json.dumps(build(), ensure_ascii=False, separators=(",", ":")), "application/json")
+    return s.page_cache.respond(request, page)
+
+LEAD_EXPORT_FIELDS = ("id", "ts", "name", "email", "message")
+COMMENT_EXPORT_FIELDS = ("ts", "name", "comment")
+
+async def stream_export(s: Services, open_rows: Callable, fmt: str, fields: Optional[str], default_fields: tuple,
+                        filename: str) -> Response:
+    """NDJSON/CSV/JSON download of the rows from `open_rows()`, encoded and read chunk by chunk on the disk pool."""
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown export format")
     try:
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = from_email
-        msg["To"] = to_email
-        msg.set_content(content)
-        if use_ssl:
-            server = smtplib.SMTP_SSL(host, port, timeout=10)
-        else:
-            server = smtplib.SMTP(host, port, timeout=10)
-        server.ehlo()
-        if use_tls and not use_ssl:
-            server.starttls()
-            server.ehlo()
-        if user:
-            server.login(user, password)
-        server.send_message(msg)
-        server.quit()
-        return True
-    except Exception:
-        logger.exception("SMTP send failed")
-        return False
-
-
-def send_contact_email(entry: dict) -> None:
-    """Try SendGrid first, fallback to SMTP if configured."""
-    from_email = os.environ.get("EMAIL_FROM", profile.get("email"))
-    to_email = os.environ.get("EMAIL_TO", profile.get("email"))
-    subject = f"Portfolio contact form: {entry.get('name')}"
-    body = f"Name: {entry.get('name')}\nEmail: {entry.get('email')}\nMessage:\n{entry.get('message')}\n\nReceived: {entry.get('ts')}"
-
-    sendgrid_key = os.environ.get("SENDGRID_API_KEY")
-    if sendgrid_key:
-        ok = send_email_via_sendgrid(sendgrid_key, to_email, subject, body, from_email)
-        if ok:
-            logger.info("Contact email sent via SendGrid")
-            return
-
-    smtp_host = os.environ.get("SMTP_HOST")
-    if smtp_host:
-        smtp_port = int(os.environ.get("SMTP_PORT", 587))
-        smtp_user = os.environ.get("SMTP_USER")
-        smtp_pass = os.environ.get("SMTP_PASSWORD")
-        use_ssl = os.environ.get("SMTP_SSL", "0") == "1"
-        use_tls = os.environ.get("SMTP_TLS", "1") == "1"
-        ok = send_email_via_smtp(smtp_host, smtp_port, smtp_user, smtp_pass, from_email, to_email, subject, body, use_tls=use_tls, use_ssl=use_ssl)
-        if ok:
-            logger.info("Contact email sent via SMTP")
-            return
-
-    logger.warning("No email provider configured; skipping send")
-# Simple admin auth helper
-def _is_admin(request: Request) -> bool:
-    # simple cookie-based admin; set via /admin/login
-    return request.cookies.get("_is_admin") == "1"
+        # NDJSON keeps whole rows unless fields are given; CSV needs columns
+        columns = parse_fields(fields, default_fields if fmt == "csv" else ())
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # only the first call may be refused with a 503; once the 200 is sent, a refusal would
+    # end the download early in a file that looks complete (neither format has a terminator)
+    chunks = await s.executors.disk.run(lambda: encode(open_rows(), fmt, columns))
+
+    async def body():
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(s.executors.disk, next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            try:
+                chunks.close()  # closes the underlying log file early if the client went away
+            except ValueError:
+                pass  # still running in a pool thread; it's closed when collected
+    return StreamingResponse(body(), media_type=EXPORT_FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'})
 
 
 # Routes
-def list_gallery_images():
-    img_dir = BASE_DIR / "static" / "img"
-    out = []
-    for p in sorted(img_dir.iterdir()):
-        if p.is_file() and p.parent == img_dir and p.suffix.lower() in ('.jpg', '.jpeg', '.png', '.webp', '.svg'):
-            out.append(f"/static/img/{p.name}")
-    return out
-
-@app.get("/", response_class=HTMLResponse)
-def index(request: Request):
-    gallery_images = list_gallery_images()
-    resp = templates.TemplateResponse("index.html", {"request": request, "profile": profile, "projects": projects, "gallery_images": gallery_images, "year": datetime.now().year})
-    logger.debug("index returning %s", type(resp))
-    return resp
+router = APIRouter()
 
+@router.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    s = _services(request)
+    gallery_images = await s.executors.disk.run(s.gallery_media.urls)
+    return await render_cached(request, (s.gallery_media.version,), "index.html", {"projects": s.catalog.projects, "gallery_images": gallery_images})
 
-# Admin login
-@app.get("/admin/login", response_class=HTMLResponse)
-def admin_login_get(request: Request):
-    return templates.TemplateResponse("admin_login.html", {"request": request, "error": None, "profile": profile, "year": datetime.now().year})
 
-@app.post("/admin/login")
-def admin_login_post(request: Request, password: str = Form(...)):
+# Admin login
+@router.get("/admin/login", response_class=HTMLResponse)
+async def admin_login_get(request: Request):
+    s = _services(request)
+    return s.templates.TemplateResponse("admin_login.html", page_context(s, request, error=None))
+
+@router.post("/admin/login")
+async def admin_login_post(request: Request, password: str = Form(...)):
+    s = _services(request)
     admin_pass = os.environ.get("ADMIN_PASS")
     if admin_pass and password == admin_pass:
         resp = RedirectResponse(url="/admin", status_code=303)
         resp.set_cookie("_is_admin", "1", httponly=True)
         return resp
-    return templates.TemplateResponse("admin_login.html", {"request": request, "error": "Invalid password", "profile": profile, "year": datetime.now().year})
+    return s.templates.TemplateResponse("admin_login.html", page_context(s, request, error="Invalid password"))
 
-@app.get("/admin", response_class=HTMLResponse)
-def admin_get(request: Request):
+@router.get("/admin", response_class=HTMLResponse)
+async def admin_get(request: Request):
     if not _is_admin(request):
         return RedirectResponse(url="/admin/login")
-    uploads = [p.name for p in (UPLOADS_DIR).glob("*") if p.is_file()]
-    return templates.TemplateResponse("admin.html", {"request": request, "uploads": uploads, "profile": profile, "year": datetime.now().year})
+    s = _services(request)
+    uploads = await s.executors.disk.run(s.uploads_media.entries)
+    return s.templates.TemplateResponse("admin.html", page_context(s, request, uploads=uploads))
 
-@app.post("/admin/upload")
-def admin_upload(request: Request, slug: str = Form(...), file: UploadFile = File(...), assign: bool = Form(True)):
+@router.post("/admin/upload")
+async def admin_upload(request: Request, slug: str = Form(...), file: UploadFile = File(...), assign: bool = Form(True)):
     # simple admin-protected upload
     if not _is_admin(request):
         return RedirectResponse(url="/admin/login")
     if not file.filename:
         return RedirectResponse(url="/admin")
-    safe_name = Path(file.filename).name
-    dest = UPLOADS_DIR / safe_name
-    with dest.open("wb") as fh:
-        fh.write(file.file.read())
-    generated = generate_responsive_images(dest, UPLOADS_DIR)
-    # assign largest (detail) as project image if assign True and project exists
-    if assign and generated and find_project(slug):
-        # pick detail size
-        detail_url = generated.get("detail")
-        for p in projects:
-            if p.get("slug") == slug:
-                p["image"] = detail_url
-        PROJECTS_PATH.write_text(json.dumps(projects, indent=2))
-    return RedirectResponse(url="/admin", status_code=303)
-
-@app.post("/admin/upload_resume")
-def admin_upload_resume(request: Request, resume: UploadFile = File(None)):
+    s = _services(request)
+    uploads_dir = s.config.uploads_dir
+    try:
+        stored = await s.executors.disk.run(store_upload, file.file, uploads_dir, file.filename, max_bytes=s.config.max_upload_bytes)
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    dest = stored.path
+    await s.executors.disk.run(s.uploads_media.add, dest)
+
+    def on_done(job: dict):
+        record = job.get("result") or {}
+        for url in record_files(record):
+            s.uploads_media.add(uploads_dir / Path(url).name)
+        # assign the detail-size variant as project image if assign True; update() ignores unknown slugs
+        if assign and record:
+            s.catalog.update(slug, image=record["src"])
+
+    # the resizing itself runs in the pipeline's process pool; submit only checks the cache
+    job_id = await s.executors.disk.run(s.image_pipeline.submit, dest, on_done=on_done, digest=stored.sha256)
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse({"job": job_id, "status_url": f"/admin/jobs/{job_id}"}, status_code=202)
+    return RedirectResponse(url=f"/admin?job={job_id}", status_code=303)
+
+@router.get("/admin/jobs/{job_id}")
+async def admin_job_status(request: Request, job_id: str):
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    job = _services(request).image_pipeline.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+def stage_bulk(s: Services, job: BulkImport, files: List[UploadFile], manifest: Optional[str]) -> None:
+    """Stream the batch's images (loose or zipped) to the uploads dir and read its manifest. Blocking."""
+    limit, max_files = s.config.max_upload_bytes, s.config.max_bulk_files
+    raw_manifest = manifest or None
+    for f in files:
+        name = Path(f.filename or "").name
+        if name.lower().endswith(".zip"):
+            raw_manifest = job.stage_zip(f.file, s.config.uploads_dir, limit, max_files) or raw_manifest
+        elif name == "manifest.json":
+            raw_manifest = f.file.read(1 << 20)
+        elif is_bulk_image(name):
+            if len(job.items) >= max_files:
+                raise BulkError(f"more than {max_files} images in one batch")
+            job.stage(name, f.file, s.config.uploads_dir, limit)
+    if raw_manifest:
+        job.manifest = parse_manifest(raw_manifest)
+    if not job.items and not job.manifest:
+        raise BulkError("no images or manifest in the batch")
+
+
+def start_bulk(s: Services, job: BulkImport) -> None:
+    """Process every staged image concurrently; apply the manifest with one catalog write at the end."""
+    def submit(item: dict):
+        def on_done(pipeline_job: dict):
+            record = pipeline_job.get("result") or {}
+            for url in record_files(record):
+                s.uploads_media.add(s.config.uploads_dir / Path(url).name)
+            job.complete(item["name"], record, pipeline_job.get("error"))
+        s.uploads_media.add(item["path"])
+        s.image_pipeline.submit(item["path"], on_done=on_done, digest=item["sha256"])
+
+    def finish(job: BulkImport) -> dict:
+        changes = job.resolved_changes()
+        before = {p.get("slug") for p in s.catalog.projects}
+        updated = s.catalog.update_many(changes) if changes else {}
+        return {"updated": sorted(slug for slug in updated if slug in before),
+                "created": sorted(slug for slug in updated if slug not in before),
+                "catalog_version": s.catalog.version}
+
+    job.start(submit, finish)
+
+@router.post("/admin/bulk_upload")
+async def admin_bulk_upload(request: Request, files: List[UploadFile] = File(...), manifest: Optional[str] = Form(None)):
+    """Many images (loose files and/or zip archives) plus an optional projects manifest.
+
+    Returns 202 at once; images are processed in parallel in the pipeline's
+    process pool and progress is streamed from ``events_url``.
+    """
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    s = _services(request)
+    job = s.bulk_imports.create()
+    try:
+        await s.executors.disk.run(stage_bulk, s, job, files, manifest)
+    except Exception as exc:
+        # the job was never listed, so nothing waits on its events; just drop what was staged
+        await asyncio.get_running_loop().run_in_executor(None, job.discard)
+        if isinstance(exc, BulkError):
+            raise HTTPException(status_code=400, detail=str(exc))
+        raise
+    s.bulk_imports.add(job)
+    await s.executors.disk.run(start_bulk, s, job)
+    return JSONResponse({"job": job.id, "items": len(job.items), "projects": len(job.manifest),
+                         "status_url": f"/admin/bulk/{job.id}", "events_url": f"/admin/bulk/{job.id}/events"},
+                        status_code=202)
+
+def _bulk_job(request: Request, job_id: str) -> BulkImport:
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    job = _services(request).bulk_imports.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@router.get("/admin/bulk/{job_id}")
+async def admin_bulk_status(request: Request, job_id: str):
+    return _bulk_job(request, job_id).summary()
+
+@router.get("/admin/bulk/{job_id}/events")
+async def admin_bulk_events(request: Request, job_id: str):
+    """SSE: one event per item state change, then a final ``done`` event with the summary."""
+    job = _bulk_job(request, job_id)
+    events = job.hub.stream(
+        request.is_disconnected,
+        last_event_id=request.headers.get("last-event-id") or "0",
+        replay=job.events_after,
+        until=lambda event: event["type"] == "done",
+    )
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/admin/upload_resume")
+async def admin_upload_resume(request: Request, resume: UploadFile = File(None)):
     if not _is_admin(request):
         return RedirectResponse(url="/admin/login")
     if resume:
-        dest = BASE_DIR / "static" / "Aman_Singhal_Resume.pdf"
-        with dest.open("wb") as fh:
-            fh.write(resume.file.read())
+        s = _services(request)
+        dest = s.config.static_dir / "Aman_Singhal_Resume.pdf"
+        try:
+            await s.executors.disk.run(store_upload_as, resume.file, dest, max_bytes=s.config.max_resume_bytes)
+        except UploadTooLarge as exc:
+            raise HTTPException(status_code=413, detail=str(exc))
     return RedirectResponse(url="/admin", status_code=303)
 
-@app.get("/about", response_class=HTMLResponse)
-def about(request: Request):
-    return templates.TemplateResponse("about.html", {"request": request, "profile": profile, "year": datetime.now().year})
-
-@app.get("/projects", response_class=HTMLResponse)
-def projects_list(request: Request):
-    # compute unique sorted tags for project filtering and pass to template
-    tags = sorted({t for p in projects for t in p.get('tech', [])})
-    return templates.TemplateResponse("projects.html", {"request": request, "projects": projects, "tags": tags, "profile": profile, "year": datetime.now().year})
-
-@app.get("/projects/search", response_class=HTMLResponse)
-def projects_search(request: Request, q: str = "", tag: str = ""):
+@router.get("/img/{path:path}")
+async def image_derivative(request: Request, path: str, w: Optional[int] = None, fmt: str = "auto"):
+    """`path` under static/img, at most `w` pixels wide (rounded up to a fixed step), as `fmt`.
+
+    ``fmt=auto`` picks AVIF/WebP/JPEG from the Accept header. Derivatives are
+    rendered once per source version and served from the on-disk cache.
+    """
+    s = _services(request)
+    root = (s.config.static_dir / "img").resolve()
+    src = (root / path).resolve()
+    if not src.is_relative_to(root) or src.suffix.lower() not in DERIVATIVE_SOURCE_EXTS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if w is not None and w <= 0:
+        raise HTTPException(status_code=400, detail="w must be positive")
+    cache = s.derivatives
+    if not cache.formats:  # no Pillow: the original is the best we can do
+        return RedirectResponse(url=f"/static/img/{src.relative_to(root).as_posix()}", status_code=307)
+    negotiated = fmt == "auto"
+    if negotiated:
+        fmt = negotiate_format(request.headers.get("accept", ""), cache.formats)
+    elif fmt not in cache.formats:
+        raise HTTPException(status_code=400, detail=f"fmt must be one of: auto, {', '.join(cache.formats)}")
+    width = snap_width(w) if w else None
+
+    def lookup():
+        if not src.is_file():
+            return None, None
+        key = cache.key(cache.source_digest(src), width, fmt)
+        return key, cache.lookup(key)
+
+    key, cached = await s.executors.disk.run(lookup)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = {"Cache-Control": DERIVATIVE_CACHE_CONTROL, "ETag": f'"{Path(key).stem}"'}
+    if negotiated:
+        headers["Vary"] = "Accept"
+    inm = request.headers.get("if-none-match")
+    if inm and _etag_matches(inm, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if cached is None:
+        # concurrent requests for the same key wait for the same render
+        cached = await asyncio.wrap_future(cache.render(key, src, width, fmt))
+        if cached is None:
+            raise HTTPException(status_code=415, detail="Unsupported image")
+    return FileResponse(cached, media_type=DERIVATIVE_FORMATS[fmt][2], headers=headers)
+
+@router.get("/about", response_class=HTMLResponse)
+async def about(request: Request):
+    return await render_cached(request, (), "about.html", {})
+
+@router.get("/projects", response_class=HTMLResponse)
+async def projects_list(request: Request):
+    catalog = _services(request).catalog
+    return await render_cached(request, (), "projects.html", {"projects": catalog.projects, "tags": catalog.tags})
+
+@router.get("/projects/search", response_class=HTMLResponse)
+async def projects_search(request: Request, q: str = "", tag: str = ""):
     """Return a partial list of projects matching query or tag for HTMX replacement."""
-    filtered = projects
-    if q:
-        qlow = q.lower()
-        filtered = [p for p in filtered if qlow in p.get('title','').lower() or qlow in p.get('summary','').lower()]
+    s = _services(request)
+    filtered = await s.executors.cpu.run(s.search_index.search, q) if q.strip() else s.catalog.projects
     if tag:
-        filtered = [p for p in filtered if tag in p.get('tech', [])]
-    return templates.TemplateResponse("_projects_list.html", {"request": request, "projects": filtered})
+        tagged = {p.get("slug") for p in s.catalog.by_tag(tag)}
+        filtered = [p for p in filtered if p.get("slug") in tagged]
+    return s.templates.TemplateResponse("_projects_list.html", {"request": request, "projects": filtered})
 
-@app.get("/projects/{slug}", response_class=HTMLResponse)
-def project_detail(request: Request, slug: str):
-    p = find_project(slug)
+@router.get("/projects/{slug}", response_class=HTMLResponse)
+async def project_detail(request: Request, slug: str):
+    p = _services(request).catalog.get(slug)
     if not p:
         raise HTTPException(status_code=404, detail="Project not found")
-    return templates.TemplateResponse("project_detail.html", {"request": request, "project": p, "profile": profile, "year": datetime.now().year})
+    return await render_cached(request, (slug,), "project_detail.html", {"project": p})
 
-# Comments: simple JSON file per project
-def _comments_path_for(slug: str) -> Path:
-    return DATA_DIR / f"comments_{slug}.json"
-
-@app.get("/projects/{slug}/comments", response_class=HTMLResponse)
-def project_comments(request: Request, slug: str):
-    path = _comments_path_for(slug)
+@router.get("/projects/{slug}/comments", response_class=HTMLResponse)
+async def project_comments(request: Request, slug: str, before: Optional[str] = None, limit: int = 20):
+    s = _services(request)
+    limit = max(1, min(limit, 100))
     try:
-        comments = json.loads(path.read_text()) if path.exists() else []
-    except Exception:
-        comments = []
-    return templates.TemplateResponse("_comments_list.html", {"request": request, "comments": comments})
-
-@app.post("/projects/{slug}/comments")
-def submit_project_comment(request: Request, slug: str, name: str = Form(...), comment: str = Form(...)):
+        comments, next_before = await s.executors.disk.run(s.comment_store.page, slug, before=before, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    ctx = {"request": request, "slug": slug, "comments": comments, "next_before": next_before, "limit": limit}
+    # "Load older" requests only need the next page of items, not the form
+    template = "_comments_page.html" if before else "_comments_list.html"
+    return s.templates.TemplateResponse(template, ctx)
+
+@router.post("/projects/{slug}/comments")
+async def submit_project_comment(request: Request, slug: str, name: str = Form(...), comment: str = Form(...)):
+    s = _services(request)
+    await check_rate(s, [(f"comment:ip:{client_ip(request)}", s.config.rate("comment_ip")),
+                         (f"comment:slug:{slug}", s.config.rate("comment_slug"))])
     entry = {"name": name, "comment": comment, "ts": datetime.utcnow().isoformat()}
-    path = _comments_path_for(slug)
     try:
-        cur = json.loads(path.read_text()) if path.exists() else []
-        cur.append(entry)
-        path.write_text(json.dumps(cur, indent=2))
+        entry = await s.comment_writes.submit((slug, entry))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    except ExecutorSaturated:
+        raise
     except Exception:
         logger.exception("Failed to save comment")
         return JSONResponse({"error": "failed"}, status_code=500)
     # return an HTML fragment representing the new comment for HTMX to insert
-    return templates.TemplateResponse("_comment_item.html", {"request": request, "comment": entry})
-
-@app.get("/projects/search", response_class=HTMLResponse)
-def projects_search(request: Request, q: str = "", tag: str = ""):
-    """Return a partial list of projects matching query or tag for HTMX replacement."""
-    filtered = projects
-    if q:
-        qlow = q.lower()
-        filtered = [p for p in filtered if qlow in p.get('title','').lower() or qlow in p.get('summary','').lower()]
-    if tag:
-        filtered = [p for p in filtered if tag in p.get('tech', [])]
-    return templates.TemplateResponse("_projects_list.html", {"request": request, "projects": filtered})
-
-@app.get("/contact", response_class=HTMLResponse)
-def contact_get(request: Request, success: int = 0):
-    return templates.TemplateResponse("contact.html", {"request": request, "success": success, "profile": profile, "year": datetime.now().year})
-
-@app.post("/contact")
-def contact_post(request: Request, name: str = Form(...), email: str = Form(...), message: str = Form(...), background_tasks: BackgroundTasks = None):
+    return s.templates.TemplateResponse("_comment_item.html", {"request": request, "comment": entry})
+
+@router.get("/contact", response_class=HTMLResponse)
+async def contact_get(request: Request, success: int = 0):
+    s = _services(request)
+    return s.templates.TemplateResponse("contact.html", page_context(s, request, success=success))
+
+@router.post("/contact")
+async def contact_post(request: Request, name: str = Form(...), email: str = Form(...), message: str = Form(...)):
+    s = _services(request)
+    await check_rate(s, [(f"contact:ip:{client_ip(request)}", s.config.rate("contact_ip")),
+                         (f"contact:email:{email.strip().lower()}", s.config.rate("contact_email"))])
     entry = {"name": name, "email": email, "message": message, "ts": datetime.utcnow().isoformat()}
     try:
-        leads = json.loads(LEADS_PATH.read_text())
-        leads.append(entry)
-        LEADS_PATH.write_text(json.dumps(leads, indent=2))
-        logger.info(f"Lead saved: {name} <{email}>")
+        # saved together with any other leads arriving in the same few ms; see save_leads
+        entry = await s.lead_writes.submit(entry)
+    except ExecutorSaturated:
+        raise
     except Exception as e:
         logger.exception("Failed to save lead")
         return JSONResponse({"error": "failed to save"}, status_code=500)
 
-    # Send email in background if configured
-    try:
-        if background_tasks is not None:
-            background_tasks.add_task(send_contact_email, entry)
-        else:
-            # best-effort synchronous send
-            send_contact_email(entry)
-    except Exception:
-        logger.exception("Failed to queue/send contact email")
-
-    # Broadcast to admin subscribers (SSE) if any
-    try:
-        broadcast_lead(entry)
-    except Exception:
-        logger.exception("Broadcast failed")
-
     # If HTMX/async request, return a small success partial to replace the form
     try:
         if request.headers.get("hx-request") == "true":
-            return templates.TemplateResponse("_contact_success.html", {"request": request, "profile": profile, "year": datetime.now().year})
+            return s.templates.TemplateResponse("_contact_success.html", page_context(s, request))
     except Exception:
         pass
 
     return RedirectResponse(url="/contact?success=1", status_code=303)
 
-@app.get("/api/profile")
-def api_profile():
-    return profile
+@router.get("/api/profile")
+async def api_profile(request: Request):
+    snapshot = _services(request).profile_source.snapshot
+    return await json_cached(request, ("profile", snapshot.version), lambda: snapshot.data or {})
+
+@router.get("/api/projects")
+async def api_projects(request: Request):
+    catalog = _services(request).catalog
+    version = catalog.version  # read before the list: a reload in between re-serializes, never caches stale
+    projects = catalog.projects
+    return await json_cached(request, ("projects", version), lambda: projects)
+
+@router.get("/admin/leads.json")
+async def admin_leads_export(request: Request):
+    """Download all leads as a JSON array, like the legacy leads.json (streamed, not built in memory)."""
+    if not _is_admin(request):
+        return RedirectResponse(url="/admin/login")
+    s = _services(request)
+    return await stream_export(s, lambda: s.lead_store.iter_leads(), "json", None, (), "leads")
 
-@app.get("/api/projects")
-def api_projects():
-    return projects
+@router.get("/admin/api/leads/stats")
+async def admin_lead_stats(request: Request, days: int = Query(30, ge=0, le=366), hours: int = Query(48, ge=0, le=24 * 14),
+                           top: int = Query(10, ge=1, le=100)):
+    """Lead counts per day/hour, rolling 24h/7d/30d windows, sender domains and repeat senders."""
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    s = _services(request)
+    return await s.executors.disk.run(lambda: s.lead_index.stats(days=days, hours=hours, top=top))
+
+@router.get("/admin/api/leads")
+async def admin_lead_list(request: Request, domain: Optional[str] = None, email: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, q: Optional[str] = None,
+                          before: Optional[int] = None, limit: int = Query(20, ge=1, le=100)):
+    """Leads newest first, filtered by sender domain/email, ts range and name/email text.
+
+    Pass ``next_before`` from the response as `before` for the next page. ``total``
+    is null when filtering by ts range or text, which the index can't count.
+    """
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    s = _services(request)
+    try:
+        leads, next_before, total = await s.executors.disk.run(
+            lambda: s.lead_index.query(domain=domain, email=email, since=since, until=until, q=q, before=before, limit=limit))
+    except LeadIndexStale as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+    return {"leads": leads, "total": total, "next_before": next_before}
+
+@router.get("/admin/export/leads.{fmt}")
+async def admin_export_leads(request: Request, fmt: str, fields: Optional[str] = None, after: int = 0,
+                             limit: Optional[int] = Query(None, ge=1)):
+    """All leads (or `limit` of them with ids above `after`) as NDJSON, CSV or JSON, streamed from the store."""
+    if not _is_admin(request):
+        return RedirectResponse(url="/admin/login")
+    s = _services(request)
+    return await stream_export(s, lambda: itertools.islice(s.lead_store.iter_leads(after_id=after), limit),
+                               fmt, fields, LEAD_EXPORT_FIELDS, "leads")
+
+@router.get("/admin/export/comments/{slug}.{fmt}")
+async def admin_export_comments(request: Request, slug: str, fmt: str, fields: Optional[str] = None,
+                                after: Optional[str] = None, limit: Optional[int] = Query(None, ge=1)):
+    """A project's comments oldest first (`after` = last ts of the previous page) as NDJSON, CSV or JSON."""
+    if not _is_admin(request):
+        return RedirectResponse(url="/admin/login")
+    s = _services(request)
+    try:
+        await s.executors.disk.run(s.comment_store.count, slug)  # validates the slug
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return await stream_export(s, lambda: itertools.islice(s.comment_store.iter_comments(slug, after=after), limit),
+                               fmt, fields, COMMENT_EXPORT_FIELDS, f"comments-{slug}")
 
-@app.get("/admin/lead_stream")
+@router.get("/admin/lead_stream")
 async def lead_stream(request: Request):
-    """Server-Sent Events endpoint that streams new leads to admin UI."""
-    q = asyncio.Queue()
-    LEADS_SUBSCRIBERS.append(q)
+    """Server-Sent Events endpoint that streams new leads to admin UI.
 
-    async def event_generator():
-        try:
-            while True:
-                # disconnect support: break if client disconnects
-                if await request.is_disconnected():
-                    break
-                data = await q.get()
-                yield f"data: {json.dumps(data)}\n\n"
-        finally:
-            try:
-                LEADS_SUBSCRIBERS.remove(q)
-            except Exception:
-                pass
+    Reconnecting clients send Last-Event-ID and get the leads they missed first.
+    """
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    s = _services(request)
+    events = s.lead_hub.stream(
+        request.is_disconnected,
+        last_event_id=request.headers.get("last-event-id"),
+        replay=lambda after: s.lead_store.iter_leads(after_id=after),
+    )
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/admin/executors.json")
+async def admin_executor_stats(request: Request):
+    """Queue depth, high-water marks and wait/run times of the disk/cpu/net pools."""
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return _services(request).executors.stats()
+
+@router.get("/admin/startup.json")
+async def admin_startup_report(request: Request):
+    """How long import, create_app and each lazily created subsystem took."""
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return startup_report(request.app)
 
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+@router.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Prometheus text format. Set METRICS_TOKEN to require ``Authorization: Bearer <token>``."""
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("authorization") != f"Bearer {token}" and not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 # Simple health
-@app.get("/health")
-def health():
+@router.get("/health")
+async def health():
     return {"status": "ok"}
+
+
+# Services of every app created in this process; the gauges below add them up
+_live_services: "weakref.WeakSet[Services]" = weakref.WeakSet()
+
+def _gauge(name: str, fn: Callable, default=0) -> Callable:
+    """Sum `fn(subsystem)` over live apps; subsystems that haven't been created yet count as 0."""
+    def read():
+        total = default
+        for s in list(_live_services):
+            sub = s.peek(name)
+            if sub is None:
+                continue
+            value = fn(sub)
+            if isinstance(total, dict):
+                total = {k: total.get(k, 0) + value.get(k, 0) for k in {**total, **value}}
+            else:
+                total += value
+        return total
+    return read
+
+def _executor_stat(field: str) -> Callable:
+    return _gauge("executors", lambda ex: {(e.name,): getattr(e, field) for e in ex}, {})
+
+# Live gauges read at scrape time
+for _name, _help, _fn, _labels in [
+    ("portfolio_sse_subscribers", "Connected admin lead-stream clients", _gauge("lead_hub", lambda hub: hub.subscriber_count), ()),
+    ("portfolio_executor_queued", "Calls waiting for a thread, per executor", _executor_stat("queued"), ("executor",)),
+    ("portfolio_executor_active", "Calls running, per executor", _executor_stat("active"), ("executor",)),
+    ("portfolio_page_cache_entries", "Rendered pages held in the page cache", _gauge("page_cache", len), ()),
+    ("portfolio_page_cache_lookups", "Page cache hits and misses since start",
+     _gauge("page_cache", lambda c: {("hit",): c.hits, ("miss",): c.misses}, {}), ("result",)),
+    ("portfolio_image_derivative_bytes", "Bytes held in the /img derivative cache", _gauge("derivatives", lambda c: c.total_bytes), ()),
+    ("portfolio_image_derivative_lookups", "/img derivative cache hits and misses since start",
+     _gauge("derivatives", lambda c: {("hit",): c.hits, ("miss",): c.misses}, {}), ("result",)),
+    ("portfolio_emails", "Emails sent / given up on since start",
+     _gauge("mailer", lambda m: {("sent",): m.sent, ("failed",): m.failed}, {}), ("result",)),
+]:
+    metrics.REGISTRY.register(metrics.CallbackGauge(_name, _help, _fn, _labels))
+
+
+def startup_report(app: FastAPI) -> dict:
+    s: Services = app.state.services
+    return {
+        "import_ms": IMPORT_MS,
+        "create_app_ms": app.state.create_app_ms,
+        "subsystems_ms": dict(s.init_ms),
+        "storage_recovery": s.peek("storage_report"),
+    }
+
+
+def create_app(config: Optional[Config] = None) -> FastAPI:
+    """Build the app. Nothing touches the disk here; subsystems start on first use."""
+    t0 = time.perf_counter()
+    config = config or Config.from_env()
+    app = FastAPI(title="Aman Singhal — Portfolio")
+    services = Services(config)
+    app.state.services = services
+
+    @app.exception_handler(ExecutorSaturated)
+    async def _executor_saturated(request: Request, exc: ExecutorSaturated):
+        logger.warning("Shedding %s %s: %s", request.method, request.url.path, exc)
+        return JSONResponse({"error": "busy"}, status_code=503, headers={"Retry-After": "1"})
+
+    @app.exception_handler(RateLimited)
+    async def _rate_limited(request: Request, exc: RateLimited):
+        metrics.RATE_LIMITED.labels(exc.limit or "other").inc()
+        logger.warning("Rate limited %s %s: %s", request.method, request.url.path, exc)
+        return JSONResponse({"error": "too many requests"}, status_code=429,
+                            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))})
+
+    # check_dir=False: the directory is only needed once a static file is requested
+    app.mount("/static", PrecompressedStaticFiles(directory=config.static_dir, check_dir=False), name="static")
+    app.include_router(router)
+    # oversized uploads get a 413 before Starlette spools the multipart body
+    app.add_middleware(UploadLimitMiddleware, limit_for=config.body_limit)
+
+    # Prometheus metrics: per-route latency (middleware), template/JSON/image/email timings
+    # (observed where they happen) and the live gauges above
+    _live_services.add(services)
+    # admins can add ?profile=1 to any URL to get collapsed stacks for a flamegraph
+    app.add_middleware(metrics.MetricsMiddleware, is_admin=lambda scope: _is_admin(Request(scope)))
+
+    @app.on_event("startup")
+    async def _report_startup():
+        await services.executors.disk.run(lambda: services.storage_report)
+        logger.info("Startup: %s", startup_report(app))
+
+    @app.on_event("shutdown")
+    async def _close_services():
+        await services.aclose()
+
+    app.state.create_app_ms = round((time.perf_counter() - t0) * 1000, 2)
+    return app
+
+
+_default_app: Optional[FastAPI] = None
+_default_lock = threading.Lock()
+
+def get_app() -> FastAPI:
+    """The process-wide app built from the environment (what ``uvicorn portfolio.app:app`` serves)."""
+    global _default_app
+    with _default_lock:
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+
+def __getattr__(name: str):
+    # `app` is created on first access, so importing this module has no side effects
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+IMPORT_MS = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 2)
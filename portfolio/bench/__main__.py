@@ -0,0 +1,74 @@
+"""Benchmark the portfolio app and print/save the results as JSON.
+
+Examples:
+  python -m portfolio.bench --projects 10000 --comments 100000 --leads 100000
+  python -m portfolio.bench --mode uvicorn --out bench.json
+  python -m portfolio.bench --baseline bench.json          # exit 1 on regressions
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+
+from . import datagen, harness
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test and latency benchmarks for the portfolio app")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--scenarios", default=",".join(harness.SCENARIOS),
+                        help="comma-separated subset of: " + ", ".join(harness.SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--subscribers", type=int, default=50, help="SSE connections for sse_fanout")
+    parser.add_argument("--events", type=int, default=20, help="leads published during sse_fanout")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (uvicorn mode)")
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--leads", type=int, default=10000)
+    parser.add_argument("--data-dir", type=Path, help="reuse/generate synthetic data here (default: a temp dir)")
+    parser.add_argument("--out", type=Path, help="write results JSON here")
+    parser.add_argument("--baseline", type=Path, help="compare against a saved results JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p95/req/s change before flagging")
+    parser.add_argument("--verbose", action="store_true", help="show uvicorn output")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(harness.SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    tmp = None
+    data_dir = args.data_dir
+    if data_dir is None:
+        tmp = tempfile.TemporaryDirectory(prefix="portfolio-bench-")
+        data_dir = Path(tmp.name)
+    try:
+        if not (data_dir / "projects.json").exists():
+            print(f"Generating data in {data_dir} ...", file=sys.stderr)
+            datagen.generate(data_dir, args.projects, args.comments, args.leads)
+        slug = (datagen.hot_slugs(args.projects) or ["project-0"])[0]
+        results = asyncio.run(harness.run(
+            args.mode, scenarios, slug, data_dir, requests=args.requests, concurrency=args.concurrency,
+            subscribers=args.subscribers, events=args.events, workers=args.workers, verbose=args.verbose,
+        ))
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+    results["meta"].update(projects=args.projects, comments=args.comments, leads=args.leads)
+
+    status = 0
+    if args.baseline:
+        results["comparison"] = harness.compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        status = 1 if results["comparison"]["regressions"] else 0
+    text = json.dumps(results, indent=2)
+    if args.out:
+        args.out.write_text(text + "\n")
+    print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Synthetic data for benchmarks.
+
+`generate` writes a complete data directory (``profile.json``, ``projects.json``,
+``comments_<slug>.jsonl`` logs and ``leads.jsonl``) in the same on-disk formats
+the app's stores use, so ``PORTFOLIO_DATA_DIR=<dir>`` runs the app against it.
+Records are streamed to disk, so 1M comments or leads don't need 1M dicts in memory.
+
+Run: python -m portfolio.bench.datagen DIR [--projects N] [--comments N] [--leads N]
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+import argparse
+import json
+import random
+import shutil
+
+REAL_DATA = Path(__file__).resolve().parent.parent / "data"
+
+WORDS = (
+    "pipeline service cache index stream batch ledger query cluster schema event queue "
+    "dashboard reconciliation booking analytics ranking ingestion gateway scheduler "
+    "report export search payment invoice model feature storage replica shard"
+).split()
+TECH = ["Python", "FastAPI", "PostgreSQL", "MySQL", "Kafka", "Elasticsearch", "Docker",
+        "Terraform", "S3", "Redis", "Pandas", "NumPy", "Kibana", "React", "Go"]
+NAMES = ["Asha", "Ben", "Chen", "Dana", "Eli", "Farah", "Gus", "Hana", "Ivan", "Jo"]
+
+
+def _sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def make_project(rng: random.Random, i: int) -> dict:
+    title = " ".join(w.capitalize() for w in rng.sample(WORDS, 3))
+    return {
+        "title": f"{title} {i}",
+        "slug": f"project-{i}",
+        "summary": _sentence(rng, 14),
+        "details": " ".join(_sentence(rng, 12) for _ in range(3)),
+        "tech": rng.sample(TECH, rng.randint(2, 5)),
+        "image": "/static/img/transaction-master.svg",
+        "link": "",
+    }
+
+
+def hot_slugs(projects: int, hot: int = 10) -> list:
+    """Slugs that receive the generated comments (benchmarks read these)."""
+    return [f"project-{i}" for i in range(min(projects, hot))]
+
+
+def generate(data_dir: Path, projects: int = 1000, comments: int = 10000, leads: int = 10000,
+             hot: int = 10, seed: int = 1, profile: Optional[Path] = None) -> dict:
+    """Write a synthetic data directory; returns the record counts written."""
+    rng = random.Random(seed)
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(profile or REAL_DATA / "profile.json", data_dir / "profile.json")
+
+    with (data_dir / "projects.json").open("w") as fh:
+        fh.write("[\n")
+        for i in range(projects):
+            fh.write(("," if i else "") + json.dumps(make_project(rng, i)) + "\n")
+        fh.write("]\n")
+
+    # comments spread over the first `hot` projects, timestamps strictly increasing per slug
+    slugs = hot_slugs(projects, hot)
+    start = datetime(2024, 1, 1)
+    handles = {s: (data_dir / f"comments_{s}.jsonl").open("w") for s in slugs}
+    try:
+        for i in range(comments if slugs else 0):
+            slug = slugs[i % len(slugs)]
+            entry = {"name": rng.choice(NAMES), "comment": _sentence(rng, 10),
+                     "ts": (start + timedelta(seconds=i)).isoformat()}
+            handles[slug].write(json.dumps(entry) + "\n")
+    finally:
+        for fh in handles.values():
+            fh.close()
+
+    with (data_dir / "leads.jsonl").open("w") as fh:
+        for i in range(1, leads + 1):
+            name = rng.choice(NAMES)
+            entry = {"name": name, "email": f"{name.lower()}{i}@example.com", "message": _sentence(rng, 12),
+                     "ts": (start + timedelta(seconds=i)).isoformat(), "id": i}
+            fh.write(json.dumps(entry) + "\n")
+    return {"projects": projects, "comments": comments, "leads": leads, "hot_slugs": slugs}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic portfolio data directory")
+    parser.add_argument("data_dir", type=Path)
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--leads", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    print(json.dumps(generate(args.data_dir, args.projects, args.comments, args.leads, seed=args.seed)))
+
+
+if __name__ == "__main__":
+    main()
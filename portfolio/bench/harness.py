@@ -0,0 +1,288 @@
+"""Load-test scenarios, drivers and result comparison.
+
+Each HTTP scenario is driven by `concurrency` workers sharing a fixed request
+budget, either in-process through ``httpx.ASGITransport`` (no network, measures
+the app itself) or over TCP against a local uvicorn started on the synthetic
+data. `sse_fanout` measures publish-to-delivery latency of the admin lead
+stream. Results are plain dicts of p50/p95/p99/mean/max latency (ms), req/s and
+error counts, so they can be saved as JSON and compared against a baseline.
+"""
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent.parent
+ADMIN = {"_is_admin": "1"}
+SEARCH_TERMS = ["pipe", "cache", "ledger query", "stream", "booking analytics", "python", "sea"]
+
+HTTP_SCENARIOS = ("home", "projects", "search", "comments_get", "comments_post", "contact_burst")
+SCENARIOS = HTTP_SCENARIOS + ("sse_fanout",)
+
+
+# -- stats ---------------------------------------------------------------------
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    lat = sorted(x * 1000 for x in latencies)
+    return {
+        "requests": len(lat),
+        "errors": errors,
+        "rps": round(len(lat) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(lat, 50), 3),
+        "p95_ms": round(percentile(lat, 95), 3),
+        "p99_ms": round(percentile(lat, 99), 3),
+        "mean_ms": round(sum(lat) / len(lat), 3) if lat else 0.0,
+        "max_ms": round(lat[-1], 3) if lat else 0.0,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.10) -> dict:
+    """Per-scenario deltas; a scenario regresses if p95 rose or req/s fell by more than `threshold`."""
+    out = {"threshold": threshold, "scenarios": {}, "regressions": []}
+    for name, cur in current.get("scenarios", {}).items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        p95 = cur["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0.0
+        rps = cur["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+        regressed = p95 > threshold or rps < -threshold
+        out["scenarios"][name] = {
+            "p95_ms": [base["p95_ms"], cur["p95_ms"]], "p95_change": round(p95, 3),
+            "rps": [base["rps"], cur["rps"]], "rps_change": round(rps, 3),
+            "regression": regressed,
+        }
+        if regressed:
+            out["regressions"].append(name)
+    return out
+
+
+# -- scenarios -----------------------------------------------------------------
+def request_factory(name: str, slug: str) -> Callable[[int], tuple]:
+    """Return ``i -> (method, url, kwargs)`` for HTTP scenario `name`."""
+    if name == "home":
+        return lambda i: ("GET", "/", {})
+    if name == "projects":
+        return lambda i: ("GET", "/projects", {})
+    if name == "search":
+        return lambda i: ("GET", "/projects/search", {"params": {"q": SEARCH_TERMS[i % len(SEARCH_TERMS)]}})
+    if name == "comments_get":
+        return lambda i: ("GET", f"/projects/{slug}/comments", {})
+    if name == "comments_post":
+        return lambda i: ("POST", f"/projects/{slug}/comments", {"data": {"name": "Bench", "comment": f"comment {i}"}})
+    if name == "contact_burst":
+        return lambda i: ("POST", "/contact", {
+            "data": {"name": "Bench", "email": f"bench{i}@example.com", "message": f"hello {i}"},
+            "headers": {"hx-request": "true"},
+        })
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+async def drive(client: httpx.AsyncClient, make_request: Callable[[int], tuple], requests: int,
+                concurrency: int, warmup: int = 10) -> dict:
+    for i in range(min(warmup, requests)):
+        method, url, kwargs = make_request(i)
+        await client.request(method, url, **kwargs)
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = make_request(i)
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(method, url, **kwargs)
+                failed = r.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - t0)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def sse_fanout_inprocess(hub, subscribers: int, events: int) -> dict:
+    """Publish `events` leads to `subscribers` streams of `hub`; latency is publish -> delivery."""
+    latencies: List[float] = []
+    ready = asyncio.Event()
+    started_subs = 0
+
+    async def never_disconnected():
+        return False
+
+    async def consume():
+        nonlocal started_subs
+        seen = 0
+        async for chunk in hub.stream(never_disconnected):
+            if chunk.startswith("retry"):
+                started_subs += 1
+                if started_subs == subscribers:
+                    ready.set()
+                continue
+            if "data: " in chunk:
+                entry = json.loads(chunk.split("data: ", 1)[1])
+                latencies.append(time.perf_counter() - entry["sent"])
+                seen += 1
+                if seen == events:
+                    return
+
+    tasks = [asyncio.ensure_future(consume()) for _ in range(subscribers)]
+    await asyncio.wait_for(ready.wait(), 10)
+    started = time.perf_counter()
+    for i in range(events):
+        hub.publish({"id": None, "name": "Bench", "sent": time.perf_counter()})
+        await asyncio.sleep(0)
+    await asyncio.wait_for(asyncio.gather(*tasks), 60)
+    return summarize(latencies, subscribers * events - len(latencies), time.perf_counter() - started)
+
+
+async def sse_fanout_http(base_url: str, subscribers: int, events: int) -> dict:
+    """Same measurement over HTTP: N admin SSE connections, leads posted via /contact."""
+    latencies: List[float] = []
+    sent: Dict[str, float] = {}
+    connected = 0
+    ready = asyncio.Event()
+
+    async def consume(client: httpx.AsyncClient):
+        nonlocal connected
+        seen = 0
+        async with client.stream("GET", "/admin/lead_stream", cookies=ADMIN) as r:
+            async for line in r.aiter_lines():
+                if line.startswith("retry"):
+                    connected += 1
+                    if connected == subscribers:
+                        ready.set()
+                elif line.startswith("data: "):
+                    entry = json.loads(line[6:])
+                    if entry.get("message") in sent:
+                        latencies.append(time.perf_counter() - sent[entry["message"]])
+                        seen += 1
+                        if seen == events:
+                            return
+
+    limits = httpx.Limits(max_connections=subscribers + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        tasks = [asyncio.ensure_future(consume(client)) for _ in range(subscribers)]
+        await asyncio.wait_for(ready.wait(), 30)
+        started = time.perf_counter()
+        for i in range(events):
+            message = f"sse bench {i} {started}"
+            sent[message] = time.perf_counter()
+            await client.post("/contact", data={"name": "Bench", "email": "sse@example.com", "message": message},
+                              headers={"hx-request": "true"})
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), 60)
+        except asyncio.TimeoutError:
+            for t in tasks:
+                t.cancel()
+    return summarize(latencies, subscribers * events - len(latencies), time.perf_counter() - started)
+
+
+# -- targets -------------------------------------------------------------------
+def load_app(data_dir: Optional[Path]):
+    """An app serving `data_dir` (None = the configured one), without rate limits: all load comes from one IP."""
+    from portfolio.app import Config, create_app
+    overrides = {"rate_limit_backend": "off"}
+    if data_dir is not None:
+        overrides["data_dir"] = data_dir
+    app = create_app(Config.from_env(**overrides))
+    import logging
+    logging.getLogger("portfolio").setLevel(logging.ERROR)  # one "no email provider" warning per lead otherwise
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def uvicorn_server(data_dir: Path, workers: int = 1, verbose: bool = False):
+    """Run ``uvicorn portfolio.app:app`` on a free port for the duration of the block."""
+    port = _free_port()
+    env = {**os.environ, "PORTFOLIO_DATA_DIR": str(data_dir), "RATE_LIMIT_BACKEND": "off"}  # see load_app
+    out = None if verbose else subprocess.DEVNULL
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "portfolio.app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=str(ROOT), env=env, stdout=out, stderr=out,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 120  # large synthetic lead logs are scanned at startup
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not become healthy")
+                await asyncio.sleep(0.2)
+        yield base_url
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+async def run(mode: str, scenarios: List[str], slug: str, data_dir: Optional[Path], requests: int = 500,
+              concurrency: int = 20, subscribers: int = 50, events: int = 20, workers: int = 1,
+              verbose: bool = False) -> dict:
+    """Run `scenarios` and return ``{"meta": ..., "scenarios": {name: summary}}``."""
+    results: Dict[str, dict] = {}
+    meta = {
+        "mode": mode, "requests": requests, "concurrency": concurrency,
+        "python": platform.python_version(), "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    if mode == "inprocess":
+        app = load_app(data_dir)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=ADMIN) as client:
+            for name in scenarios:
+                if name == "sse_fanout":
+                    results[name] = await sse_fanout_inprocess(app.state.services.lead_hub, subscribers, events)
+                else:
+                    results[name] = await drive(client, request_factory(name, slug), requests, concurrency)
+    elif mode == "uvicorn":
+        if data_dir is None:
+            raise ValueError("uvicorn mode needs a data directory")
+        meta["workers"] = workers
+        async with uvicorn_server(data_dir, workers, verbose) as base_url:
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+                for name in scenarios:
+                    if name == "sse_fanout":
+                        results[name] = await sse_fanout_http(base_url, subscribers, events)
+                    else:
+                        results[name] = await drive(client, request_factory(name, slug), requests, concurrency)
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    return {"meta": meta, "scenarios": results}
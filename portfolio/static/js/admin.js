@@ -32,17 +32,97 @@ document.addEventListener('DOMContentLoaded', function() {
       };
       xhr.onload = function() {
         if (xhr.status >= 200 && xhr.status < 400) {
-          // reload to show new uploads
-          window.location.reload();
+          // variants are generated in the background; poll the job, then reload to show them
+          let job = null;
+          try { job = JSON.parse(xhr.responseText); } catch (err) { /* non-JSON reply */ }
+          if (job && job.status_url) {
+            pollJob(job.status_url);
+          } else {
+            window.location.reload();
+          }
         } else {
           alert('Upload failed');
         }
       };
       xhr.open('POST', form.action, true);
+      xhr.setRequestHeader('Accept', 'application/json');
       xhr.send(fd);
     });
   }
 
+  function pollJob(url) {
+    const statusEl = document.getElementById('upload-status');
+    if (statusEl) statusEl.textContent = 'Processing image…';
+    fetch(url, {credentials: 'same-origin'}).then(r => r.json()).then(function(job) {
+      if (job.state === 'done') {
+        window.location.reload();
+      } else if (job.state === 'failed') {
+        if (statusEl) statusEl.textContent = 'Image processing failed: ' + (job.error || 'unknown error');
+      } else {
+        setTimeout(() => pollJob(url), 1000);
+      }
+    }).catch(() => setTimeout(() => pollJob(url), 2000));
+  }
+
+  // Bulk import: upload the batch, then follow per-item progress over SSE
+  const bulkForm = document.getElementById('bulk-form');
+  if (bulkForm) {
+    bulkForm.addEventListener('submit', function(e) {
+      e.preventDefault();
+      const list = document.getElementById('bulk-items');
+      const wrap = document.getElementById('bulk-progress');
+      const bar = document.getElementById('bulk-progress-bar');
+      list.textContent = 'Uploading…';
+      fetch(bulkForm.action, {method: 'POST', body: new FormData(bulkForm), credentials: 'same-origin'})
+        .then(r => r.json().then(body => ({ok: r.ok, body})))
+        .then(function({ok, body}) {
+          if (!ok) { list.textContent = 'Import failed: ' + (body.detail || 'unknown error'); return; }
+          list.textContent = '';
+          wrap.style.display = 'block';
+          const rows = {};
+          const es = new EventSource(body.events_url);
+          es.onmessage = function(ev) {
+            const event = JSON.parse(ev.data);
+            if (event.type === 'item') {
+              const item = event.item;
+              if (!rows[item.name]) {
+                rows[item.name] = document.createElement('li');
+                list.appendChild(rows[item.name]);
+              }
+              rows[item.name].textContent = item.name + ': ' + item.state + (item.error ? ' (' + item.error + ')' : '');
+              rows[item.name].dataset.state = item.state;
+              const finished = Object.values(rows).filter(li => li.dataset.state !== 'queued').length;
+              bar.style.width = Math.round(finished / Math.max(body.items, 1) * 100) + '%';
+            } else if (event.type === 'done') {
+              es.close();
+              bar.style.width = '100%';
+              const result = event.summary.result || {};
+              const li = document.createElement('li');
+              li.className = 'fw-bold';
+              li.textContent = result.error ? 'Manifest failed: ' + result.error :
+                'Done: ' + (result.updated || []).length + ' updated, ' + (result.created || []).length + ' created';
+              list.appendChild(li);
+            }
+          };
+        });
+    });
+  }
+
+  // Lead totals from the precomputed aggregates
+  const statsEl = document.getElementById('lead-stats');
+  if (statsEl) {
+    fetch('/admin/api/leads/stats?days=7&hours=0&top=3', {credentials: 'same-origin'})
+      .then(r => r.ok ? r.json() : null)
+      .then(function(stats) {
+        if (!stats) return;
+        const domains = stats.top_domains.map(d => d.domain + ' (' + d.count + ')').join(', ');
+        statsEl.textContent = stats.total + ' leads · ' + stats.windows['24h'] + ' in 24h · ' +
+          stats.windows['7d'] + ' in 7 days · ' + stats.senders.repeat + ' repeat senders' +
+          (domains ? ' · top domains: ' + domains : '');
+      })
+      .catch(() => {});
+  }
+
   // SSE for leads
   if (window.EventSource) {
     try {
@@ -1,7 +1,42 @@
 import pytest
 from httpx import AsyncClient
-from portfolio.app import app, LEADS_PATH, projects, DATA_DIR
+import portfolio.app as app_module
+from portfolio.app import Config, app, create_app
+from portfolio.utils.leads import JsonlLeadStore, SqliteLeadStore, migrate_json_leads
+from portfolio.utils.leadstats import LeadIndex
+from portfolio.utils.comments import CommentStore
+from portfolio.utils.catalog import ProjectCatalog
+from portfolio.utils.datasource import JsonSource
+from portfolio.utils.search import SearchIndex
+from portfolio.utils.media import MediaManifest
+from portfolio.utils.images import DerivativeCache, ImageMetaStore, ImagePipeline, process_image
+from portfolio.utils.uploads import UploadTooLarge, store_upload
+from portfolio.utils.assets import build_assets, minify_css
+from portfolio.utils.pagecache import pick_encoding
+from portfolio.utils.executors import BoundedExecutor, ExecutorSaturated
+from portfolio.utils.ratelimit import RateLimited, limiter_from_env, parse_rate
+from portfolio.utils.coalesce import WriteCoalescer
+from portfolio.utils.datasource import file_stamp
+from portfolio.utils.storage import VersionConflict, atomic_write_text, recover
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import os
 import json
+import subprocess
+import sys
+from pathlib import Path
+
+services = app.state.services
+catalog = services.catalog
+
+
+@pytest.fixture
+def lead_store(tmp_path, monkeypatch):
+    store = JsonlLeadStore(tmp_path / "leads.jsonl")
+    monkeypatch.setattr(services, "lead_store", store)
+    yield store
+    store.close()
 
 @pytest.mark.asyncio
 async def test_index():
@@ -17,31 +52,147 @@ async def test_api_profile():
         assert "name" in r.json()
 
 @pytest.mark.asyncio
-async def test_contact_saves_lead(tmp_path):
-    # keep a backup of the leads file and restore after test
-    orig = LEADS_PATH.read_text()
-    try:
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            r = await ac.post("/contact", data={"name": "Test", "email": "t@example.com", "message": "hello"})
-            assert r.status_code in (200, 303)
-        leads = json.loads(LEADS_PATH.read_text())
-        assert any(l.get("email") == "t@example.com" for l in leads)
-    finally:
-        LEADS_PATH.write_text(orig)
+async def test_contact_saves_lead(lead_store):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/contact", data={"name": "Test", "email": "t@example.com", "message": "hello"})
+        assert r.status_code in (200, 303)
+    leads = list(lead_store.iter_leads())
+    assert any(l.get("email") == "t@example.com" for l in leads)
 
 @pytest.mark.asyncio
-async def test_contact_via_htmx_posts(tmp_path):
-    orig = LEADS_PATH.read_text()
-    try:
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            headers = {"hx-request": "true"}
-            r = await ac.post("/contact", data={"name": "Hx", "email": "hx@example.com", "message": "hi"}, headers=headers)
-            assert r.status_code == 200
-            assert "Thanks — your message was sent" in r.text
-        leads = json.loads(LEADS_PATH.read_text())
-        assert any(l.get("email") == "hx@example.com" for l in leads)
-    finally:
-        LEADS_PATH.write_text(orig)
+async def test_contact_via_htmx_posts(lead_store):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = {"hx-request": "true"}
+        r = await ac.post("/contact", data={"name": "Hx", "email": "hx@example.com", "message": "hi"}, headers=headers)
+        assert r.status_code == 200
+        assert "Thanks — your message was sent" in r.text
+    leads = list(lead_store.iter_leads())
+    assert any(l.get("email") == "hx@example.com" for l in leads)
+
+@pytest.mark.asyncio
+async def test_admin_leads_export(lead_store, monkeypatch):
+    monkeypatch.setenv('ADMIN_PASS', 's3cret')
+    lead_store.append({"name": "A", "email": "a@example.com", "message": "m", "ts": "2024-01-01T00:00:00"})
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        await ac.post('/admin/login', data={'password': 's3cret'})
+        r = await ac.get('/admin/leads.json')
+        assert r.status_code == 200
+        assert r.json()[0]["email"] == "a@example.com"
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_lead_index_updates_incrementally(tmp_path, backend):
+    from datetime import datetime
+    store = JsonlLeadStore(tmp_path / "leads.jsonl") if backend == "jsonl" else SqliteLeadStore(tmp_path / "l.sqlite3")
+    store.append_many([
+        {"name": "Ann", "email": "ann@Acme.io", "ts": "2024-03-01T09:00:00"},
+        {"name": "Bob", "email": "bob@example.com", "ts": "2024-03-09T10:30:00"},
+    ])
+    index = LeadIndex(store, check_interval=0)
+    assert index.refresh() == 2 and index.refresh() == 0  # nothing new: nothing re-read
+    store.append_many([{"name": "Ann", "email": "ann@acme.io", "ts": "2024-03-10T11:00:00"},
+                       {"name": "Cy", "email": "cy@acme.io", "ts": "2024-03-10T11:05:00"}])
+    stats = index.stats(days=3, hours=2, now=datetime(2024, 3, 10, 11, 30))
+    assert stats["total"] == 4 and stats["last_id"] == 4
+    assert stats["windows"] == {"24h": 2, "7d": 3, "30d": 4}
+    assert stats["daily"] == [{"day": "2024-03-08", "count": 0}, {"day": "2024-03-09", "count": 1}, {"day": "2024-03-10", "count": 2}]
+    assert stats["hourly"][-1] == {"hour": "2024-03-10T11", "count": 2}
+    assert stats["top_domains"][0] == {"domain": "acme.io", "count": 3}
+    assert stats["senders"] == {"unique": 3, "repeat": 1}
+    leads, next_before, total = index.query(domain="acme.io", limit=2)
+    assert [l["name"] for l in leads] == ["Cy", "Ann"]
+    assert total == 3
+    assert next_before == 3
+    leads, next_before, total = index.query(domain="acme.io", before=next_before, limit=2)
+    assert [l["id"] for l in leads] == [1]
+    assert next_before is None
+    assert total == 3  # the whole result set, not what's left after the cursor
+    leads, next_before, total = index.query(before=4, limit=1)
+    assert [l["id"] for l in leads] == [3]
+    assert next_before == 3
+    assert total == 4
+    assert index.query(q="ann")[2] is None  # ad-hoc filters aren't counted
+    assert [l["id"] for l in index.query(since="2024-03-09", until="2024-03-09")[0]] == [2]
+    assert [l["id"] for l in index.query(since="2024-03-10")[0]] == [4, 3]
+    assert [l["id"] for l in index.query(email="ANN@acme.io")[0]] == [3, 1]
+    assert index.query(q="bo")[0][0]["email"] == "bob@example.com"
+    if backend == "jsonl":
+        store.compact()  # rewrites the log: the index notices and rebuilds
+        assert index.refresh() == 4 and len(index) == 4
+    store.close()
+
+@pytest.mark.asyncio
+async def test_admin_lead_api(lead_store, monkeypatch, tmp_path):
+    monkeypatch.setattr(services, "lead_index", LeadIndex(lead_store))
+    monkeypatch.setattr(services, "rate_limiter", limiter_from_env(tmp_path, "off"))
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        assert (await ac.get('/admin/api/leads/stats')).status_code == 403
+        for i in range(3):
+            await ac.post('/contact', data={'name': f'N{i}', 'email': f'n{i}@corp.test', 'message': 'hi'})
+        stats = (await ac.get('/admin/api/leads/stats', cookies={'_is_admin': '1'})).json()
+        assert stats["total"] == 3 and stats["windows"]["24h"] == 3  # save_leads updated the index
+        page = (await ac.get('/admin/api/leads?domain=corp.test&limit=2', cookies={'_is_admin': '1'})).json()
+        assert [l["name"] for l in page["leads"]] == ["N2", "N1"] and page["total"] == 3
+        rest = (await ac.get(f'/admin/api/leads?domain=corp.test&before={page["next_before"]}', cookies={'_is_admin': '1'})).json()
+        assert [l["name"] for l in rest["leads"]] == ["N0"] and rest["next_before"] is None
+
+@pytest.mark.asyncio
+async def test_admin_exports_stream_ndjson_and_csv(lead_store, monkeypatch, tmp_path):
+    monkeypatch.setattr("portfolio.utils.export.CHUNK_SIZE", 1)  # one chunk per row
+    lead_store.append_many([{"name": f"N{i}", "email": f"n{i}@x.test", "message": "a,\"b\"", "ts": f"2024-01-0{i + 1}"}
+                            for i in range(3)])
+    comments = CommentStore(tmp_path)
+    monkeypatch.setattr(services, "comment_store", comments)
+    comments.add_many("demo", [{"name": "C", "comment": "one", "ts": "2024-01-01T00:00:00"},
+                               {"name": "D", "comment": "two", "ts": "2024-01-02T00:00:00"}])
+    admin = {'_is_admin': '1'}
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        assert (await ac.get('/admin/export/leads.ndjson')).status_code == 307
+        r = await ac.get('/admin/export/leads.ndjson?fields=id,email&after=1&limit=1', cookies=admin)
+        assert r.headers["content-type"] == "application/x-ndjson"
+        assert r.text == '{"id": 2, "email": "n1@x.test"}\n'
+        r = await ac.get('/admin/export/leads.csv', cookies=admin)
+        assert r.text.splitlines()[0] == "id,ts,name,email,message"
+        assert r.text.splitlines()[1] == '1,2024-01-01,N0,n0@x.test,"a,""b"""'
+        assert [l["id"] for l in (await ac.get('/admin/leads.json', cookies=admin)).json()] == [1, 2, 3]
+        r = await ac.get('/admin/export/comments/demo.ndjson?after=2024-01-01T00:00:00', cookies=admin)
+        assert [json.loads(line)["comment"] for line in r.text.splitlines()] == ["two"]
+        assert (await ac.get('/admin/export/comments/demo.xml', cookies=admin)).status_code == 404
+        assert (await ac.get('/admin/export/leads.csv?fields=a-b', cookies=admin)).status_code == 400
+        # the disk pool filling up mid-download doesn't cut the file short
+        encode = app_module.encode
+
+        def saturating_encode(*args):
+            for i, chunk in enumerate(encode(*args)):
+                if i == 1:
+                    monkeypatch.setattr(services.executors.disk, "max_queue", 0)
+                yield chunk
+        monkeypatch.setattr(app_module, "encode", saturating_encode)
+        r = await ac.get('/admin/export/leads.ndjson', cookies=admin)
+        assert [json.loads(line)["id"] for line in r.text.splitlines()] == [1, 2, 3]
+
+def test_lead_store_migration_and_reopen(tmp_path):
+    legacy = tmp_path / "leads.json"
+    legacy.write_text(json.dumps([{"name": "Old", "email": "o@example.com", "message": "x", "ts": "t"}]))
+    store = JsonlLeadStore(tmp_path / "leads.jsonl")
+    assert migrate_json_leads(legacy, store) == 1
+    assert not legacy.exists()
+    store.append({"name": "New", "email": "n@example.com", "message": "y", "ts": "t"})
+    store.close()
+    # a torn trailing line must not break reopening
+    with (tmp_path / "leads.jsonl").open("a") as fh:
+        fh.write('{"name": "torn')
+    reopened = JsonlLeadStore(tmp_path / "leads.jsonl")
+    assert [l["id"] for l in reopened.iter_leads()] == [1, 2]
+    assert reopened.append({"name": "Next"})["id"] == 3
+    reopened.close()
+
+def test_sqlite_lead_store(tmp_path):
+    store = SqliteLeadStore(tmp_path / "leads.sqlite3")
+    store.append_many([{"name": "A", "ts": "1"}, {"name": "B", "ts": "2"}])
+    assert store.count() == 2
+    assert [l["name"] for l in store.iter_leads(after_id=1)] == ["B"]
+    assert json.loads(store.export_json())[0]["name"] == "A"
+    store.close()
 
 @pytest.mark.asyncio
 async def test_admin_login_and_upload(tmp_path, monkeypatch):
@@ -57,7 +208,9 @@ async def test_admin_login_and_upload(tmp_path, monkeypatch):
         with img.open('rb') as fh:
             r2 = await ac.post('/admin/upload', data={'slug': 'transaction-master', 'assign': 'on'}, files={'file': ('t.png', fh, 'image/png')})
             assert r2.status_code in (200, 303)
-    # cleanup not necessary because uploads are in static/img/uploads
+    # uploads are stored content-addressed as t.<sha12>.png
+    for p in services.config.uploads_dir.glob('t.*.png'):
+        p.unlink()
 
 @pytest.mark.asyncio
 async def test_projects_search():
@@ -65,19 +218,621 @@ async def test_projects_search():
         r = await ac.get('/projects/search?q=flight')
         assert r.status_code == 200
         assert 'flight' in r.text.lower()
+        # prefix match on the term being typed, restricted by tag
+        r = await ac.get('/projects/search?q=elastic&tag=Python')
+        assert 'transaction-master' in r.text
+        assert 'flight-booking-app' not in r.text
+
+@pytest.fixture
+def comment_store(tmp_path, monkeypatch):
+    store = CommentStore(tmp_path)
+    monkeypatch.setattr(services, "comment_store", store)
+    return store
 
 @pytest.mark.asyncio
-async def test_project_comment_submit(tmp_path):
-    slug = projects[0].get('slug') if projects else 'transaction-master'
-    path = DATA_DIR / f"comments_{slug}.json"
-    orig = path.read_text() if path.exists() else '[]'
-    try:
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            r = await ac.post(f"/projects/{slug}/comments", data={'name':'Tester','comment':'nice work'})
+async def test_project_comment_submit(comment_store):
+    slug = catalog.projects[0].get('slug') if len(catalog) else 'transaction-master'
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post(f"/projects/{slug}/comments", data={'name':'Tester','comment':'nice work'})
+        assert r.status_code == 200
+        assert 'Tester' in r.text
+    comments, _ = comment_store.page(slug)
+    assert any(c.get('name')=='Tester' for c in comments)
+
+@pytest.mark.asyncio
+async def test_project_comments_pagination(comment_store):
+    slug = 'transaction-master'
+    for i in range(5):
+        comment_store.add(slug, {"name": f"user{i}", "comment": "c", "ts": "2024-01-01T00:00:00"})
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.get(f"/projects/{slug}/comments?limit=2")
+        assert 'user4' in r.text and 'user3' in r.text and 'user2' not in r.text
+        assert 'Load older comments' in r.text
+    page, cursor = comment_store.page(slug, limit=2)
+    older, _ = comment_store.page(slug, before=cursor, limit=2)
+    assert [c["name"] for c in older] == ["user2", "user1"]
+
+def test_comment_store_reads_beyond_tail(tmp_path):
+    store = CommentStore(tmp_path, tail_size=2)
+    for i in range(6):
+        store.add("p", {"name": str(i), "ts": f"2024-01-01T00:00:0{i}"})
+    page, cursor = store.page("p", before="2024-01-01T00:00:03", limit=2)
+    assert [c["name"] for c in page] == ["2", "1"]
+    assert cursor == "2024-01-01T00:00:01"
+    # a second store instance (another worker) sees the same log
+    assert CommentStore(tmp_path).count("p") == 6
+
+def test_project_catalog_indexes_and_persists(tmp_path):
+    path = tmp_path / "projects.json"
+    path.write_text(json.dumps([
+        {"slug": "a", "title": "A", "tech": ["Python", "Kafka"]},
+        {"slug": "b", "title": "B", "tech": ["Python"]},
+    ]))
+    cat = ProjectCatalog(path)
+    assert cat.get("b")["title"] == "B"
+    assert cat.tags == ["Kafka", "Python"]
+    assert [p["slug"] for p in cat.by_tag("Python")] == ["a", "b"]
+    before = cat.projects
+    cat.update("a", tech=["Go"])
+    assert cat.tags == ["Go", "Python"]
+    assert before[0]["tech"] == ["Python", "Kafka"]  # old snapshot untouched
+    assert json.loads(path.read_text())[0]["tech"] == ["Go"]
+    assert cat.update("missing", title="x") is None
+
+def test_catalog_and_json_source_follow_the_file(tmp_path):
+    path = tmp_path / "projects.json"
+    path.write_text(json.dumps([{"slug": "a", "title": "A"}]))
+    cat = ProjectCatalog(path, check_interval=0)
+    v = cat.version
+    other = ProjectCatalog(path, check_interval=0)  # e.g. another worker
+    other.update("a", title="A2")
+    assert cat.get("a")["title"] == "A2" and cat.version == v + 1
+    assert cat.version == v + 1  # unchanged file: no reparse
+
+    profile = tmp_path / "profile.json"
+    profile.write_text('{"name": "x"}')
+    src = JsonSource(profile, default={}, check_interval=0)
+    snap = src.snapshot
+    assert snap.data == {"name": "x"} and snap.version == 1
+    profile.write_text('{"name": "y"}')
+    os.utime(profile, ns=(0, snap.stamp[1] + 1))  # make sure the mtime moves on coarse clocks
+    assert src.data == {"name": "y"} and src.version == 2 and src.etag != snap.etag
+    profile.write_text("{broken")
+    os.utime(profile, ns=(0, snap.stamp[1] + 2))
+    assert src.data == {"name": "y"}  # last good snapshot is kept
+
+def test_search_index_ranking_and_prefix():
+    idx = SearchIndex(cache_size=2)
+    idx.build([
+        {"slug": "a", "title": "Kafka pipelines", "summary": "stream data", "tech": ["Python"]},
+        {"slug": "b", "title": "Dashboards", "summary": "kafka metrics in kibana", "tech": ["Kibana"]},
+        {"slug": "c", "title": "Mobile", "summary": "app", "tech": [".NET"]},
+    ])
+    assert [p["slug"] for p in idx.search("kafka")] == ["a", "b"]  # title outweighs summary
+    assert [p["slug"] for p in idx.search("kafka kib")] == ["b"]
+    assert [p["slug"] for p in idx.search(".net")] == ["c"]
+    assert idx.search("nothing") == []
+    assert "kafka" in idx.to_dict()["postings"]
+
+def test_pick_encoding_honours_q_values():
+    assert pick_encoding("gzip, br", ("br", "gzip")) == "br"
+    assert pick_encoding("gzip;q=1, br;q=0.5", ("br", "gzip")) == "gzip"
+    assert pick_encoding("br;q=0, gzip", ("br", "gzip")) == "gzip"
+    assert pick_encoding("*, gzip;q=0", ("gzip",)) is None
+    assert pick_encoding("*;q=0.1", ("br", "gzip")) == "br"
+    assert pick_encoding("identity", ("br", "gzip")) is None
+    assert pick_encoding("", ("gzip",)) is None
+
+@pytest.mark.asyncio
+async def test_public_pages_use_etag_cache(monkeypatch, tmp_path):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.get("/projects/transaction-master", headers={"accept-encoding": "gzip"})
+        assert r.status_code == 200
+        assert r.headers["content-encoding"] == "gzip"
+        assert "Transaction Master" in r.text
+        etag = r.headers["etag"]
+        r = await ac.get("/projects/transaction-master", headers={"accept-encoding": "gzip;q=0, br;q=0"})
+        assert "content-encoding" not in r.headers
+        r = await ac.get("/projects/transaction-master", headers={"if-none-match": etag})
+        assert r.status_code == 304
+        # a catalog change invalidates the cached page
+        path = tmp_path / "projects.json"
+        path.write_text(json.dumps(catalog.projects))
+        monkeypatch.setattr(catalog, "path", path)
+        catalog.update("transaction-master", title="Transaction Master v2")
+        try:
+            r = await ac.get("/projects/transaction-master", headers={"if-none-match": etag})
             assert r.status_code == 200
-            assert 'Tester' in r.text
-        comments = json.loads(path.read_text())
-        assert any(c.get('name')=='Tester' for c in comments)
+            assert "Transaction Master v2" in r.text
+        finally:
+            monkeypatch.undo()
+            catalog.reload()
+
+@pytest.mark.asyncio
+async def test_api_json_is_serialized_once_per_version(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "projects.json").write_text(json.dumps([{"slug": "a", "title": "Ä"}]))
+    tmp_app = create_app(Config(data_dir=data))
+    s = tmp_app.state.services
+    async with AsyncClient(app=tmp_app, base_url="http://test") as ac:
+        r = await ac.get("/api/projects")
+        assert r.json() == [{"slug": "a", "title": "Ä"}]
+        assert r.headers["content-type"] == "application/json"
+        assert (await ac.get("/api/projects", headers={"if-none-match": r.headers["etag"]})).status_code == 304
+        assert s.page_cache.misses == 1
+        assert s.page_cache.hits == 1
+        s.catalog.update("a", title="B")  # new version: serialized again, new ETag
+        r2 = await ac.get("/api/projects", headers={"if-none-match": r.headers["etag"]})
+        assert r2.status_code == 200
+        assert r2.json()[0]["title"] == "B"
+        assert r2.headers["etag"] != r.headers["etag"]
+
+def test_media_manifest_incremental(tmp_path):
+    (tmp_path / "a.svg").write_text("<svg/>")
+    (tmp_path / "notes.txt").write_text("x")
+    m = MediaManifest(tmp_path, "/static/img", check_interval=0)
+    assert m.urls() == ["/static/img/a.svg"]
+    v = m.version
+    assert m.refresh() is False and m.version == v  # nothing changed on disk
+    (tmp_path / "b.png").write_bytes(b"png")
+    (tmp_path / "b-600.webp").write_bytes(b"webp")
+    m.refresh(force=True)
+    assert [e.name for e in m.entries()] == ["a.svg", "b.png"]
+    assert m.entries()[1].variants == {600: "/static/img/b-600.webp"}
+
+def test_image_pipeline_progressive_and_cached(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    src = tmp_path / "photo.png"
+    Image.new("RGB", (2000, 1000), "red").save(src)
+    pipeline = ImagePipeline(tmp_path / "out", tmp_path / "cache.json", url_prefix="/u", max_workers=1)
+    done = []
+    try:
+        job_id = pipeline.submit(src, on_done=done.append)
+        pipeline._pool.shutdown(wait=True)  # wait for the worker to finish
+        job = pipeline.status(job_id)
+        assert job["state"] == "done"
+        record = job["result"]
+        assert record["src"] == record["sizes"]["detail"] == "/u/photo-1200.webp"
+        # never upscaled: 2000px wide source gets 600/1200/1800, hero maps to 1800
+        assert record["widths"] == [600, 1200, 1800] and (record["width"], record["height"]) == (2000, 1000)
+        assert "/u/photo-600.webp 600w" in record["formats"][-1]["srcset"]
+        assert record["placeholder"].startswith("data:image/webp;base64,")
+        assert pipeline.meta.get("/u/photo-600.webp") is record
+        with Image.open(tmp_path / "out" / "photo-600.webp") as im:
+            assert im.size == (600, 300)
+        # same bytes again: served from the content-hash cache without a worker
+        again = pipeline.status(pipeline.submit(src))
+        assert again["state"] == "done" and again.get("cached")
+        assert len(done) == 1
+    finally:
+        pipeline.shutdown()
+
+def test_process_image_small_source_not_upscaled(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    src = tmp_path / "small.png"
+    Image.new("RGB", (400, 200), "blue").save(src)
+    record = process_image(src, tmp_path / "out", url_prefix="/u")
+    assert record["widths"] == [400]
+    assert set(record["sizes"].values()) == {"/u/small-400.webp"}
+    assert not (tmp_path / "out" / "small-600.webp").exists()
+
+def test_store_upload_streams_and_dedupes(tmp_path):
+    first = store_upload(io.BytesIO(b"x" * 10), tmp_path, "../a.PNG", chunk_size=3)
+    assert first.path.parent == tmp_path
+    assert first.path.name.startswith("a.") and first.path.suffix == ".png"
+    again = store_upload(io.BytesIO(b"x" * 10), tmp_path, "b.png")
+    assert again.deduplicated and again.path == first.path
+    with pytest.raises(UploadTooLarge):
+        store_upload(io.BytesIO(b"y" * 10), tmp_path, "c.png", max_bytes=5, chunk_size=4)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [first.path.name]  # no temp files left behind
+
+@pytest.mark.asyncio
+async def test_oversized_upload_is_rejected_before_parsing(tmp_path):
+    tmp_app = create_app(Config(data_dir=tmp_path / "data", static_dir=tmp_path / "static", max_upload_bytes=1000))
+    admin = {'_is_admin': '1'}
+    async with AsyncClient(app=tmp_app, base_url="http://test", cookies=admin) as ac:
+        r = await ac.post('/admin/upload', data={'slug': 'x'}, files={'file': ('a.png', b'x' * 100_000, 'image/png')})
+        assert r.status_code == 413
+
+        async def chunks():  # no Content-Length: counted while it arrives
+            yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\n\r\n'
+            for _ in range(100):
+                yield b"x" * 1000
+        r = await ac.post('/admin/upload', content=chunks(), headers={'content-type': 'multipart/form-data; boundary=b'})
+        assert r.status_code == 413
+    assert not (tmp_path / "static" / "img" / "uploads").exists()
+
+@pytest.mark.asyncio
+async def test_fingerprinted_assets_are_precompressed_and_immutable(tmp_path):
+    import shutil
+    static = tmp_path / "static"
+    shutil.copytree(app_module.BASE_DIR / "static" / "css", static / "css")
+    tmp_app = create_app(Config(static_dir=static))
+    assert tmp_app.state.services.assets.static_url('css/styles.css') == '/static/css/styles.css'  # nothing built yet
+    assert not (static / "dist").exists()  # serving never writes into static/
+    build_assets(static)
+    tmp_app = create_app(Config(static_dir=static))
+    css_url = tmp_app.state.services.assets.static_url('css/styles.css')
+    assert css_url.startswith('/static/dist/styles.')
+    assert css_url.endswith('.css')
+    async with AsyncClient(app=tmp_app, base_url="http://test") as ac:
+        page = await ac.get('/about')
+        assert css_url in page.text
+        r = await ac.get(css_url, headers={'accept-encoding': 'gzip'})
+        assert r.status_code == 200
+        assert r.headers['content-encoding'] == 'gzip'
+        assert r.headers['content-type'].startswith('text/css')
+        assert 'immutable' in r.headers['cache-control']
+        assert '.project-card:hover{' in r.text
+        r = await ac.get(css_url, headers={'accept-encoding': 'identity'})
+        assert 'content-encoding' not in r.headers
+        assert r.headers['vary'] == 'Accept-Encoding'
+        # unfingerprinted files keep default caching
+        r = await ac.get('/static/css/styles.css')
+        assert 'immutable' not in r.headers.get('cache-control', '')
+        assert 'vary' not in r.headers
+
+def test_minify_css_keeps_selector_colons():
+    assert minify_css("/* c */ a :hover , b > i {\n  color : red ;\n}") == "a :hover,b>i{color : red}"
+
+def test_minify_css_leaves_strings_alone():
+    assert minify_css('a::after { content: "a , b" ; }') == 'a::after{content: "a , b"}'
+    assert minify_css("[title='x > y'] , i { }") == "[title='x > y'],i{}"
+    assert minify_css('b { content: "/* not a comment */" }') == 'b{content: "/* not a comment */"}'
+
+@pytest.mark.asyncio
+async def test_bounded_executor_sheds_load_and_reports_depth():
+    import threading
+    gate = threading.Event()
+    ex = BoundedExecutor("disk", max_workers=1, max_queue=1)
+    try:
+        running = asyncio.ensure_future(ex.run(gate.wait))
+        waiting = asyncio.ensure_future(ex.run(lambda: "done"))
+        while ex.active != 1 or ex.queued != 1:
+            await asyncio.sleep(0.01)
+        with pytest.raises(ExecutorSaturated):
+            await ex.run(lambda: None)
+        gate.set()
+        assert await waiting == "done" and await running
+        stats = ex.stats()
+        assert stats["max_queued"] == 1 and stats["rejected"] == 1 and stats["completed"] == 2
+        assert stats["queued"] == 0 and stats["active"] == 0
     finally:
-        path.write_text(orig)
+        gate.set()
+        ex.shutdown()
+
+@pytest.mark.asyncio
+async def test_executor_stats_are_admin_only():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        assert (await ac.get('/admin/executors.json')).status_code == 403
+        r = await ac.get('/admin/executors.json', cookies={'_is_admin': '1'})
+        assert set(r.json()) == {'disk', 'cpu', 'net'}
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_route_latency_and_gauges():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        await ac.get('/projects/transaction-master')
+        await ac.get('/no-such-page')
+        r = await ac.get('/metrics')
+    assert r.status_code == 200 and r.headers['content-type'].startswith('text/plain')
+    text = r.text
+    assert 'portfolio_http_request_duration_seconds_count{method="GET",route="/projects/{slug}",status="200"}' in text
+    assert 'route="unmatched",status="404"' in text
+    assert 'portfolio_template_render_seconds_bucket{template="project_detail.html",le="+Inf"}' in text
+    assert 'portfolio_sse_subscribers 0' in text
+    assert 'portfolio_executor_queued{executor="disk"}' in text
+
+@pytest.mark.asyncio
+async def test_profile_param_returns_collapsed_stacks_for_admins_only():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.get('/projects?profile=1')
+        assert '<html' in r.text.lower()  # ignored for anonymous users
+        r = await ac.get('/projects?noprofile=1', cookies={'_is_admin': '1'})
+        assert '<html' in r.text.lower()  # only the profile parameter itself counts
+        r = await ac.get('/projects?profile=1', cookies={'_is_admin': '1'})
+    assert r.status_code == 200 and r.headers['content-type'].startswith('text/plain')
+    line = r.text.splitlines()[0]
+    stack, count = line.rsplit(' ', 1)
+    assert int(count) >= 1 and ';' in stack
+
+@pytest.mark.asyncio
+async def test_profiling_a_stream_stops_after_the_cap():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await asyncio.wait_for(ac.get('/admin/lead_stream?profile=1&seconds=0.2', cookies={'_is_admin': '1'}), 10)
+    assert r.status_code == 200
+    assert r.headers['content-type'].startswith('text/plain')
+    assert r.text.strip()
+
+def test_importing_the_module_has_no_side_effects(tmp_path):
+    env = {**os.environ, "PORTFOLIO_DATA_DIR": str(tmp_path / "data")}
+    code = "import portfolio.app as m; assert '_default_app' in vars(m) and m._default_app is None"
+    subprocess.run([sys.executable, "-c", code], check=True, env=env, cwd=str(Path(app_module.__file__).parents[1]))
+    assert not (tmp_path / "data").exists()
+
+@pytest.mark.asyncio
+async def test_create_app_starts_subsystems_on_first_use(tmp_path):
+    profile = dict(services.profile, name="Tmp")
+    (tmp_path / "profile.json").write_text(json.dumps(profile))
+    (tmp_path / "projects.json").write_text("[]")
+    tmp_app = create_app(Config(data_dir=tmp_path, jinja_cache_dir=str(tmp_path / "jinja")))
+    s = tmp_app.state.services
+    assert s.init_ms == {}
+    async with AsyncClient(app=tmp_app, base_url="http://test") as ac:
+        assert (await ac.get('/api/profile')).json()["name"] == "Tmp"
+        assert (await ac.get('/about')).status_code == 200
+        assert (await ac.get('/admin/startup.json')).status_code == 403
+        report = (await ac.get('/admin/startup.json', cookies={'_is_admin': '1'})).json()
+    assert {"profile_source", "catalog", "templates", "page_cache"} <= set(report["subsystems_ms"])
+    assert not {"mailer", "image_pipeline", "lead_hub", "lead_store"} & set(s.init_ms)
+    assert report["import_ms"] > 0 and report["create_app_ms"] >= 0
+    assert any((tmp_path / "jinja").iterdir())  # compiled templates were cached
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_rate_limiter_token_buckets(tmp_path, backend):
+    limiter = limiter_from_env(tmp_path, backend)
+    try:
+        ip, email = ("ip:1", parse_rate("2/60", "ip")), ("email:a", parse_rate("1/60", "email"))
+        limiter.acquire([ip, email])
+        with pytest.raises(RateLimited) as exc:
+            limiter.acquire([ip, email])
+        assert exc.value.key == "email:a" and 0 < exc.value.retry_after <= 60
+        assert exc.value.limit == "email"
+        # the refused request didn't spend the IP's token
+        limiter.acquire([ip, ("email:b", parse_rate("1/60"))])
+        with pytest.raises(RateLimited):
+            limiter.acquire([ip])
+        limiter.acquire([("ip:1", None)])  # None = unlimited
+    finally:
+        limiter.close()
+
+@pytest.mark.asyncio
+async def test_contact_is_rate_limited_per_email(lead_store, monkeypatch):
+    monkeypatch.setitem(services.config.rate_limits, "contact_ip", "off")
+    monkeypatch.setitem(services.config.rate_limits, "contact_email", "1/600")
+    data = {"name": "Spam", "email": "Spam@example.com", "message": "buy"}
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        assert (await ac.post("/contact", data=data)).status_code == 303
+        r = await ac.post("/contact", data={**data, "email": " spam@example.com"})
+        exposed = (await ac.get("/metrics")).text
+    assert r.status_code == 429 and int(r.headers["retry-after"]) > 0
+    assert lead_store.count() == 1
+    # labelled by the configured limit, never by the submitted address
+    assert 'portfolio_rate_limited_total{limit="contact_email"}' in exposed
+    assert "spam@example.com" not in exposed
+
+@pytest.mark.asyncio
+async def test_contact_burst_is_one_write_and_one_digest(lead_store, monkeypatch):
+    monkeypatch.setitem(services.config.rate_limits, "contact_ip", "off")
+    sent = []
+    async def fake_send(s, entries):
+        sent.append([e["email"] for e in entries])
+    monkeypatch.setattr(app_module, "send_contact_email", fake_send)
+    writes = services.lead_writes
+    batches = writes.batches
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        rs = await asyncio.gather(*(ac.post("/contact", data={"name": f"B{i}", "email": f"b{i}@example.com", "message": "hi"})
+                                    for i in range(5)))
+    assert [r.status_code for r in rs] == [303] * 5
+    assert writes.batches == batches + 1
+    assert sorted(sent[0]) == [f"b{i}@example.com" for i in range(5)] and len(sent) == 1
+    assert sorted(l["id"] for l in lead_store.iter_leads()) == [1, 2, 3, 4, 5]
+
+@pytest.mark.asyncio
+async def test_write_coalescer_reports_per_item_errors():
+    async def flush(items):
+        return [ValueError(i) if i < 0 else i * 2 for i in items]
+    writes = WriteCoalescer(flush, window=0.01)
+    results = await asyncio.gather(writes.submit(1), writes.submit(-1), writes.submit(3), return_exceptions=True)
+    assert results[0] == 2 and isinstance(results[1], ValueError) and results[2] == 6
+    assert writes.batches == 1
+
+def test_atomic_write_checks_the_expected_version(tmp_path):
+    path = tmp_path / "data.json"
+    atomic_write_text(path, "[1]", expected=None)
+    stamp = file_stamp(path)
+    atomic_write_text(path, "[2]", expected=stamp)
+    with pytest.raises(VersionConflict):
+        atomic_write_text(path, "[3]", expected=stamp)
+    assert path.read_text() == "[2]"
+    assert [p.name for p in tmp_path.iterdir()] == ["data.json"]  # no temp files left behind
+
+def test_workers_sharing_files_dont_lose_writes(tmp_path):
+    # two stores on one directory stand in for two uvicorn workers
+    a, b = JsonlLeadStore(tmp_path / "leads.jsonl"), JsonlLeadStore(tmp_path / "leads.jsonl")
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: (a if i % 2 else b).append({"n": i}), range(40)))
+        ids = [l["id"] for l in a.iter_leads()]
+        assert sorted(ids) == list(range(1, 41))
+        a.compact()
+        assert b.append({"n": 40})["id"] == 41
+    finally:
+        a.close()
+        b.close()
+
+    c1, c2 = CommentStore(tmp_path), CommentStore(tmp_path)
+    for i in range(6):
+        (c1 if i % 2 else c2).add("p", {"comment": str(i), "ts": "2024-01-01T00:00:00"})
+    items, _ = c1.page("p", limit=10)
+    assert [c["comment"] for c in items] == ["5", "4", "3", "2", "1", "0"]
+    assert len({c["ts"] for c in items}) == 6
+
+    path = tmp_path / "projects.json"
+    path.write_text(json.dumps([{"slug": "a"}, {"slug": "b"}]))
+    w1, w2 = ProjectCatalog(path), ProjectCatalog(path)
+    w1.update("a", title="A")
+    w2.update("b", title="B")
+    assert [p.get("title") for p in ProjectCatalog(path).projects] == ["A", "B"]
+    with pytest.raises(VersionConflict):
+        w1.update("a", expected_version=w1._version - 1, title="stale")
+
+def test_image_meta_store_sees_records_from_other_workers(tmp_path):
+    reader = ImageMetaStore(tmp_path / "image_cache.json", check_interval=0)
+    assert reader.get("/u/a-600.webp") is None
+    record = {"src": "/u/a-600.webp", "formats": {}, "sizes": {"600": "/u/a-600.webp"}}
+    ImageMetaStore(tmp_path / "image_cache.json").put("abc", record)  # another worker, or the bulk importer
+    assert reader.get("/u/a-600.webp") == record
+    assert reader.by_digest("abc") == record
+
+def test_storage_recovery_after_a_crash(tmp_path):
+    stale = tmp_path / ".projects.json.abc.tmp"
+    stale.write_text("[")
+    os.utime(stale, (0, 0))
+    fresh = tmp_path / ".profile.json.def.tmp"  # may belong to a worker writing right now
+    fresh.write_text("{")
+    (tmp_path / "leads.jsonl").write_text('{"id": 1}\n{"id": 2, "na')
+    (tmp_path / "profile.json").write_text("{broken")
+    report = recover(tmp_path)
+    assert report == {"removed_tmp": [stale.name], "truncated": {"leads.jsonl": 13}, "unreadable": ["profile.json"]}
+    assert fresh.exists() and (tmp_path / "leads.jsonl").read_text() == '{"id": 1}\n'
+
+@pytest.mark.asyncio
+async def test_img_endpoint_resizes_on_demand_and_caches(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    static = tmp_path / "static"
+    (static / "img").mkdir(parents=True)
+    Image.new("RGB", (1000, 500), "green").save(static / "img" / "photo.jpg")
+    tmp_app = create_app(Config(data_dir=tmp_path / "data", static_dir=static))
+    cache = tmp_app.state.services.derivatives
+    async with AsyncClient(app=tmp_app, base_url="http://test") as ac:
+        # identical concurrent requests share one render
+        rs = await asyncio.gather(*(ac.get('/img/photo.jpg?w=300', headers={'accept': 'image/webp,*/*'}) for _ in range(4)))
+        r = rs[0]
+        assert [x.status_code for x in rs] == [200] * 4
+        assert r.headers['content-type'] == 'image/webp' and r.headers['vary'] == 'Accept'
+        assert 'max-age' in r.headers['cache-control']
+        assert Image.open(io.BytesIO(r.content)).size == (320, 160)  # w rounded up to a fixed step
+        assert len(cache) == 1 and cache.misses == 4 and cache.renders == 1
+        r2 = await ac.get('/img/photo.jpg?w=300', headers={'accept': 'image/webp', 'if-none-match': r.headers['etag']})
+        assert r2.status_code == 304
+        weak = await ac.get('/img/photo.jpg?w=300', headers={'accept': 'image/webp', 'if-none-match': 'W/' + r.headers['etag']})
+        assert weak.status_code == 304
+        star = await ac.get('/img/photo.jpg?w=300', headers={'accept': 'image/webp', 'if-none-match': '*'})
+        assert star.status_code == 304
+        other = await ac.get('/img/photo.jpg?w=300', headers={'accept': 'image/webp', 'if-none-match': r.headers['etag'][:-3] + '"'})
+        assert other.status_code == 200
+        r3 = await ac.get('/img/photo.jpg?w=4000&fmt=jpeg')
+        assert r3.headers['content-type'] == 'image/jpeg' and 'vary' not in r3.headers
+        assert Image.open(io.BytesIO(r3.content)).size == (1000, 500)  # never upscaled
+        assert (await ac.get('/img/../data/profile.json')).status_code == 404
+        assert (await ac.get('/img/missing.jpg')).status_code == 404
+        assert (await ac.get('/img/photo.jpg?fmt=gif')).status_code == 400
+
+def test_derivative_cache_evicts_least_recently_used(tmp_path):
+    pytest.importorskip("PIL.Image")
+    from PIL import Image
+    src = tmp_path / "src.png"
+    Image.effect_noise((400, 400), 64).convert("RGB").save(src)
+    cache = DerivativeCache(tmp_path / "cache", max_bytes=1, pool=lambda: pool)
+    with ThreadPoolExecutor(2) as pool:
+        digest = cache.source_digest(src)
+        keys = [cache.key(digest, w, "jpeg") for w in (160, 320)]
+        first = cache.render(keys[0], src, 160, "jpeg").result()
+        assert first.exists() and cache.lookup(keys[0]) == first
+        cache.render(keys[1], src, 320, "jpeg").result()
+    assert not first.exists() and cache.lookup(keys[0]) is None  # over budget: the older one went
+    assert len(cache) == 1 and cache.evictions == 1
+    assert len(DerivativeCache(tmp_path / "cache", 1 << 20, pool=None)) == 1  # index rebuilt from disk
+
+@pytest.mark.asyncio
+async def test_bulk_upload_processes_batch_and_writes_catalog_once(tmp_path):
+    import zipfile
+    Image = pytest.importorskip("PIL.Image")
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "projects.json").write_text(json.dumps([{"slug": "old", "title": "Old", "tech": ["Go"]}]))
+    tmp_app = create_app(Config(data_dir=data, static_dir=tmp_path / "static"))
+    s = tmp_app.state.services
+    version = s.catalog.version
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for name, color in (("a.png", "red"), ("b.jpg", "blue")):
+            buf = io.BytesIO()
+            Image.new("RGB", (700, 400), color).save(buf, "PNG" if name.endswith("png") else "JPEG")
+            zf.writestr(f"shots/{name}", buf.getvalue())
+        zf.writestr("__MACOSX/shots/._a.png", b"junk")
+        zf.writestr("manifest.json", json.dumps({"projects": [
+            {"slug": "old", "image": "a.png"},
+            {"slug": "new", "title": "New", "tech": ["Rust"], "image": "b.jpg"},
+        ]}))
+    async with AsyncClient(app=tmp_app, base_url="http://test") as ac:
+        files = [("files", ("batch.zip", archive.getvalue(), "application/zip"))]
+        assert (await ac.post('/admin/bulk_upload', files=files)).status_code == 403
+        r = await ac.post('/admin/bulk_upload', files=files, cookies={'_is_admin': '1'})
+        assert r.status_code == 202 and r.json()["items"] == 2
+        body = (await ac.get(r.json()["events_url"], cookies={'_is_admin': '1'})).text
+        events = [json.loads(line[6:]) for line in body.splitlines() if line.startswith("data: ")]
+        assert events[-1]["type"] == "done"
+        assert [e["id"] for e in events] == list(range(1, len(events) + 1))
+        result = events[-1]["summary"]["result"]
+        assert result["updated"] == ["old"] and result["created"] == ["new"]
+        bad = await ac.post('/admin/bulk_upload', files=[("files", ("m.json", b"x", "text/plain"))],
+                            data={"manifest": "[{\"slug\": \"../x\"}]"}, cookies={'_is_admin': '1'})
+        assert bad.status_code == 400
+        uploads = sorted(s.config.uploads_dir.iterdir())
+        twice = io.BytesIO()
+        with zipfile.ZipFile(twice, "w") as zf:
+            for folder, color in (("a", "green"), ("b", "white")):
+                buf = io.BytesIO()
+                Image.new("RGB", (10, 10), color).save(buf, "PNG")
+                zf.writestr(f"{folder}/cover.png", buf.getvalue())
+        r = await ac.post('/admin/bulk_upload', files=[("files", ("twice.zip", twice.getvalue(), "application/zip"))],
+                          cookies={'_is_admin': '1'})
+        assert r.status_code == 400
+        assert "cover.png" in r.json()["detail"]
+    assert sorted(s.config.uploads_dir.iterdir()) == uploads  # the refused batch left no files behind
+    assert len(s.bulk_imports) == 1  # nor a job that would never finish
+    s.image_pipeline.shutdown()
+    assert s.catalog.version == version + 1  # both projects in one write
+    assert s.catalog.get("old")["image"].startswith("/static/img/uploads/a.")
+    assert s.catalog.get("new")["tech"] == ["Rust"] and s.catalog.by_tag("Rust")
+    assert json.loads((data / "projects.json").read_text())[1]["slug"] == "new"
+
+def test_static_export_rebuilds_only_pages_that_depend_on_a_changed_template(tmp_path, monkeypatch, capsys):
+    import importlib.util
+    import shutil
+    root = Path(__file__).resolve().parents[2]
+    spec = importlib.util.spec_from_file_location("export_static", root / "scripts" / "export_static.py")
+    export = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(export)
+    for name in ("templates", "static", "data"):
+        shutil.copytree(root / "portfolio" / name, tmp_path / "portfolio" / name, ignore=shutil.ignore_patterns("dist"))
+    docs = tmp_path / "docs"
+    paths = {"ROOT": tmp_path, "TEMPLATES": tmp_path / "portfolio" / "templates", "STATIC": tmp_path / "portfolio" / "static",
+             "DATA": tmp_path / "portfolio" / "data", "IMAGE_META": tmp_path / "portfolio" / "data" / "image_cache.json",
+             "DOCS": docs, "MANIFEST": docs / ".build-manifest.json"}
+    for name, value in paths.items():
+        monkeypatch.setattr(export, name, value)
+
+    def build():
+        monkeypatch.setattr(export, "_env", None)  # the environment caches templates
+        export.main(["--jobs", "1"])
+        out = capsys.readouterr().out
+        return sorted(str(Path(line.split(" ", 1)[1]).relative_to(docs)) for line in out.splitlines()
+                      if line.startswith("Wrote ") and line.endswith(".html"))
+
+    first = build()
+    assert "index.html" in first
+    assert "contact.html" in first
+    detail = [p for p in first if p.startswith("projects/")]
+    assert detail
+    # the rewrite pass made links and assets relative for the static host
+    html = (docs / "contact.html").read_text()
+    assert 'href="styles.css"' in html
+    assert 'href="index.html"' in html
+    assert 'action="https://formspree.io/f/YOUR_FORM_ID"' in html
+    assert "hx-post" not in html
+    assert build() == []
+
+    # a new mtime with the same content is caught by the source hash
+    picture = paths["TEMPLATES"] / "_picture.html"
+    os.utime(picture, ns=(0, picture.stat().st_mtime_ns + 10**9))
+    assert build() == []
 
+    # only pages that import the macro are rebuilt
+    picture.write_text(picture.read_text() + "\n{# changed #}\n")
+    assert build() == sorted(["index.html", "projects.html"] + detail)
+    contact = paths["TEMPLATES"] / "contact.html"
+    contact.write_text(contact.read_text() + "\n{# changed #}\n")
+    assert build() == ["contact.html"]
@@ -0,0 +1,41 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+from portfolio.app import app
+from portfolio.bench import datagen, harness
+from portfolio.utils.catalog import ProjectCatalog
+from portfolio.utils.comments import CommentStore
+from portfolio.utils.leads import JsonlLeadStore
+
+
+def test_datagen_writes_store_formats(tmp_path):
+    counts = datagen.generate(tmp_path, projects=30, comments=45, leads=12, hot=3)
+    assert counts["hot_slugs"] == ["project-0", "project-1", "project-2"]
+    assert len(ProjectCatalog(tmp_path / "projects.json")) == 30
+    items, cursor = CommentStore(tmp_path).page("project-1", limit=10)
+    assert len(items) == 10 and cursor
+    assert sum(CommentStore(tmp_path).count(s) for s in counts["hot_slugs"]) == 45
+    store = JsonlLeadStore(tmp_path / "leads.jsonl")
+    try:
+        assert store.count() == 12
+        assert store.append({"name": "x"})["id"] == 13
+    finally:
+        store.close()
+
+
+def test_percentiles_and_baseline_comparison():
+    stats = harness.summarize([i / 1000 for i in range(1, 101)], errors=0, elapsed=2.0)
+    assert (stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], stats["rps"]) == (50, 95, 99, 50)
+    base = {"scenarios": {"home": {"p95_ms": 10.0, "rps": 100.0}, "search": {"p95_ms": 10.0, "rps": 100.0}}}
+    cur = {"scenarios": {"home": {"p95_ms": 10.5, "rps": 98.0}, "search": {"p95_ms": 13.0, "rps": 100.0}}}
+    result = harness.compare(cur, base, threshold=0.1)
+    assert result["regressions"] == ["search"]
+    assert result["scenarios"]["home"]["regression"] is False
+
+
+@pytest.mark.asyncio
+async def test_drive_reports_latency_in_process():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        stats = await harness.drive(client, harness.request_factory("home", "transaction-master"),
+                                    requests=20, concurrency=4, warmup=2)
+    assert stats["requests"] == 20 and stats["errors"] == 0
+    assert 0 < stats["p50_ms"] <= stats["p95_ms"] <= stats["max_ms"]
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+from portfolio.utils.pubsub import LeadHub
+
+
+@pytest.mark.asyncio
+async def test_publish_from_thread_and_drop_oldest():
+    hub = LeadHub(buffer_size=2)
+    sub = hub.subscribe()
+    t = threading.Thread(target=lambda: [hub.publish({"id": i}) for i in range(1, 4)])
+    t.start()
+    t.join()
+    await asyncio.sleep(0.01)  # let the call_soon_threadsafe callbacks run
+    items = await sub.next_batch(timeout=1)
+    assert [e["id"] for e in items] == [2, 3]
+    assert sub.dropped == 1
+    hub.unsubscribe(sub)
+    assert hub.subscriber_count == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_replays_then_heartbeats():
+    hub = LeadHub(heartbeat=0.01)
+    history = [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}, {"id": 3, "name": "c"}]
+    disconnected = False
+
+    async def is_disconnected():
+        return disconnected
+
+    gen = hub.stream(is_disconnected, last_event_id="1",
+                     replay=lambda after: (e for e in history if e["id"] > after))
+    assert await gen.__anext__() == "retry: 3000\n\n"
+    assert (await gen.__anext__()).startswith("id: 2\n")
+    assert (await gen.__anext__()).startswith("id: 3\n")
+    assert await gen.__anext__() == ": ping\n\n"
+    hub.publish({"id": 3, "name": "c"})  # already replayed -> skipped
+    hub.publish({"id": 4, "name": "d"})
+    await asyncio.sleep(0)
+    assert (await gen.__anext__()).startswith("id: 4\n")
+    await gen.aclose()
+    assert hub.subscriber_count == 0
+
+
+@pytest.mark.asyncio
+async def test_filetail_backend_picks_up_other_writers(tmp_path):
+    log = tmp_path / "leads.jsonl"
+    log.write_text("")
+    hub = LeadHub(backend="filetail", tail_path=log, tail_interval=0.01)
+    sub = hub.subscribe()
+    hub.publish({"id": 99})  # ignored: the log is the source of truth
+    await asyncio.sleep(0.02)
+    with log.open("a") as fh:  # e.g. written by another uvicorn worker
+        fh.write(json.dumps({"id": 1, "name": "x"}) + "\n")
+    items = await sub.next_batch(timeout=1)
+    assert [e["id"] for e in items] == [1]
+    hub.unsubscribe(sub)
+
+
+@pytest.mark.asyncio
+async def test_filetail_does_not_replay_a_compacted_log(tmp_path):
+    log = tmp_path / "leads.jsonl"
+    log.write_text("".join(json.dumps({"id": i}) + "\n" for i in (1, 2, 2, 2)))
+    hub = LeadHub(backend="filetail", tail_path=log, tail_interval=0.01)
+    sub = hub.subscribe()
+    await asyncio.sleep(0.02)
+    # compaction: a new file (new inode), shorter than before, then a new lead
+    tmp = tmp_path / "compacted"
+    tmp.write_text("".join(json.dumps({"id": i}) + "\n" for i in (1, 2, 3)))
+    os.replace(tmp, log)
+    items = await sub.next_batch(timeout=1)
+    assert [e["id"] for e in items] == [3]
+    # a same-size replacement is noticed too
+    tmp.write_text("".join(json.dumps({"id": i}) + "\n" for i in (2, 3, 4)))
+    os.replace(tmp, log)
+    items = await sub.next_batch(timeout=1)
+    assert [e["id"] for e in items] == [4]
+    hub.unsubscribe(sub)
@@ -0,0 +1,166 @@
+"""Static asset build: minify CSS, fingerprint and precompress CSS/JS.
+
+`build_assets` writes ``static/dist/<name>.<hash><ext>`` (plus ``.gz`` and, if
+the optional ``brotli`` package is installed, ``.br`` siblings) for every file
+in `ASSETS` and records the mapping in ``static/dist/manifest.json``. It runs
+at deploy time (``python -m portfolio.utils.assets``, also run by
+``scripts/export_static.py``), never while serving requests: the app only
+reads the manifest via `AssetManifest.load`, and without one `static_url`
+returns the plain ``/static/...`` paths.
+
+Templates call ``static_url('css/styles.css')`` to get the fingerprinted URL;
+`PrecompressedStaticFiles` serves the precompressed siblings of fingerprinted
+files and marks them as immutable. JS is fingerprinted and compressed but not
+minified; gzip/brotli already remove most of what a safe minifier could.
+"""
+from pathlib import Path
+from typing import Dict, Optional
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import stat
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+
+from .pagecache import pick_encoding
+from .storage import atomic_write_bytes
+
+try:  # optional dependency
+    import brotli as _brotli
+except Exception:
+    _brotli = None
+
+logger = logging.getLogger("portfolio")
+
+ASSETS = ("css/styles.css", "js/lightbox.js", "js/admin.js")
+DIST = "dist"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+# comments and quoted strings; everything between them is CSS code
+_CSS_TOKEN_RE = re.compile(r"/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'", re.S)
+
+
+def _squeeze_css(code: str) -> str:
+    code = re.sub(r"\s+", " ", code)
+    # outside strings, whitespace around these never matters (":" does, in selectors)
+    code = re.sub(r"\s*([{};,>])\s*", r"\1", code)
+    return code.replace(";}", "}")
+
+
+def minify_css(text: str) -> str:
+    """Drop comments and squeeze whitespace in CSS code; strings are copied verbatim."""
+    parts, code, pos = [], [], 0
+    for m in _CSS_TOKEN_RE.finditer(text):
+        code.append(text[pos:m.start()])
+        if m.group().startswith("/*"):
+            code.append(" ")  # a comment still separates tokens
+        else:
+            parts.append(_squeeze_css("".join(code)))
+            parts.append(m.group())
+            code = []
+        pos = m.end()
+    code.append(text[pos:])
+    parts.append(_squeeze_css("".join(code)))
+    return "".join(parts).strip()
+
+
+MINIFIERS = {".css": minify_css}
+
+
+def _write_if_changed(path: Path, data: bytes) -> None:
+    if path.exists() and path.read_bytes() == data:
+        return
+    atomic_write_bytes(path, data)  # workers building at the same time each use their own temp file
+
+
+def build_assets(static_dir: Path) -> Dict[str, str]:
+    """Build fingerprinted assets into ``static_dir/dist`` and return the manifest. Deploy step only."""
+    static_dir = Path(static_dir)
+    dist = static_dir / DIST
+    dist.mkdir(parents=True, exist_ok=True)
+    manifest: Dict[str, str] = {}
+    for rel in ASSETS:
+        src = static_dir / rel
+        if not src.exists():
+            continue
+        minify = MINIFIERS.get(src.suffix, lambda t: t)
+        body = minify(src.read_text()).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:10]
+        out = dist / f"{src.stem}.{digest}{src.suffix}"
+        if not out.exists():
+            _write_if_changed(out, body)
+            _write_if_changed(out.with_name(out.name + ".gz"), gzip.compress(body, compresslevel=9, mtime=0))
+            if _brotli is not None:
+                _write_if_changed(out.with_name(out.name + ".br"), _brotli.compress(body))
+        manifest[rel] = f"{DIST}/{out.name}"
+    live = {Path(v).name for v in manifest.values()}
+    for old in dist.iterdir():
+        # drop outdated fingerprints (and their .gz/.br siblings)
+        base = old.name[:-3] if old.name.endswith((".gz", ".br")) else old.name
+        if old.name != "manifest.json" and base not in live:
+            old.unlink(missing_ok=True)
+    _write_if_changed(dist / "manifest.json", json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return manifest
+
+
+class AssetManifest:
+    """Maps logical asset paths to fingerprinted URLs under `url_prefix`."""
+
+    def __init__(self, mapping: Optional[Dict[str, str]] = None, url_prefix: str = "/static"):
+        self.mapping = dict(mapping or {})
+        self.url_prefix = url_prefix.rstrip("/")
+
+    @classmethod
+    def load(cls, static_dir: Path, url_prefix: str = "/static") -> "AssetManifest":
+        try:
+            mapping = json.loads((Path(static_dir) / DIST / "manifest.json").read_text())
+        except Exception:
+            mapping = {}
+        return cls(mapping, url_prefix)
+
+    def static_url(self, path: str) -> str:
+        path = path.lstrip("/")
+        return f"{self.url_prefix}/{self.mapping.get(path, path)}"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves ``.br``/``.gz`` siblings of fingerprinted files and caches those forever.
+
+    Only paths under ``dist/`` have siblings, so other static files cost no extra stat calls.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        fingerprinted = path.replace(os.sep, "/").startswith(f"{DIST}/") and not path.endswith((".gz", ".br"))
+        if not fingerprinted:
+            return await super().get_response(path, scope)
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        # every variant of a fingerprinted file depends on Accept-Encoding, including the identity one
+        headers = {"Vary": "Accept-Encoding", "Cache-Control": IMMUTABLE}
+        if scope["method"] in ("GET", "HEAD"):
+            candidates = {"br": ".br", "gzip": ".gz"}
+            while True:
+                encoding = pick_encoding(accept, candidates)
+                if encoding is None:
+                    break
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + candidates.pop(encoding))
+                if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                    continue
+                media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                return FileResponse(full_path, stat_result=stat_result, media_type=media_type,
+                                    headers={**headers, "Content-Encoding": encoding})
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers.update(headers)
+        return response
+
+if __name__ == "__main__":
+    static = Path(__file__).resolve().parent.parent / "static"
+    print(json.dumps(build_assets(static), indent=2))
@@ -0,0 +1,242 @@
+"""Bulk import: many images plus a projects manifest in one request.
+
+Images (sent as files, inside zip archives, or both) are streamed to the
+uploads directory and all submitted to the image pipeline at once, so they are
+processed concurrently by its process pool. When the last one finishes, the
+manifest is applied to the catalog with a single `update_many`, so there's one
+write however many projects it touches. Progress is recorded as numbered
+events on the `BulkImport`. Its hub streams them over SSE, replaying what a
+late subscriber missed.
+
+A manifest is JSON, either a list of projects or ``{"projects": [...]}``:
+
+    [{"slug": "new-app", "title": "New app", "tech": ["Go"], "image": "shot.png"}]
+
+``image`` names a file in the batch; it is replaced by that upload's
+detail-size variant once processed. Unknown slugs create new projects. Items
+are keyed by file name, so a batch that repeats one (``a/cover.jpg`` and
+``b/cover.jpg``) is refused rather than letting one copy replace the other.
+"""
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional
+import json
+import logging
+import threading
+import time
+import uuid
+import zipfile
+
+from .comments import SLUG_RE
+from .pubsub import LeadHub
+from .uploads import StoredUpload, UploadTooLarge, store_upload
+
+logger = logging.getLogger("portfolio")
+
+BULK_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".avif", ".gif")
+MANIFEST_NAME = "manifest.json"
+
+
+class BulkError(ValueError):
+    """The batch itself is unusable (bad manifest, too many files); answered with a 400."""
+
+
+def parse_manifest(raw) -> Dict[str, dict]:
+    """``{slug: fields}`` from manifest JSON (bytes/str) or an already parsed list/dict."""
+    if isinstance(raw, (bytes, str)):
+        try:
+            raw = json.loads(raw)
+        except ValueError as exc:
+            raise BulkError(f"manifest is not valid JSON: {exc}")
+    projects = raw.get("projects") if isinstance(raw, dict) else raw
+    if not isinstance(projects, list):
+        raise BulkError("manifest must be a list of projects or {\"projects\": [...]}")
+    out: Dict[str, dict] = {}
+    for i, p in enumerate(projects):
+        if not isinstance(p, dict) or not isinstance(p.get("slug"), str) or not SLUG_RE.match(p["slug"]):
+            raise BulkError(f"manifest entry {i} needs a slug of letters, digits, '-' or '_'")
+        if "image" in p and not isinstance(p["image"], str):
+            raise BulkError(f"manifest entry {i}: image must be a file name")
+        fields = {k: v for k, v in p.items() if k != "slug"}
+        out[p["slug"]] = {**out.get(p["slug"], {}), **fields}
+    return out
+
+
+def is_bulk_image(name: str) -> bool:
+    name = Path(name).name
+    return not name.startswith(".") and Path(name).suffix.lower() in BULK_IMAGE_EXTS
+
+
+class BulkImport:
+    def __init__(self, job_id: str, heartbeat: float = 15.0):
+        self.id = job_id
+        self.created = time.time()
+        self.items: "OrderedDict[str, dict]" = OrderedDict()
+        self.manifest: Dict[str, dict] = {}
+        self.result: Optional[dict] = None
+        self.events: List[dict] = []
+        self.hub = LeadHub(buffer_size=1000, heartbeat=heartbeat)
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._written: List[Path] = []  # files this import created, removed again by discard()
+
+    # -- staging (request handler) -----------------------------------------------
+    def stage(self, name: str, src: BinaryIO, dest_dir: Path, max_bytes: Optional[int]) -> Optional[StoredUpload]:
+        """Stream one image into `dest_dir` as an item of this import; blocking."""
+        name = Path(name).name
+        if name in self.items:
+            raise BulkError(f"{name} appears more than once in the batch")
+        try:
+            stored = store_upload(src, dest_dir, name, max_bytes=max_bytes)
+        except UploadTooLarge as exc:
+            self._item(name, state="failed", error=str(exc))
+            return None
+        if not stored.deduplicated:
+            self._written.append(stored.path)
+        self._item(name, state="queued", path=stored.path, sha256=stored.sha256, size=stored.size)
+        return stored
+
+    def discard(self) -> None:
+        """Remove the files staged so far, for a batch that was refused before processing; blocking."""
+        for path in self._written:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                logger.exception("Bulk import %s: could not remove %s", self.id, path)
+        self._written = []
+
+    def stage_zip(self, src: BinaryIO, dest_dir: Path, max_bytes: Optional[int], max_files: int) -> Optional[bytes]:
+        """Stage every image in the zip `src`; returns its manifest.json, if any. Blocking."""
+        try:
+            archive = zipfile.ZipFile(src)
+        except zipfile.BadZipFile:
+            raise BulkError("not a valid zip archive")
+        manifest = None
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or "__MACOSX" in info.filename:
+                    continue
+                base = Path(info.filename).name
+                if base == MANIFEST_NAME:
+                    with archive.open(info) as fh:
+                        manifest = fh.read(1 << 20)
+                elif is_bulk_image(base):
+                    if len(self.items) >= max_files:
+                        raise BulkError(f"more than {max_files} images in one batch")
+                    # store_upload counts the bytes actually decompressed, so a zip bomb stops at max_bytes
+                    with archive.open(info) as fh:
+                        self.stage(base, fh, dest_dir, max_bytes)
+        return manifest
+
+    # -- processing (pipeline callback threads) ----------------------------------
+    def start(self, submit: Callable[[dict], None], finish: Callable[["BulkImport"], Optional[dict]]) -> None:
+        """Hand every queued item to `submit(item)`; `finish(self)` runs after the last completes.
+
+        `submit` must eventually call `complete(name, ...)` for its item.
+        """
+        self._finish = finish
+        queued = [item for item in self.items.values() if item["state"] == "queued"]
+        with self._lock:
+            self._remaining = len(queued) + 1  # +1 until every item has been submitted
+        for item in queued:
+            try:
+                submit(item)
+            except Exception as exc:
+                logger.exception("Bulk import %s: submitting %s failed", self.id, item["name"])
+                self.complete(item["name"], error=str(exc))
+        self._countdown()
+
+    def complete(self, name: str, record: Optional[dict] = None, error: Optional[str] = None) -> None:
+        if record:
+            self._item(name, state="done", url=record.get("src"), record=record)
+        else:
+            self._item(name, state="failed", error=error or "could not decode image")
+        self._countdown()
+
+    def _countdown(self) -> None:
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if not last:
+            return
+        try:
+            self.result = self._finish(self) or {}
+        except Exception as exc:
+            logger.exception("Bulk import %s: applying the manifest failed", self.id)
+            self.result = {"error": str(exc)}
+        self._event("done", summary=self.summary())
+
+    def resolved_changes(self) -> Dict[str, dict]:
+        """The manifest with ``image`` names replaced by processed URLs (dropped if that image failed)."""
+        changes = {}
+        for slug, fields in self.manifest.items():
+            fields = dict(fields)
+            if "image" in fields:
+                item = self.items.get(Path(fields["image"]).name)
+                if item is not None and item.get("url"):
+                    fields["image"] = item["url"]
+                else:
+                    del fields["image"]
+            if fields:
+                changes[slug] = fields
+        return changes
+
+    # -- progress ----------------------------------------------------------------
+    def _item(self, name: str, **fields) -> None:
+        with self._lock:
+            item = self.items.setdefault(name, {"name": name})
+            item.update(fields)
+            public = _public(item)
+        self._event("item", item=public)
+
+    def _event(self, kind: str, **data) -> None:
+        with self._lock:
+            event = {"id": len(self.events) + 1, "job": self.id, "type": kind, **data}
+            self.events.append(event)
+        self.hub.publish(event)
+
+    def events_after(self, after: int) -> List[dict]:
+        with self._lock:
+            return self.events[max(0, after):]
+
+    @property
+    def finished(self) -> bool:
+        return self.result is not None
+
+    def summary(self) -> dict:
+        with self._lock:
+            items = [_public(i) for i in self.items.values()]
+        counts: Dict[str, int] = {}
+        for item in items:
+            counts[item["state"]] = counts.get(item["state"], 0) + 1
+        return {"job": self.id, "finished": self.finished, "counts": counts, "items": items, "result": self.result}
+
+
+def _public(item: dict) -> dict:
+    return {k: v for k, v in item.items() if k not in ("path", "record")}
+
+
+class BulkImports:
+    """The most recent `max_jobs` imports, by id."""
+
+    def __init__(self, max_jobs: int = 20, heartbeat: float = 15.0):
+        self.max_jobs = max_jobs
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, BulkImport]" = OrderedDict()
+
+    def create(self) -> BulkImport:
+        """A new import; it isn't listed until `add` (once its batch was staged)."""
+        return BulkImport(uuid.uuid4().hex, heartbeat=self.heartbeat)
+
+    def add(self, job: BulkImport) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def get(self, job_id: str) -> Optional[BulkImport]:
+        return self._jobs.get(job_id)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
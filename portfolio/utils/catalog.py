@@ -0,0 +1,183 @@
+"""In-memory project catalog backed by ``projects.json``.
+
+`ProjectCatalog` owns the project list and keeps lookup indexes next to it:
+slug -> project, tag -> projects and the sorted tag list used by the projects
+page. Updates are copy-on-write (readers always see a consistent list) and are
+persisted atomically via a temp file + ``os.replace``, under the file's
+advisory lock so updates from several workers don't overwrite each other.
+Reads check the file's stamp every `check_interval` seconds and reload it when
+it was edited by hand or rewritten by another worker.
+"""
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import json
+import logging
+import threading
+import time
+
+from .datasource import file_stamp
+from .metrics import timed_json
+from .storage import VersionConflict, atomic_write_text, file_lock
+
+logger = logging.getLogger("portfolio")
+
+
+class ProjectCatalog:
+    def __init__(self, path: Path, check_interval: float = 1.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._listeners: List[Callable[["ProjectCatalog"], None]] = []
+        self._version = 0
+        self._stamp = None
+        self._checked_at = 0.0
+        self._projects: List[dict] = []
+        self._by_slug: Dict[str, dict] = {}
+        self._by_tag: Dict[str, List[dict]] = {}
+        self._tags: List[str] = []
+        self.reload()
+
+    # -- reads -------------------------------------------------------------
+    @property
+    def projects(self) -> List[dict]:
+        """Current project list. Treat it as read-only; use `update` to change it."""
+        self.refresh()
+        return self._projects
+
+    @property
+    def tags(self) -> List[str]:
+        self.refresh()
+        return self._tags
+
+    @property
+    def version(self) -> int:
+        """Bumped on every reload/update; page cache keys include it."""
+        self.refresh()
+        return self._version
+
+    def get(self, slug: str) -> Optional[dict]:
+        self.refresh()
+        return self._by_slug.get(slug)
+
+    def by_tag(self, tag: str) -> List[dict]:
+        self.refresh()
+        return self._by_tag.get(tag, [])
+
+    def __len__(self) -> int:
+        return len(self.projects)
+
+    def __iter__(self):
+        return iter(self.projects)
+
+    # -- writes ------------------------------------------------------------
+    def subscribe(self, fn: Callable[["ProjectCatalog"], None]) -> None:
+        """Call `fn(catalog)` after every reload or update (e.g. to refresh derived indexes)."""
+        self._listeners.append(fn)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reload if ``projects.json`` changed on disk. Returns True when it was reloaded."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        if file_stamp(self.path) == self._stamp:
+            return False
+        with self._lock:
+            if file_stamp(self.path) == self._stamp:
+                return False
+            self.reload()
+        return True
+
+    def reload(self) -> None:
+        with self._lock:
+            self._stamp = file_stamp(self.path)
+            self._checked_at = time.monotonic()
+            try:
+                with timed_json(self.path.name, "load"):
+                    data = json.loads(self.path.read_text())
+            except FileNotFoundError:
+                data = []
+            except Exception:
+                logger.exception("Failed to load %s", self.path)
+                data = None
+            if not isinstance(data, list):
+                if self._version:
+                    return  # keep serving the last good list instead of an empty site
+                data = []
+            self._swap(data)
+
+    def update(self, slug: str, expected_version: Optional[int] = None, **fields) -> Optional[dict]:
+        """Set `fields` on the project `slug`, reindex and persist. Returns the new project.
+
+        With `expected_version`, raise VersionConflict if the catalog moved on
+        since the caller read that version.
+        """
+        if self.get(slug) is None:
+            return None
+        return self.update_many({slug: fields}, create=False, expected_version=expected_version).get(slug)
+
+    def update_many(self, changes: Dict[str, dict], create: bool = True,
+                    expected_version: Optional[int] = None) -> Dict[str, dict]:
+        """Apply ``{slug: fields}`` as one transaction: a single reindex and a single write.
+
+        Unknown slugs become new projects (appended in order) if `create`, and
+        are skipped otherwise. Returns the resulting project for each changed slug.
+        """
+        with self._lock, file_lock(self.path):
+            for attempt in range(3):
+                self.refresh(force=True)  # apply the change to the latest file, not a stale copy
+                if expected_version is not None and self._version != expected_version:
+                    raise VersionConflict(self.path)
+                out: Dict[str, dict] = {}
+                new_list = []
+                for p in self._projects:
+                    slug = p.get("slug")
+                    if slug in changes and slug not in out:
+                        p = out[slug] = {**p, **changes[slug]}
+                    new_list.append(p)
+                if create:
+                    for slug, fields in changes.items():
+                        if slug not in out:
+                            out[slug] = {"slug": slug, **fields}
+                            new_list.append(out[slug])
+                if not out:
+                    return out
+                try:
+                    self._write(new_list)
+                except VersionConflict:
+                    # edited by hand (no lock) between our reload and the write; redo on top of it
+                    if attempt == 2 or expected_version is not None:
+                        raise
+                    continue
+                self._swap(new_list)
+                return out
+
+    def save(self) -> None:
+        with self._lock, file_lock(self.path):
+            self._write(self._projects)
+
+    def _write(self, projects: List[dict]) -> None:
+        """Persist `projects` unless the file changed since we last loaded it. Hold the file lock."""
+        with timed_json(self.path.name, "dump"):
+            text = json.dumps(projects, indent=2)
+        atomic_write_text(self.path, text, expected=self._stamp)
+        self._stamp = file_stamp(self.path)  # our own write doesn't need a reload
+
+    def _swap(self, projects: List[dict]) -> None:
+        by_slug = {}
+        by_tag: Dict[str, List[dict]] = {}
+        for p in projects:
+            if p.get("slug"):
+                by_slug.setdefault(p["slug"], p)
+            for t in p.get("tech", []):
+                by_tag.setdefault(t, []).append(p)
+        self._projects = projects
+        self._by_slug = by_slug
+        self._by_tag = by_tag
+        self._tags = sorted(by_tag)
+        self._version += 1
+        for fn in list(self._listeners):
+            try:
+                fn(self)
+            except Exception:
+                logger.exception("Catalog listener failed")
@@ -0,0 +1,77 @@
+"""Group writes that arrive close together into one flush.
+
+`WriteCoalescer.submit(item)` parks the caller until the current batch is
+flushed and then returns that item's result. A batch is flushed `window`
+seconds after its first item arrives, or as soon as it holds `max_items`.
+`flush(items)` is an async callable that returns one result per item; a result
+that is an exception is raised in that item's caller only, so one bad item
+doesn't fail the rest of the batch. If `flush` itself raises, every caller in
+the batch gets the error.
+"""
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger("portfolio")
+
+
+class WriteCoalescer:
+    def __init__(self, flush: Callable[[List[Any]], Awaitable[List[Any]]], window: float = 0.05,
+                 max_items: int = 100):
+        self.flush = flush
+        self.window = window
+        self.max_items = max_items
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.max_items:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await fut
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.flush([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"flush returned {len(results)} results for {len(batch)} items")
+        except BaseException as exc:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+            return
+        for (_, fut), result in zip(batch, results):
+            if fut.done():
+                continue  # the caller went away
+            if isinstance(result, BaseException):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+    async def drain(self) -> None:
+        """Flush whatever is pending now and wait for in-flight batches."""
+        self._start_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,189 @@
+"""Per-project comment storage.
+
+Each project gets an append-only ``comments_<slug>.jsonl`` log. For every slug
+we keep an in-memory index (timestamps + byte offsets) and a small tail cache
+of the newest comments, so the first page is served from memory and older
+pages are read with a single seek. Writers are serialized by a per-slug lock
+and, across workers, by the log's advisory file lock.
+"""
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import os
+import re
+import threading
+
+from .storage import atomic_write_text, file_lock, truncate_torn_tail
+
+logger = logging.getLogger("portfolio")
+
+SLUG_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class _SlugLog:
+    __slots__ = ("path", "lock", "ts", "offsets", "tail", "size")
+
+    def __init__(self, path: Path, tail_size: int):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ts: List[str] = []
+        self.offsets: List[int] = []
+        self.tail: deque = deque(maxlen=tail_size)
+        self.size = 0  # bytes of the log already indexed
+
+
+class CommentStore:
+    def __init__(self, data_dir: Path, tail_size: int = 50):
+        self.data_dir = Path(data_dir)
+        self.tail_size = tail_size
+        self._logs: Dict[str, _SlugLog] = {}
+        self._guard = threading.Lock()
+
+    def path_for(self, slug: str) -> Path:
+        return self.data_dir / f"comments_{slug}.jsonl"
+
+    def _log(self, slug: str) -> _SlugLog:
+        if not SLUG_RE.match(slug):
+            raise ValueError(f"Invalid slug: {slug!r}")
+        log = self._logs.get(slug)
+        if log is None:
+            with self._guard:
+                log = self._logs.get(slug)
+                if log is None:
+                    log = _SlugLog(self.path_for(slug), self.tail_size)
+                    with log.lock:
+                        with file_lock(log.path):
+                            self._migrate_legacy(slug, log.path)
+                        self._catch_up(log)
+                    self._logs[slug] = log
+        return log
+
+    def _migrate_legacy(self, slug: str, path: Path) -> None:
+        legacy = self.data_dir / f"comments_{slug}.json"
+        if path.exists() or not legacy.exists():
+            return
+        try:
+            entries = json.loads(legacy.read_text())
+        except Exception:
+            logger.exception("Could not parse %s for migration", legacy)
+            return
+        if not isinstance(entries, list) or not entries:
+            return
+        entries.sort(key=lambda c: c.get("ts", ""))
+        atomic_write_text(path, "".join(json.dumps(c) + "\n" for c in entries))
+        os.replace(legacy, legacy.with_name(legacy.name + ".migrated"))
+        logger.info("Migrated %d comments for %s", len(entries), slug)
+
+    def _catch_up(self, log: _SlugLog) -> None:
+        """Index lines appended since the last look (by us or another worker)."""
+        try:
+            size = log.path.stat().st_size
+        except FileNotFoundError:
+            return
+        if size <= log.size:
+            return
+        with log.path.open("rb") as fh:
+            fh.seek(log.size)
+            pos = log.size
+            for raw in fh:
+                if not raw.endswith(b"\n"):
+                    break  # incomplete line from a concurrent writer; pick it up next time
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    pos += len(raw)
+                    continue
+                log.ts.append(entry.get("ts", ""))
+                log.offsets.append(pos)
+                log.tail.append(entry)
+                pos += len(raw)
+        log.size = pos
+
+    def add(self, slug: str, entry: dict) -> dict:
+        return self.add_many(slug, [entry])[0]
+
+    def add_many(self, slug: str, entries: List[dict]) -> List[dict]:
+        """Append `entries` to the slug's log with a single write and fsync."""
+        log = self._log(slug)
+        with log.lock, file_lock(log.path):
+            truncate_torn_tail(log.path)  # a worker that crashed mid-append
+            self._catch_up(log)  # including comments other workers appended
+            out, last = [], log.ts[-1] if log.ts else ""
+            for entry in entries:
+                # timestamps double as pagination cursors, so keep them strictly increasing
+                if last and entry.get("ts", "") <= last:
+                    try:
+                        bumped = datetime.fromisoformat(last) + timedelta(microseconds=1)
+                        entry = {**entry, "ts": bumped.isoformat()}
+                    except ValueError:
+                        pass
+                out.append(entry)
+                last = entry.get("ts", "")
+            with log.path.open("ab") as fh:
+                fh.write("".join(json.dumps(e) + "\n" for e in out).encode("utf-8"))
+                fh.flush()
+                os.fsync(fh.fileno())
+            self._catch_up(log)
+        return out
+
+    def page(self, slug: str, before: Optional[str] = None, limit: int = 20) -> Tuple[List[dict], Optional[str]]:
+        """Return up to `limit` comments older than `before`, newest first, plus the next cursor."""
+        log = self._log(slug)
+        with log.lock:
+            self._catch_up(log)
+            total = len(log.ts)
+            end = bisect_left(log.ts, before) if before else total
+            start = max(0, end - limit)
+            tail_start = total - len(log.tail)
+            if start >= tail_start:
+                tail = list(log.tail)
+                items = tail[start - tail_start:end - tail_start]
+            else:
+                items = self._read_range(log, start, end)
+            cursor = log.ts[start] if start > 0 else None
+        items.reverse()
+        return items, cursor
+
+    def _read_range(self, log: _SlugLog, start: int, end: int) -> List[dict]:
+        out = []
+        if start >= end:
+            return out
+        with log.path.open("rb") as fh:
+            for offset in log.offsets[start:end]:
+                fh.seek(offset)
+                out.append(json.loads(fh.readline()))
+        return out
+
+    def iter_comments(self, slug: str, after: Optional[str] = None) -> Iterator[dict]:
+        """Comments oldest first, newer than the timestamp `after`, read sequentially from the log.
+
+        Covers what was in the log when iteration started, so a long export
+        doesn't chase concurrent appends.
+        """
+        log = self._log(slug)
+        with log.lock:
+            self._catch_up(log)
+            start = bisect_right(log.ts, after) if after else 0
+            if start >= len(log.offsets):
+                return
+            pos, end = log.offsets[start], log.size
+        with log.path.open("rb") as fh:
+            fh.seek(pos)
+            for raw in fh:
+                pos += len(raw)
+                if pos > end:
+                    break
+                try:
+                    yield json.loads(raw)
+                except ValueError:
+                    continue
+
+    def count(self, slug: str) -> int:
+        log = self._log(slug)
+        with log.lock:
+            self._catch_up(log)
+            return len(log.ts)
@@ -0,0 +1,110 @@
+"""Hot-reloadable JSON data files.
+
+`JsonSource` holds the parsed contents of a file as an immutable `Snapshot`
+with a version number. Reads check the file's (inode, mtime, size) stamp at
+most every `check_interval` seconds and, if it changed, parse the new file and
+swap the snapshot in atomically. Editing the file by hand, or a write from
+another uvicorn worker (which replaces the file, so its inode changes), is
+picked up without a restart and without reparsing on every request.
+
+`version` increases on every swap in this process; `etag` is a hash of the
+file contents, so it's the same in every worker for the same data.
+"""
+from pathlib import Path
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .metrics import timed_json
+
+logger = logging.getLogger("portfolio")
+
+
+def file_stamp(path: Path) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime_ns, size) of `path`, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class Snapshot(NamedTuple):
+    data: Any
+    version: int
+    etag: str
+    stamp: Optional[Tuple[int, int, int]]
+
+
+class JsonSource:
+    def __init__(self, path: Path, default: Any = None, check_interval: float = 1.0):
+        self.path = Path(path)
+        self.default = default
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Snapshot], None]] = []
+        self._checked_at = 0.0
+        self._snapshot = Snapshot(default, 0, "", None)
+        self.refresh(force=True)
+
+    def subscribe(self, fn: Callable[[Snapshot], None]) -> None:
+        """Call `fn(snapshot)` after every swap."""
+        self._listeners.append(fn)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reparse if the file changed on disk (`force` checks now, ignoring `check_interval`).
+
+        Returns True when a new snapshot was swapped in.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        stamp = file_stamp(self.path)
+        if stamp == self._snapshot.stamp and self._snapshot.version:
+            return False
+        with self._lock:
+            old = self._snapshot
+            if stamp == old.stamp and old.version:
+                return False  # another thread got here first
+            try:
+                raw = self.path.read_bytes()
+                with timed_json(self.path.name, "load"):
+                    data = json.loads(raw)
+            except FileNotFoundError:
+                raw, data = b"", self.default
+            except Exception:
+                # keep serving the last good snapshot; retry once the file changes again
+                logger.exception("Failed to load %s; keeping version %d", self.path, old.version)
+                self._snapshot = old._replace(stamp=stamp)
+                return False
+            snapshot = Snapshot(data, old.version + 1, hashlib.sha256(raw).hexdigest()[:16], stamp)
+            self._snapshot = snapshot
+        for fn in list(self._listeners):
+            try:
+                fn(snapshot)
+            except Exception:
+                logger.exception("Data source listener failed")
+        return True
+
+    @property
+    def snapshot(self) -> Snapshot:
+        self.refresh()
+        return self._snapshot
+
+    @property
+    def data(self) -> Any:
+        """Current parsed contents. Treat it as read-only; it is shared by every request."""
+        return self.snapshot.data
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def etag(self) -> str:
+        return self.snapshot.etag
@@ -0,0 +1,135 @@
+"""Bounded thread pools for the blocking work behind the async handlers.
+
+Handlers are ``async def`` and hand blocking calls to one of three pools, each
+sized separately so slow work of one kind can't starve the others:
+
+- ``disk``: lead/comment logs, uploads, manifest scans (``DISK_WORKERS``, default 8)
+- ``cpu``: template rendering, compression, hashing (``CPU_WORKERS``, default cpu count)
+- ``net``: blocking network clients such as SMTP (``NET_WORKERS``, default 4)
+
+Each pool also caps how many calls may wait for a thread (``*_QUEUE``, default
+16x workers); past that `BoundedExecutor.run` raises `ExecutorSaturated` instead
+of queueing without limit. `stats()` reports queue depth, high-water marks and
+wait/run times per pool so the worker counts can be tuned.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+import asyncio
+import os
+import threading
+import time
+
+
+class ExecutorSaturated(Exception):
+    def __init__(self, name: str, limit: int):
+        super().__init__(f"{name} executor queue is full ({limit} waiting)")
+        self.name = name
+        self.limit = limit
+
+
+class BoundedExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that tracks queue depth and timings, with an optional queue bound.
+
+    It can be passed straight to ``loop.run_in_executor``; the bound is only
+    enforced by `run`, so internal callers are never refused.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: Optional[int] = None):
+        super().__init__(max_workers=max_workers, thread_name_prefix=f"portfolio-{name}")
+        self.name = name
+        self.workers = max_workers
+        self.max_queue = max_queue
+        self._stats_lock = threading.Lock()
+        self.queued = 0        # submitted, waiting for a thread
+        self.active = 0        # running right now
+        self.max_queued = 0    # high-water mark of `queued`
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        submitted = time.perf_counter()
+        with self._stats_lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def tracked():
+            started = time.perf_counter()
+            with self._stats_lock:
+                self.queued -= 1
+                self.active += 1
+                self.wait_seconds += started - submitted
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.run_seconds += time.perf_counter() - started
+
+        try:
+            return super().submit(tracked)
+        except BaseException:
+            with self._stats_lock:
+                self.queued -= 1
+            raise
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on this pool and await its result."""
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            with self._stats_lock:
+                self.rejected += 1
+            raise ExecutorSaturated(self.name, self.max_queue)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self, partial(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            done = self.completed or 1
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "active": self.active,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_seconds / done * 1000, 3),
+                "avg_run_ms": round(self.run_seconds / done * 1000, 3),
+            }
+
+
+class Executors:
+    """The app's ``disk``/``cpu``/``net`` pools."""
+
+    def __init__(self, disk: int, cpu: int, net: int, queue_factor: int = 16):
+        self.disk = BoundedExecutor("disk", disk, _env_int("DISK_QUEUE", disk * queue_factor))
+        self.cpu = BoundedExecutor("cpu", cpu, _env_int("CPU_QUEUE", cpu * queue_factor))
+        self.net = BoundedExecutor("net", net, _env_int("NET_QUEUE", net * queue_factor))
+
+    @classmethod
+    def from_env(cls) -> "Executors":
+        return cls(
+            disk=_env_int("DISK_WORKERS", 8),
+            cpu=_env_int("CPU_WORKERS", os.cpu_count() or 2),
+            net=_env_int("NET_WORKERS", 4),
+        )
+
+    def __iter__(self):
+        return iter((self.disk, self.cpu, self.net))
+
+    def stats(self) -> Dict[str, dict]:
+        return {ex.name: ex.stats() for ex in self}
+
+    def shutdown(self, wait: bool = True) -> None:
+        for ex in self:
+            ex.shutdown(wait=wait)
+
+
+def _env_int(var: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(var, default)))
+    except ValueError:
+        return default
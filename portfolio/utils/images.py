@@ -1,6 +1,21 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
+from typing import Callable, Dict, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from .datasource import file_stamp
+from .storage import atomic_write_text, file_lock
+from .metrics import IMAGE_JOB, timed_json
 # Import PIL lazily inside the function to make the package optional at import time
 
+logger = logging.getLogger("portfolio")
 
 SIZES = {
     "thumb": 600,
@@ -8,25 +23,511 @@ SIZES = {
     "hero": 1800,
 }
 
+UPLOADS_URL = "/static/img/uploads"
 
-def generate_responsive_images(src_path: Path, dest_dir: Path) -> dict:
-    """Generate webp resized images for sizes in SIZES and return dict of size->relative-path"""
+
+PLACEHOLDER_WIDTH = 16
+
+# name -> (file extension, PIL format, mime type, save options); AVIF needs a Pillow build
+# (or the pillow-avif-plugin package) that can write it, WebP is always produced
+FORMATS = {
+    "avif": ("avif", "AVIF", "image/avif", {"quality": 60}),
+    "webp": ("webp", "WEBP", "image/webp", {"quality": 85}),
+}
+
+
+def available_formats() -> list:
+    try:
+        from PIL import Image
+    except Exception:
+        return []
+    try:  # optional plugin that registers AVIF support
+        import pillow_avif  # noqa: F401
+    except Exception:
+        pass
+    Image.init()  # Image.SAVE is only filled once the format plugins are loaded
+    return [name for name, (_, fmt, _, _) in FORMATS.items() if fmt in Image.SAVE]
+
+
+def _pick(widths: list, target: int) -> int:
+    """Largest generated width <= target, else the smallest one we have."""
+    fitting = [w for w in widths if w <= target]
+    return max(fitting) if fitting else min(widths)
+
+
+def process_image(src_path: Path, dest_dir: Path, url_prefix: str = UPLOADS_URL) -> dict:
+    """Generate responsive variants of `src_path` and return its metadata record.
+
+    Only widths from SIZES that are not larger than the source are produced (a
+    source narrower than every size gets a single variant at its own width), from
+    largest to smallest, each resized from the previous one. The record holds the
+    real variant widths, intrinsic dimensions, ready-made srcset strings per format
+    and a tiny base64 WebP placeholder. Returns {} if the image can't be decoded.
+    """
+    import base64
+    import io
+
+    dest_dir = Path(dest_dir)
     dest_dir.mkdir(parents=True, exist_ok=True)
-    base = src_path.stem
-    out = {}
+    base = Path(src_path).stem
+    formats = available_formats()
     try:
         from PIL import Image
         with Image.open(src_path) as im:
-            im = im.convert("RGB")
-            for name, width in SIZES.items():
-                ratio = width / im.width
-                height = int(im.height * ratio)
-                resized = im.resize((width, height), Image.LANCZOS)
-                out_name = f"{base}-{width}.webp"
-                out_path = dest_dir / out_name
-                resized.save(out_path, "WEBP", quality=85)
-                out[name] = f"/static/img/uploads/{out_name}"
+            current = im.convert("RGB")
     except Exception:
         # if conversion fails (no Pillow, etc.), return empty dict and leave file as-is
         return {}
-    return out
+    width, height = current.size
+    widths = sorted({w for w in SIZES.values() if w <= width} or {width}, reverse=True)
+    urls = {name: [] for name in formats}
+    for w in widths:
+        if w != current.width:
+            current = current.resize((w, max(1, round(current.height * w / current.width))), Image.LANCZOS)
+        for name in formats:
+            ext, pil_format, _, options = FORMATS[name]
+            out_name = f"{base}-{w}.{ext}"
+            current.save(dest_dir / out_name, pil_format, **options)
+            urls[name].append((w, f"{url_prefix}/{out_name}"))
+    thumb = current.resize((PLACEHOLDER_WIDTH, max(1, round(current.height * PLACEHOLDER_WIDTH / current.width))), Image.BILINEAR)
+    buf = io.BytesIO()
+    thumb.save(buf, "WEBP", quality=30)
+    webp = dict(urls["webp"])
+    return {
+        "width": width,
+        "height": height,
+        "widths": sorted(widths),
+        "sizes": {name: webp[_pick(widths, target)] for name, target in SIZES.items()},
+        "src": webp[_pick(widths, SIZES["detail"])],
+        "largest": webp[max(widths)],
+        "formats": [
+            {"type": FORMATS[name][2], "srcset": ", ".join(f"{u} {w}w" for w, u in sorted(urls[name]))}
+            for name in formats
+        ],
+        "placeholder": "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode("ascii"),
+    }
+
+
+def record_files(record: dict) -> list:
+    """Every URL a metadata record points at (variants in all formats)."""
+    out = set(record.get("sizes", {}).values())
+    for fmt in record.get("formats", []):
+        out.update(part.rsplit(" ", 1)[0] for part in fmt["srcset"].split(", "))
+    return sorted(out)
+
+
+def generate_responsive_images(src_path: Path, dest_dir: Path, url_prefix: str = UPLOADS_URL) -> dict:
+    """Generate webp resized images for sizes in SIZES and return dict of size->relative-path"""
+    return process_image(src_path, dest_dir, url_prefix).get("sizes", {})
+
+
+class ImageMetaStore:
+    """Image metadata records keyed by source SHA-256, also findable by any variant URL.
+
+    This is the pipeline's result cache (``data/image_cache.json``); templates
+    look records up by the URL stored in the catalog. Reads check the file's
+    stamp every `check_interval` seconds and merge in records written by other
+    workers.
+    """
+
+    def __init__(self, path: Path, check_interval: float = 1.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._records: Dict[str, dict] = {}
+        self._by_url: Dict[str, dict] = {}
+        self._stamp = None
+        self._checked_at = 0.0
+        self._load()
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reload if the file changed on disk. Returns True when it was reloaded."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        if file_stamp(self.path) == self._stamp:
+            return False
+        with self._lock:
+            if file_stamp(self.path) == self._stamp:
+                return False
+            self._load()
+        return True
+
+    def _load(self) -> None:
+        """Merge in the records on disk (other workers add to the same file)."""
+        self._stamp = file_stamp(self.path)
+        try:
+            with timed_json(self.path.name, "load"):
+                data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            data = {}
+        except Exception:
+            logger.exception("Ignoring unreadable image metadata %s", self.path)
+            data = {}
+        for key, record in (data.items() if isinstance(data, dict) else ()):
+            if isinstance(record, dict) and "formats" in record:
+                self._index(key, record)  # entries from older versions lack metadata; ignore them
+
+    def _index(self, key: str, record: dict) -> None:
+        self._records[key] = record
+        for url in record_files(record):
+            self._by_url[url] = record
+
+    def get(self, url: Optional[str]) -> Optional[dict]:
+        if not url:
+            return None
+        self.refresh()
+        with self._lock:
+            return self._by_url.get(url)
+
+    def by_digest(self, digest: str) -> Optional[dict]:
+        self.refresh()
+        with self._lock:
+            return self._records.get(digest)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def put(self, key: str, record: dict) -> None:
+        with self._lock, file_lock(self.path):
+            if file_stamp(self.path) != self._stamp:
+                self._load()
+            self._index(key, record)
+            with timed_json(self.path.name, "dump"):
+                text = json.dumps(self._records, indent=2)
+            atomic_write_text(self.path, text)
+            self._stamp = file_stamp(self.path)
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ImagePipeline:
+    """Runs `process_image` in a process pool, off the request path.
+
+    Results are cached by the SHA-256 of the source bytes, so re-uploading the
+    same image is answered from the cache as long as its variants still exist.
+    Jobs are tracked by id for the admin UI to poll.
+    """
+
+    def __init__(self, dest_dir: Path, cache_path: Path, url_prefix: str = UPLOADS_URL,
+                 max_workers: Optional[int] = None, max_jobs: int = 200):
+        self.dest_dir = Path(dest_dir)
+        self.cache_path = Path(cache_path)
+        self.url_prefix = url_prefix
+        self.max_workers = max_workers or int(os.environ.get("IMAGE_WORKERS", "2"))
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self.meta = ImageMetaStore(self.cache_path)
+
+    def pool(self) -> ProcessPoolExecutor:
+        """The shared process pool (also used for on-demand derivatives), created on first use."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def _cached(self, digest: str) -> Optional[dict]:
+        result = self.meta.by_digest(digest)
+        if not result:
+            return None
+        for url in record_files(result):
+            if not (self.dest_dir / Path(url).name).exists():
+                return None
+        return result
+
+    def _new_job(self, src: Path, digest: str) -> dict:
+        job = {"id": uuid.uuid4().hex, "source": src.name, "sha256": digest, "state": "queued", "result": None, "error": None}
+        self._jobs[job["id"]] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+        return job
+
+    def submit(self, src_path: Path, on_done: Optional[Callable[[dict], None]] = None,
+               digest: Optional[str] = None) -> str:
+        """Queue variant generation for `src_path` and return a job id.
+
+        `digest` is the SHA-256 of the file if the caller already computed it.
+        `on_done(job)` is called (from a pool callback thread) once the job has
+        finished, including when it was answered from the cache.
+        """
+        src = Path(src_path)
+        digest = digest or file_sha256(src)
+        # the cache lookup reads the metadata store and stats variants; keep it out of self._lock
+        cached = self._cached(digest)
+        with self._lock:
+            job = self._new_job(src, digest)
+            if cached is not None:
+                job.update(state="done", result=cached, cached=True)
+        if cached is not None:
+            self._notify(on_done, job)
+            return job["id"]
+        submitted = time.perf_counter()
+        fut = self.pool().submit(process_image, str(src), str(self.dest_dir), self.url_prefix)
+        fut.add_done_callback(lambda f: self._finish(job, f, on_done, submitted))
+        return job["id"]
+
+    def _finish(self, job: dict, fut: Future, on_done, submitted: float) -> None:
+        try:
+            result = fut.result()
+        except Exception as exc:
+            logger.exception("Image job %s crashed", job["id"])
+            result, error = {}, str(exc)
+        else:
+            error = None if result else "could not decode image"
+        duration = time.perf_counter() - submitted
+        IMAGE_JOB.labels("done" if result else "failed").observe(duration)
+        if result:
+            # persisted before the job reads as done, and outside self._lock: the
+            # store does file I/O under its own lock and status() shouldn't wait on it
+            try:
+                self.meta.put(job["sha256"], result)
+            except Exception:
+                logger.exception("Failed to persist image cache")
+        with self._lock:
+            if result:
+                job.update(state="done", result=result, seconds=round(duration, 3))
+            else:
+                job.update(state="failed", error=error)
+        self._notify(on_done, job)
+
+    @staticmethod
+    def _notify(on_done, job: dict) -> None:
+        if on_done is None:
+            return
+        try:
+            on_done(job)
+        except Exception:
+            logger.exception("Image job callback failed")
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+# -- on-demand derivatives (/img/<path>?w=&fmt=) ---------------------------------
+DERIVATIVE_URL = "/img"
+STATIC_IMG_URL = "/static/img"
+# requested widths are rounded up to one of these, so the cache can't be filled with every integer
+DERIVATIVE_WIDTHS = (160, 320, 480, 640, 800, 960, 1280, 1600, 1920, 2560)
+SRCSET_WIDTHS = (320, 640, 960, 1280, 1920)
+# formats a derivative can be encoded in; JPEG is the fallback for browsers without WebP
+DERIVATIVE_FORMATS = {**FORMATS, "jpeg": ("jpg", "JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True})}
+# bump when encoder settings change, so old derivatives stop matching
+DERIVATIVE_VERSION = 1
+DERIVATIVE_SOURCE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".avif")
+DERIVATIVE_CACHE_CONTROL = "public, max-age=86400, stale-while-revalidate=604800"
+
+
+def negotiate_format(accept: str, formats: list) -> str:
+    """Best of `formats` the client's Accept header allows (JPEG if it names neither AVIF nor WebP)."""
+    for name in ("avif", "webp"):
+        if name in formats and DERIVATIVE_FORMATS[name][2] in accept:
+            return name
+    return "jpeg"
+
+
+def snap_width(width: int) -> int:
+    """Smallest allowed derivative width >= `width` (the largest one if it's bigger than all)."""
+    for w in DERIVATIVE_WIDTHS:
+        if w >= width:
+            return w
+    return DERIVATIVE_WIDTHS[-1]
+
+
+def derivative(url: Optional[str], widths=SRCSET_WIDTHS, default: int = 960) -> Optional[dict]:
+    """``src``/``srcset``/``largest`` pointing at /img for an image under /static/img, else None."""
+    if not url or not url.startswith(STATIC_IMG_URL + "/") or url.lower().endswith(".svg"):
+        return None
+    base = DERIVATIVE_URL + url[len(STATIC_IMG_URL):]
+    return {
+        "src": f"{base}?w={default}",
+        "srcset": ", ".join(f"{base}?w={w} {w}w" for w in widths),
+        "largest": f"{base}?w={max(widths)}",
+    }
+
+
+def render_derivative(src_path: str, dest_path: str, width: Optional[int], fmt: str) -> bool:
+    """Encode `src_path` as `fmt`, at most `width` pixels wide, into `dest_path` (atomically).
+
+    Runs in the process pool. Returns False if the source can't be decoded.
+    """
+    import tempfile
+
+    try:
+        from PIL import Image, ImageOps
+        with Image.open(src_path) as im:
+            im = ImageOps.exif_transpose(im)
+            im = im.convert("RGB")
+    except Exception:
+        return False
+    if width and width < im.width:
+        im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+    _, pil_format, _, options = DERIVATIVE_FORMATS[fmt]
+    dest = Path(dest_path)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{dest.name}.", suffix=".tmp", dir=str(dest.parent))
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            im.save(fh, pil_format, **options)
+        os.replace(tmp, dest)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return True
+
+
+class DerivativeCache:
+    """Resized/re-encoded images in a size-bounded on-disk LRU.
+
+    Files are keyed by the SHA-256 of the source bytes plus width and format, so
+    a changed source never serves a stale derivative. The recency index lives in
+    memory (rebuilt from file mtimes at startup, which hits refresh); once the
+    total exceeds `max_bytes` the least recently used files are deleted. Renders
+    of the same key share one pool job (single flight).
+    """
+
+    def __init__(self, root: Path, max_bytes: int, pool: Callable[[], ProcessPoolExecutor]):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.pool = pool
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, int]" = OrderedDict()  # relative path -> bytes
+        self._total = 0
+        self._digests: Dict[str, tuple] = {}  # source path -> (stamp, sha256)
+        self._inflight: Dict[str, Future] = {}
+        # empty without Pillow; callers then serve the original
+        formats = available_formats()
+        self.formats = formats + ["jpeg"] if formats else []
+        self._scan()
+
+    def _scan(self) -> None:
+        files = []
+        for path in self.root.glob("*/*"):
+            if path.name.startswith("."):
+                continue  # temp file of a render in progress (or a crashed one)
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, str(path.relative_to(self.root)), st.st_size))
+        for _, rel, size in sorted(files):
+            self._lru[rel] = size
+            self._total += size
+
+    def source_digest(self, src: Path) -> str:
+        """SHA-256 of `src`, rehashed only when its stamp changes. Blocking."""
+        stamp = file_stamp(src)
+        cached = self._digests.get(str(src))
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        digest = file_sha256(src)
+        self._digests[str(src)] = (stamp, digest)
+        return digest
+
+    def key(self, digest: str, width: Optional[int], fmt: str) -> str:
+        raw = f"{digest}:{width or 0}:{fmt}:{DERIVATIVE_VERSION}"
+        name = hashlib.sha256(raw.encode("ascii")).hexdigest()[:32]
+        return f"{name[:2]}/{name}.{DERIVATIVE_FORMATS[fmt][0]}"
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Path of the cached derivative `key`, marking it recently used; None on a miss. Blocking."""
+        path = self.root / key
+        try:
+            os.utime(path)  # recency survives restarts through the mtime
+        except FileNotFoundError:
+            with self._lock:
+                # evicted by another worker, or deleted by hand
+                size = self._lru.pop(key, None)
+                if size is not None:
+                    self._total -= size
+                self.misses += 1
+            return None
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+            self.hits += 1
+        return path
+
+    def render(self, key: str, src: Path, width: Optional[int], fmt: str) -> Future:
+        """Future resolving to the derivative's path (None if undecodable); one job per key."""
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            fut = Future()
+            self._inflight[key] = fut
+            self.renders += 1
+        dest = self.root / key
+        started = time.perf_counter()
+        try:
+            job = self.pool().submit(render_derivative, str(src), str(dest), width, fmt)
+        except BaseException as exc:
+            self._settle(key, fut, exc=exc)
+            raise
+        job.add_done_callback(lambda j: self._done(key, dest, fut, j, started))
+        return fut
+
+    def _done(self, key: str, dest: Path, fut: Future, job: Future, started: float) -> None:
+        try:
+            ok = job.result()
+        except Exception as exc:
+            logger.exception("Rendering %s failed", key)
+            IMAGE_JOB.labels("failed").observe(time.perf_counter() - started)
+            self._settle(key, fut, exc=exc)
+            return
+        IMAGE_JOB.labels("derivative" if ok else "failed").observe(time.perf_counter() - started)
+        if ok:
+            self._add(key, dest)
+        self._settle(key, fut, result=dest if ok else None)
+
+    def _settle(self, key: str, fut: Future, result=None, exc: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    def _add(self, key: str, path: Path) -> None:
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return
+        evict = []
+        with self._lock:
+            self._total += size - self._lru.pop(key, 0)
+            self._lru[key] = size
+            while self._total > self.max_bytes and len(self._lru) > 1:
+                old, old_size = self._lru.popitem(last=False)
+                self._total -= old_size
+                evict.append(old)
+            self.evictions += len(evict)
+        for old in evict:
+            (self.root / old).unlink(missing_ok=True)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
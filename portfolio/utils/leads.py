@@ -0,0 +1,372 @@
+"""Lead storage backends.
+
+`JsonlLeadStore` keeps an append-only ``leads.jsonl`` log written by a single
+background writer thread (one fsync per batch of concurrent submissions).
+Each batch is appended under the file's advisory lock, and ids are assigned
+there after catching up on lines other workers appended, so ``uvicorn
+--workers N`` neither interleaves lines nor hands out an id twice.
+`SqliteLeadStore` is an optional alternative backed by the stdlib ``sqlite3``.
+Both assign increasing integer ids and can still produce the legacy
+``leads.json`` array for admins via `export_json`.
+"""
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from .metrics import timed_json
+from .storage import atomic_write_text, atomic_writer, file_lock, truncate_torn_tail
+
+logger = logging.getLogger("portfolio")
+
+
+class LeadStore:
+    """Interface shared by the lead backends."""
+
+    def append(self, entry: dict) -> dict:
+        return self.append_many([entry])[0]
+
+    def append_many(self, entries: Iterable[dict]) -> List[dict]:
+        raise NotImplementedError
+
+    def iter_leads(self, after_id: int = 0) -> Iterator[dict]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        return sum(1 for _ in self.iter_leads())
+
+    def scan(self, cursor: Any = None) -> Tuple[List[Tuple[dict, Any]], Any, bool]:
+        """Leads stored since `cursor` (None = from the start), each with a ref for `fetch`.
+
+        Returns ``(rows, new_cursor, reset)``; `reset` means the store was
+        rewritten since `cursor` and `rows` starts over from the beginning.
+        """
+        last = cursor or 0
+        rows = [(e, int(e.get("id", 0))) for e in self.iter_leads(after_id=last)]
+        return rows, max([last] + [ref for _, ref in rows]), False
+
+    def fetch(self, refs: Sequence[Any]) -> List[dict]:
+        """The leads for refs returned by `scan`, in the same order."""
+        wanted = set(refs)
+        found = {int(e.get("id", 0)): e for e in self.iter_leads() if int(e.get("id", 0)) in wanted}
+        return [found[ref] for ref in refs if ref in found]
+
+    def compact(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def export_json(self, path: Optional[Path] = None) -> str:
+        """Return (and optionally write) all leads in the legacy ``leads.json`` format."""
+        with timed_json("leads.json", "dump"):
+            text = json.dumps(list(self.iter_leads()), indent=2)
+        if path is not None:
+            atomic_write_text(path, text)
+        return text
+
+
+class _Pending:
+    __slots__ = ("entries", "done", "error")
+
+    def __init__(self, entries: List[dict]):
+        self.entries = entries
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class JsonlLeadStore(LeadStore):
+    """Append-only JSON-lines log with group commit and periodic compaction."""
+
+    def __init__(self, path: Path, compact_every: int = 1000, batch_window: float = 0.0):
+        self.path = Path(path)
+        self.compact_every = compact_every
+        # optional extra wait so bursts land in one fsync; 0 relies on natural batching
+        self.batch_window = batch_window
+        self._cond = threading.Condition()
+        self._queue: List[_Pending] = []
+        self._closed = False
+        self._since_compact = 0
+        self._writer: Optional[threading.Thread] = None
+        # how far this process has read the log, to pick up ids appended by other workers
+        self._next_id = 1
+        self._ino = None
+        self._scanned = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.path):
+            self.path.touch()
+            truncate_torn_tail(self.path)  # crash mid-write
+            self._sync_ids()
+
+    def _sync_ids(self) -> None:
+        """Advance `_next_id` past every id in the log. Hold the file lock."""
+        st = os.stat(self.path)
+        if st.st_ino != self._ino or st.st_size < self._scanned:
+            # first look, or another worker compacted the log: rescan from the start
+            self._ino, self._scanned, self._next_id = st.st_ino, 0, 1
+        if st.st_size == self._scanned:
+            return
+        with self.path.open("rb") as fh:
+            fh.seek(self._scanned)
+            for raw in fh:
+                if not raw.endswith(b"\n"):
+                    break
+                self._scanned += len(raw)
+                try:
+                    self._next_id = max(self._next_id, int(json.loads(raw).get("id", 0)) + 1)
+                except (ValueError, TypeError, AttributeError):
+                    continue
+
+    # -- writes ------------------------------------------------------------
+    def append_many(self, entries: Iterable[dict]) -> List[dict]:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("lead store is closed")
+            pending = _Pending(list(entries))
+            self._queue.append(pending)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="lead-writer", daemon=True)
+                self._writer.start()
+            self._cond.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.entries
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue and self._closed:
+                    return
+            if self.batch_window:
+                threading.Event().wait(self.batch_window)
+            with self._cond:
+                batch, self._queue = self._queue, []
+            error = None
+            try:
+                self._append(batch)
+            except Exception as exc:
+                logger.exception("Failed to append leads")
+                error = exc
+            for p in batch:
+                p.error = error
+                p.done.set()
+            self._since_compact += sum(len(p.entries) for p in batch)
+            if self.compact_every and self._since_compact >= self.compact_every:
+                try:
+                    self.compact()
+                except Exception:
+                    logger.exception("Failed to compact %s", self.path)
+
+    def _append(self, batch: List[_Pending]) -> None:
+        with file_lock(self.path):
+            truncate_torn_tail(self.path)  # a worker that crashed mid-append
+            self._sync_ids()
+            for p in batch:
+                p.entries = [{**e, "id": self._next_id + i} for i, e in enumerate(p.entries)]
+                self._next_id += len(p.entries)
+            # opened per batch: the log is replaced when any worker compacts it
+            with self.path.open("ab") as fh:
+                fh.write("".join(json.dumps(e) + "\n" for p in batch for e in p.entries).encode("utf-8"))
+                fh.flush()
+                os.fsync(fh.fileno())
+                self._scanned = fh.tell()
+
+    def compact(self) -> None:
+        """Rewrite the log without invalid/duplicate lines.
+
+        Runs on the writer thread when `compact_every` appends have accumulated.
+        """
+        with file_lock(self.path):
+            seen = set()
+            with atomic_writer(self.path) as out:
+                for entry in self.iter_leads():
+                    if entry.get("id") in seen:
+                        continue
+                    seen.add(entry.get("id"))
+                    out.write((json.dumps(entry) + "\n").encode("utf-8"))
+            st = os.stat(self.path)
+            self._ino, self._scanned = st.st_ino, st.st_size
+        self._since_compact = 0
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    # -- reads -------------------------------------------------------------
+    def iter_leads(self, after_id: int = 0) -> Iterator[dict]:
+        try:
+            fh = self.path.open("r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with fh:
+            for line in fh:
+                if not line.endswith("\n"):
+                    break  # partially written line; it will be complete on the next read
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if int(entry.get("id", 0)) > after_id:
+                    yield entry
+
+
+    def scan(self, cursor: Any = None) -> Tuple[List[Tuple[dict, Any]], Any, bool]:
+        # cursor is (inode, byte offset): only bytes appended since are read, and
+        # a compaction (new inode, or a shorter file) restarts from the top
+        try:
+            fh = self.path.open("rb")
+        except FileNotFoundError:
+            return [], cursor, False
+        rows = []
+        with fh:
+            st = os.fstat(fh.fileno())
+            ino, pos = cursor or (None, 0)
+            reset = cursor is not None and (st.st_ino != ino or st.st_size < pos)
+            if reset:
+                pos = 0
+            fh.seek(pos)
+            for raw in fh:
+                if not raw.endswith(b"\n"):
+                    break  # partially written line; it will be complete on the next scan
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    entry = None
+                if isinstance(entry, dict):
+                    rows.append((entry, pos))
+                pos += len(raw)
+        return rows, (st.st_ino, pos), reset
+
+    def fetch(self, refs: Sequence[Any]) -> List[dict]:
+        out = []
+        try:
+            fh = self.path.open("rb")
+        except FileNotFoundError:
+            return out
+        with fh:
+            for offset in refs:
+                fh.seek(offset)
+                try:
+                    out.append(json.loads(fh.readline()))
+                except ValueError:
+                    continue
+        return out
+
+
+class SqliteLeadStore(LeadStore):
+    """Leads in a single SQLite table (WAL journal, one shared connection)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leads (id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, data TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def append_many(self, entries: Iterable[dict]) -> List[dict]:
+        out = []
+        with self._lock:
+            with self._conn:
+                for e in entries:
+                    e = {k: v for k, v in e.items() if k != "id"}
+                    cur = self._conn.execute(
+                        "INSERT INTO leads (ts, data) VALUES (?, ?)", (e.get("ts"), json.dumps(e))
+                    )
+                    out.append({**e, "id": cur.lastrowid})
+        return out
+
+    def iter_leads(self, after_id: int = 0) -> Iterator[dict]:
+        last = after_id
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, data FROM leads WHERE id > ? ORDER BY id LIMIT 500", (last,)
+                ).fetchall()
+            if not rows:
+                return
+            for row_id, data in rows:
+                yield {**json.loads(data), "id": row_id}
+            last = rows[-1][0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+
+    def fetch(self, refs: Sequence[Any]) -> List[dict]:
+        if not refs:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, data FROM leads WHERE id IN ({','.join('?' * len(refs))})", list(refs)
+            ).fetchall()
+        found = {row_id: {**json.loads(data), "id": row_id} for row_id, data in rows}
+        return [found[ref] for ref in refs if ref in found]
+
+    def compact(self) -> None:
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_json_leads(json_path: Path, store: LeadStore) -> int:
+    """Import a legacy ``leads.json`` array into an empty store.
+
+    The source is renamed to ``leads.json.migrated`` afterwards so the import
+    only happens once. Returns the number of leads imported.
+    """
+    json_path = Path(json_path)
+    if not json_path.exists():
+        return 0
+    with file_lock(json_path):  # every worker tries this at startup; only one may import
+        return _migrate_locked(json_path, store)
+
+
+def _migrate_locked(json_path: Path, store: LeadStore) -> int:
+    if not json_path.exists():
+        return 0
+    try:
+        legacy = json.loads(json_path.read_text())
+    except Exception:
+        logger.exception("Could not parse %s for migration", json_path)
+        return 0
+    if not isinstance(legacy, list) or not legacy:
+        return 0
+    if store.count():
+        logger.warning("Lead store is not empty; skipping migration of %s", json_path)
+        return 0
+    store.append_many(legacy)
+    os.replace(json_path, json_path.with_name(json_path.name + ".migrated"))
+    logger.info("Migrated %d leads from %s", len(legacy), json_path)
+    return len(legacy)
+
+
+def open_lead_store(data_dir: Path, backend: Optional[str] = None) -> LeadStore:
+    """Open the configured backend (``LEAD_STORE=jsonl|sqlite``) and migrate ``leads.json``."""
+    backend = (backend or os.environ.get("LEAD_STORE", "jsonl")).lower()
+    data_dir = Path(data_dir)
+    if backend == "sqlite":
+        store: LeadStore = SqliteLeadStore(data_dir / "leads.sqlite3")
+    elif backend == "jsonl":
+        store = JsonlLeadStore(data_dir / "leads.jsonl")
+    else:
+        raise ValueError(f"Unknown lead store backend: {backend}")
+    migrate_json_leads(data_dir / "leads.json", store)
+    return store
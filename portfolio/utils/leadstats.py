@@ -0,0 +1,191 @@
+"""Incrementally maintained lead aggregates and a query index for the admin API.
+
+`LeadIndex` follows the lead store with `LeadStore.scan`, which only reads what
+was appended since the last call. Each new lead updates the day/hour
+counters, the email-domain histogram and the sender counts, and adds a small
+row (id, ts, email, name) plus a storage ref to the index. `stats()` is then
+computed from the counters, in time proportional to the window it reports
+rather than to the number of leads. `query()` walks the in-memory rows
+newest first, starting from the per-domain or per-email lists when given. It
+stops at the first match past the page, or at the first row older than
+`since`, and reads only that page from storage via `LeadStore.fetch`.
+"""
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+import threading
+import time
+
+from .leads import LeadStore
+
+logger = logging.getLogger("portfolio")
+
+
+class _Row(NamedTuple):
+    id: int
+    ts: str
+    email: str
+    name: str
+    ref: object
+
+
+def email_domain(email: str) -> str:
+    return email.rpartition("@")[2].strip().lower() if "@" in email else ""
+
+
+class LeadIndex:
+    def __init__(self, store: LeadStore, check_interval: float = 1.0):
+        self.store = store
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._checked_at = 0.0
+        self._clear()
+
+    def _clear(self) -> None:
+        self._cursor = None
+        self._rows: List[_Row] = []
+        self._ids: List[int] = []
+        # key -> (positions in _rows, their ids); the ids make `before` a bisect
+        self._by_domain: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._by_email: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.daily: Counter = Counter()  # "YYYY-MM-DD" -> leads
+        self.hourly: Counter = Counter()  # "YYYY-MM-DDTHH" -> leads
+        self.hour_of_day = [0] * 24
+        self.domains: Counter = Counter()
+        self.senders: Counter = Counter()
+        self.repeat_senders = 0
+
+    # -- maintenance -------------------------------------------------------
+    def refresh(self, force: bool = False) -> int:
+        """Index leads appended since the last call (by any worker). Returns how many."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return 0
+        with self._lock:
+            self._checked_at = now
+            rows, cursor, reset = self.store.scan(self._cursor)
+            if reset:
+                logger.info("Lead store was rewritten; rebuilding the lead index")
+                self._clear()
+            self._cursor = cursor
+            added = 0
+            for entry, ref in rows:
+                added += self._add(entry, ref)
+            return added
+
+    def _add(self, entry: dict, ref) -> int:
+        try:
+            lead_id = int(entry.get("id") or 0)
+        except (TypeError, ValueError):
+            return 0
+        if self._ids and lead_id <= self._ids[-1]:
+            return 0  # duplicate line from before a compaction
+        ts = str(entry.get("ts") or "")
+        email = str(entry.get("email") or "").strip().lower()
+        domain = email_domain(email)
+        pos = len(self._rows)
+        self._rows.append(_Row(lead_id, ts, email, str(entry.get("name") or ""), ref))
+        self._ids.append(lead_id)
+        for index, key in ((self._by_domain, domain), (self._by_email, email)):
+            positions, ids = index.setdefault(key, ([], []))
+            positions.append(pos)
+            ids.append(lead_id)
+        if len(ts) >= 13:
+            self.daily[ts[:10]] += 1
+            self.hourly[ts[:13]] += 1
+            try:
+                self.hour_of_day[int(ts[11:13])] += 1
+            except (ValueError, IndexError):
+                pass
+        if domain:
+            self.domains[domain] += 1
+        if email:
+            self.senders[email] += 1
+            if self.senders[email] == 2:
+                self.repeat_senders += 1
+        return 1
+
+    # -- reads -------------------------------------------------------------
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def stats(self, days: int = 30, hours: int = 48, top: int = 10, now: Optional[datetime] = None) -> dict:
+        """Totals, rolling windows, per-day/per-hour series and the top sender domains."""
+        self.refresh()
+        now = now or datetime.utcnow()  # lead timestamps are naive UTC
+        with self._lock:
+            day_keys = [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(max(days, 30) - 1, -1, -1)]
+            hour_keys = [(now - timedelta(hours=i)).strftime("%Y-%m-%dT%H") for i in range(max(hours, 24) - 1, -1, -1)]
+            return {
+                "total": len(self._rows),
+                "last_id": self._ids[-1] if self._ids else 0,
+                "first_ts": self._rows[0].ts if self._rows else None,
+                "last_ts": self._rows[-1].ts if self._rows else None,
+                "windows": {
+                    "24h": sum(self.hourly[k] for k in hour_keys[-24:]),
+                    "7d": sum(self.daily[k] for k in day_keys[-7:]),
+                    "30d": sum(self.daily[k] for k in day_keys[-30:]),
+                },
+                "senders": {"unique": len(self.senders), "repeat": self.repeat_senders},
+                "daily": [{"day": k, "count": self.daily[k]} for k in day_keys[-days:]] if days > 0 else [],
+                "hourly": [{"hour": k, "count": self.hourly[k]} for k in hour_keys[-hours:]] if hours > 0 else [],
+                "hour_of_day": list(self.hour_of_day),
+                "top_domains": [{"domain": d, "count": c} for d, c in self.domains.most_common(top)],
+            }
+
+    def query(self, domain: Optional[str] = None, email: Optional[str] = None, since: Optional[str] = None,
+              until: Optional[str] = None, q: Optional[str] = None, before: Optional[int] = None,
+              limit: int = 20) -> Tuple[List[dict], Optional[int], Optional[int]]:
+        """Leads matching every given filter, newest first.
+
+        `since`/`until` are ISO date or datetime prefixes (`until` is
+        inclusive); `q` matches name or email; `before` is the id cursor from
+        the previous page. Returns ``(leads, next_before, total)``. `total`
+        counts every match, not just those after the cursor, and comes from the
+        index. It is None when `since`/`until`/`q` are used, since counting
+        those would mean scanning every row.
+        """
+        self.refresh()
+        q = (q or "").strip().lower()
+        domain = (domain or "").strip().lower() or None
+        email = (email or "").strip().lower() or None
+        for attempt in range(3):
+            with self._lock:
+                if email or domain:
+                    positions, ids = (self._by_email if email else self._by_domain).get(email or domain, ([], []))
+                else:
+                    positions, ids = range(len(self._rows)), self._ids
+                end = bisect_left(ids, before) if before is not None else len(positions)
+                page: List[_Row] = []
+                more = False
+                for i in range(end - 1, -1, -1):
+                    row = self._rows[positions[i]]
+                    if since and row.ts < since:
+                        break  # leads are indexed in arrival order, so every older row is older still
+                    if until and row.ts[:len(until)] > until:
+                        continue
+                    if domain and email and email_domain(row.email) != domain:
+                        continue
+                    if q and q not in row.email and q not in row.name.lower():
+                        continue
+                    if len(page) == limit:
+                        more = True  # one match past the page is enough to know there's a next one
+                        break
+                    page.append(row)
+                if since or until or q or (domain and email):
+                    total = None
+                else:
+                    total = len(positions)
+            # read storage without holding the lock; a compaction in between is caught below
+            leads = self.store.fetch([row.ref for row in page])
+            if [int(e.get("id") or 0) for e in leads] == [row.id for row in page]:
+                return leads, page[-1].id if more else None, total
+            # the log was compacted between indexing and reading; reindex and retry
+            self.refresh(force=True)
+        raise LeadIndexStale("lead store kept changing while reading")
+
+
+class LeadIndexStale(RuntimeError):
+    """The store was rewritten under every attempt to read a page; worth retrying shortly."""
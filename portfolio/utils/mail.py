@@ -0,0 +1,404 @@
+"""Contact email delivery.
+
+`MailDispatcher` takes messages off the request path: they go into a bounded
+asyncio queue and a worker sends them in batches, through one persistent
+``httpx.AsyncClient`` for SendGrid or an `SMTPPool` of reused, kept-alive SMTP
+sessions. Failed sends are retried with exponential backoff. Messages that
+still fail, or that arrive while the queue is full, are written to a
+disk-backed outbox and retried later, including after a restart. The record
+keeps its attempt count; after `max_attempts` it is moved to ``outbox/dead``.
+"""
+from email.message import EmailMessage
+from pathlib import Path
+from typing import List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import uuid
+
+from .storage import atomic_write_text
+from .metrics import EMAIL_SEND
+
+logger = logging.getLogger("portfolio")
+
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+
+
+class MailConfig:
+    def __init__(self, from_email: Optional[str] = None, to_email: Optional[str] = None,
+                 sendgrid_key: Optional[str] = None, smtp_host: Optional[str] = None, smtp_port: int = 587,
+                 smtp_user: Optional[str] = None, smtp_password: Optional[str] = None,
+                 use_tls: bool = True, use_ssl: bool = False):
+        self.from_email = from_email
+        self.to_email = to_email
+        self.sendgrid_key = sendgrid_key
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.smtp_user = smtp_user
+        self.smtp_password = smtp_password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+
+    @classmethod
+    def from_env(cls, default_email: Optional[str] = None) -> "MailConfig":
+        env = os.environ
+        return cls(
+            from_email=env.get("EMAIL_FROM", default_email),
+            to_email=env.get("EMAIL_TO", default_email),
+            sendgrid_key=env.get("SENDGRID_API_KEY"),
+            smtp_host=env.get("SMTP_HOST"),
+            smtp_port=int(env.get("SMTP_PORT", 587)),
+            smtp_user=env.get("SMTP_USER"),
+            smtp_password=env.get("SMTP_PASSWORD"),
+            use_ssl=env.get("SMTP_SSL", "0") == "1",
+            use_tls=env.get("SMTP_TLS", "1") == "1",
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.sendgrid_key or self.smtp_host)
+
+
+class SMTPPool:
+    """A few reusable SMTP sessions; idle sessions are checked with NOOP before reuse."""
+
+    def __init__(self, config: MailConfig, size: int = 2, idle_timeout: float = 60.0, timeout: float = 10.0):
+        self.config = config
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: List[tuple] = []  # (conn, last_used)
+        self.connects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        c = self.config
+        if c.use_ssl:
+            conn = smtplib.SMTP_SSL(c.smtp_host, c.smtp_port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(c.smtp_host, c.smtp_port, timeout=self.timeout)
+        conn.ehlo()
+        if c.use_tls and not c.use_ssl:
+            conn.starttls()
+            conn.ehlo()
+        if c.smtp_user:
+            conn.login(c.smtp_user, c.smtp_password)
+        self.connects += 1
+        return conn
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if time.monotonic() - last_used > self.idle_timeout:
+                self._quietly_close(conn)
+                continue
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except Exception:
+                pass
+            self._quietly_close(conn)
+        return self._connect()
+
+    def release(self, conn: smtplib.SMTP, broken: bool = False) -> None:
+        if not broken:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append((conn, time.monotonic()))
+                    return
+        self._quietly_close(conn)
+
+    def send_batch(self, messages: List[EmailMessage]) -> List[Optional[BaseException]]:
+        """Send messages over one session; returns a per-message error (or None)."""
+        errors: List[Optional[BaseException]] = []
+        conn = None
+        for msg in messages:
+            try:
+                if conn is None:
+                    conn = self.acquire()
+                conn.send_message(msg)
+                errors.append(None)
+            except Exception as exc:
+                errors.append(exc)
+                if conn is not None:
+                    self.release(conn, broken=True)
+                    conn = None
+        if conn is not None:
+            self.release(conn)
+        return errors
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._quietly_close(conn)
+
+    @staticmethod
+    def _quietly_close(conn) -> None:
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def _to_email_message(m: dict) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = m["subject"]
+    msg["From"] = m["from"]
+    msg["To"] = m["to"]
+    msg.set_content(m["body"])
+    return msg
+
+
+class MailDispatcher:
+    def __init__(self, config: MailConfig, outbox_dir: Path, queue_size: int = 100, batch_size: int = 10,
+                 max_retries: int = 3, backoff: float = 1.0, outbox_interval: float = 300.0,
+                 max_attempts: int = 30, executor=None, disk_executor=None):
+        self.config = config
+        self.executor = executor  # threads for blocking SMTP calls (None = loop default)
+        self.disk_executor = disk_executor  # threads for outbox reads (None = loop default)
+        self.outbox_dir = Path(outbox_dir)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.outbox_interval = outbox_interval
+        self.max_attempts = max_attempts  # across outbox sweeps; then the message is dead-lettered
+        self.smtp_pool = SMTPPool(config) if config.smtp_host else None
+        self.sent = 0
+        self.failed = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._http = None
+        self._queued_outbox = set()
+        self._claim_lock = threading.Lock()
+        self._sweep_lock: Optional[asyncio.Lock] = None
+
+    # -- lifecycle -----------------------------------------------------------
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        old = self._queue
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        # carry over anything queued on a previous (now finished) event loop
+        while old is not None and not old.empty() and not self._queue.full():
+            self._queue.put_nowait(old.get_nowait())
+        self._http = None
+        self._sweep_lock = asyncio.Lock()
+        self._tasks = [loop.create_task(self._worker()), loop.create_task(self._outbox_loop())]
+
+    async def aclose(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self.smtp_pool is not None:
+            self.smtp_pool.close()
+        self._loop = None
+
+    async def join(self) -> None:
+        """Wait until every queued message has been handled (sent or moved to the outbox)."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    # -- enqueue -------------------------------------------------------------
+    def build(self, subject: str, body: str, to_email: Optional[str] = None) -> dict:
+        return {
+            "id": uuid.uuid4().hex,
+            "from": self.config.from_email,
+            "to": to_email or self.config.to_email,
+            "subject": subject,
+            "body": body,
+            "attempts": 0,
+        }
+
+    async def enqueue(self, message: dict) -> bool:
+        """Queue `message` for delivery. Returns False if it was spilled to the outbox instead."""
+        if not self.config.configured:
+            logger.warning("No email provider configured; skipping send")
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            logger.warning("Mail queue full; writing message %s to outbox", message["id"])
+            self._to_outbox(message)
+            return False
+
+    # -- worker --------------------------------------------------------------
+    async def _worker(self) -> None:
+        q = self._queue
+        while True:
+            batch = [await q.get()]
+            while len(batch) < self.batch_size and not q.empty():
+                batch.append(q.get_nowait())
+            transport = "sendgrid" if self.config.sendgrid_key else "smtp"
+            t0 = time.perf_counter()
+            try:
+                transport, errors = await self._send_batch(batch)
+            except Exception as exc:
+                logger.exception("Mail batch failed")
+                errors = [exc] * len(batch)
+            ok = all(e is None for e in errors)
+            EMAIL_SEND.labels(transport, "ok" if ok else "error").observe(time.perf_counter() - t0)
+            for msg, err in zip(batch, errors):
+                if err is None:
+                    self.sent += 1
+                    self._drop_outbox_file(msg)
+                else:
+                    self._retry_later(msg, err)
+                q.task_done()
+
+    async def _send_batch(self, batch: List[dict]) -> Tuple[str, List[Optional[BaseException]]]:
+        """(transport actually used, per-message errors); a partial SMTP fallback is "sendgrid+smtp"."""
+        if self.config.sendgrid_key:
+            results = await asyncio.gather(*(self._send_sendgrid(m) for m in batch), return_exceptions=True)
+            errors = [r if isinstance(r, BaseException) else None for r in results]
+            if self.smtp_pool is None or all(e is None for e in errors):
+                return "sendgrid", errors
+            # fall back to SMTP for whatever SendGrid rejected
+            retry = [m for m, e in zip(batch, errors) if e is not None]
+            smtp_errors = iter(await self._send_smtp(retry))
+            transport = "smtp" if len(retry) == len(batch) else "sendgrid+smtp"
+            return transport, [next(smtp_errors) if e is not None else None for e in errors]
+        return "smtp", await self._send_smtp(batch)
+
+    async def _send_sendgrid(self, m: dict) -> None:
+        if self._http is None:
+            # Import httpx lazily so the app can start even if httpx is not installed in some environments
+            import httpx as _httpx
+            self._http = _httpx.AsyncClient(
+                timeout=10.0,
+                headers={"Authorization": f"Bearer {self.config.sendgrid_key}"},
+                limits=_httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60.0),
+            )
+        payload = {
+            "personalizations": [{"to": [{"email": m["to"]}]}],
+            "from": {"email": m["from"]},
+            "subject": m["subject"],
+            "content": [{"type": "text/plain", "value": m["body"]}],
+        }
+        r = await self._http.post(SENDGRID_URL, json=payload)
+        r.raise_for_status()
+
+    async def _send_smtp(self, batch: List[dict]) -> List[Optional[BaseException]]:
+        if self.smtp_pool is None:
+            return [RuntimeError("SMTP not configured")] * len(batch)
+        msgs = [_to_email_message(m) for m in batch]
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.smtp_pool.send_batch, msgs)
+
+    def _retry_later(self, msg: dict, err: BaseException) -> None:
+        msg["attempts"] = msg.get("attempts", 0) + 1
+        if msg["attempts"] >= self.max_retries:
+            logger.warning("Giving up on message %s after %d attempts (%s); moved to outbox", msg["id"], msg["attempts"], err)
+            self.failed += 1
+            self._to_outbox(msg)
+            return
+        delay = self.backoff * (2 ** (msg["attempts"] - 1))
+        self._loop.call_later(delay, self._requeue, msg)
+
+    def _requeue(self, msg: dict) -> None:
+        try:
+            self._queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            self._to_outbox(msg)
+
+    # -- outbox --------------------------------------------------------------
+    def _outbox_path(self, msg: dict) -> Path:
+        return self.outbox_dir / f"{msg['id']}.json"
+
+    def _to_outbox(self, msg: dict) -> None:
+        try:
+            self.outbox_dir.mkdir(parents=True, exist_ok=True)
+            atomic_write_text(self._outbox_path(msg), json.dumps(msg))
+        except Exception:
+            logger.exception("Failed to write message %s to outbox", msg.get("id"))
+        self._queued_outbox.discard(msg["id"])
+
+    def _drop_outbox_file(self, msg: dict) -> None:
+        # unlink before releasing the claim, so a sweep can't re-read a delivered message
+        self._outbox_path(msg).unlink(missing_ok=True)
+        self._queued_outbox.discard(msg["id"])
+
+    def pending_outbox(self) -> List[Path]:
+        if not self.outbox_dir.exists():
+            return []
+        return sorted(self.outbox_dir.glob("*.json"))
+
+    def _claim_outbox(self, room: int) -> List[dict]:
+        """Read up to `room` outbox messages not already queued; blocking.
+
+        A message whose attempts (kept in its record across sweeps) reached
+        `max_attempts` is moved to ``outbox/dead`` instead.
+        """
+        claimed: List[dict] = []
+        for path in self.pending_outbox():
+            if len(claimed) >= room:
+                break
+            with self._claim_lock:
+                if path.stem in self._queued_outbox:
+                    continue
+                self._queued_outbox.add(path.stem)
+            try:
+                msg = json.loads(path.read_text())
+            except FileNotFoundError:
+                self._queued_outbox.discard(path.stem)  # delivered since it was listed
+                continue
+            except Exception:
+                logger.exception("Skipping unreadable outbox file %s", path)
+                self._queued_outbox.discard(path.stem)
+                continue
+            if msg.get("attempts", 0) >= self.max_attempts:
+                logger.warning("Message %s failed %d attempts; moved to outbox/dead", path.stem, msg["attempts"])
+                try:
+                    (self.outbox_dir / "dead").mkdir(exist_ok=True)
+                    os.replace(path, self.outbox_dir / "dead" / path.name)
+                except OSError:
+                    logger.exception("Failed to dead-letter %s", path)
+                self._queued_outbox.discard(path.stem)
+                continue
+            claimed.append(msg)
+        return claimed
+
+    async def requeue_outbox(self) -> int:
+        """Move outbox messages back into the queue, keeping their attempt counts."""
+        self._ensure_started()
+        async with self._sweep_lock:  # one sweep at a time, so each put lands before the next reads
+            room = self._queue.maxsize - self._queue.qsize()
+            if room <= 0:
+                return 0
+            loop = asyncio.get_running_loop()
+            msgs = await loop.run_in_executor(self.disk_executor, self._claim_outbox, room)
+            count = 0
+            for msg in msgs:
+                try:
+                    self._queue.put_nowait(msg)
+                    count += 1
+                except asyncio.QueueFull:
+                    self._queued_outbox.discard(msg["id"])  # still on disk; the next sweep retries it
+            return count
+
+    async def _outbox_loop(self) -> None:
+        while True:
+            try:
+                await self.requeue_outbox()
+            except Exception:
+                logger.exception("Outbox retry failed")
+            await asyncio.sleep(self.outbox_interval)
@@ -0,0 +1,152 @@
+"""In-memory manifest of the images in a static directory.
+
+`MediaManifest` replaces per-request ``iterdir()``/``glob`` scans: it keeps one
+`MediaEntry` per image (size, mtime, dimensions, generated ``-<width>.webp``
+variants) and only rescans when the directory mtime changes, at most once per
+`check_interval` seconds. Unchanged files are not re-probed on a rescan, and
+uploads can be registered directly with `add`.
+"""
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger("portfolio")
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.avif', '.svg')
+VARIANT_RE = re.compile(r"^(?P<stem>.+)-(?P<width>\d+)\.(?P<ext>webp|avif)$")
+
+
+class MediaEntry:
+    __slots__ = ("name", "url", "size", "mtime_ns", "width", "height", "variants")
+
+    def __init__(self, name: str, url: str, size: int, mtime_ns: int, width: Optional[int], height: Optional[int]):
+        self.name = name
+        self.url = url
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.width = width
+        self.height = height
+        self.variants: Dict[int, str] = {}  # width -> url
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+            "width": self.width,
+            "height": self.height,
+            "variants": {str(w): u for w, u in sorted(self.variants.items())},
+        }
+
+
+def probe_dimensions(path: Path) -> Tuple[Optional[int], Optional[int]]:
+    """Read (width, height) from the image header; (None, None) for SVG or without Pillow."""
+    if path.suffix.lower() == ".svg":
+        return None, None
+    try:
+        from PIL import Image
+        with Image.open(path) as im:  # lazy: only the header is parsed
+            return im.width, im.height
+    except Exception:
+        return None, None
+
+
+class MediaManifest:
+    def __init__(self, directory: Path, url_prefix: str, check_interval: float = 2.0):
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.check_interval = check_interval
+        self.version = 0
+        self._lock = threading.Lock()
+        self._files: Dict[str, MediaEntry] = {}
+        self._dir_mtime_ns: Optional[int] = None
+        self._checked_at = 0.0
+        self._grouped: Optional[List[MediaEntry]] = None
+
+    def _url(self, name: str) -> str:
+        return f"{self.url_prefix}/{name}"
+
+    def _entry_for(self, path: Path, st) -> MediaEntry:
+        old = self._files.get(path.name)
+        if old is not None and old.size == st.st_size and old.mtime_ns == st.st_mtime_ns:
+            return old
+        width, height = probe_dimensions(path)
+        return MediaEntry(path.name, self._url(path.name), st.st_size, st.st_mtime_ns, width, height)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rescan if the directory changed. Returns True when the manifest changed."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            try:
+                dir_mtime = self.directory.stat().st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime = None
+            if not force and dir_mtime == self._dir_mtime_ns:
+                return False
+            files: Dict[str, MediaEntry] = {}
+            if dir_mtime is not None:
+                for p in self.directory.iterdir():
+                    if p.suffix.lower() not in IMAGE_EXTS:
+                        continue
+                    try:
+                        st = p.stat()
+                    except FileNotFoundError:
+                        continue
+                    if not p.is_file():
+                        continue
+                    files[p.name] = self._entry_for(p, st)
+            changed = files.keys() != self._files.keys() or any(files[n] is not self._files[n] for n in files)
+            self._files = files
+            self._dir_mtime_ns = dir_mtime
+            if changed:
+                self._grouped = None
+                self.version += 1
+            return changed
+
+    def add(self, path: Path) -> MediaEntry:
+        """Register (or update) a single file without rescanning the directory."""
+        path = Path(path)
+        st = path.stat()
+        with self._lock:
+            entry = self._entry_for(path, st)
+            self._files[path.name] = entry
+            self._grouped = None
+            self.version += 1
+        return entry
+
+    def entries(self) -> List[MediaEntry]:
+        """Source images sorted by name, with their ``-<width>.webp`` variants attached."""
+        self.refresh()
+        with self._lock:
+            if self._grouped is None:
+                stems = {Path(n).stem for n in self._files}
+                variants: Dict[str, Dict[int, str]] = {}
+                for name in self._files:
+                    m = VARIANT_RE.match(name)
+                    if m and m.group("stem") in stems:
+                        widths = variants.setdefault(m.group("stem"), {})
+                        if m.group("ext") == "webp" or int(m.group("width")) not in widths:
+                            widths[int(m.group("width"))] = self._url(name)  # webp wins over avif
+                grouped = []
+                for name in sorted(self._files):
+                    m = VARIANT_RE.match(name)
+                    if m and m.group("stem") in stems:
+                        continue  # listed under its source image
+                    entry = self._files[name]
+                    entry.variants = variants.get(Path(name).stem, {})
+                    grouped.append(entry)
+                self._grouped = grouped
+            return self._grouped
+
+    def urls(self) -> List[str]:
+        return [e.url for e in self.entries()]
+
+    def to_dict(self) -> dict:
+        return {"version": self.version, "images": [e.to_dict() for e in self.entries()]}
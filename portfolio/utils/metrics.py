@@ -0,0 +1,333 @@
+"""In-process metrics in the Prometheus text format.
+
+A small, dependency-free take on the ``prometheus_client`` model: metrics are
+module-level objects registered in `REGISTRY`, so any module can observe into
+them (``TEMPLATE_RENDER.labels("index.html").observe(dt)``) and ``/metrics``
+renders them all. `CallbackGauge` reads live values (SSE subscribers, executor
+queue depth) at scrape time instead of being updated on every change.
+
+`MetricsMiddleware` records a latency histogram per route template
+(``/projects/{slug}``, not the concrete path, to keep label cardinality
+bounded) and serves the opt-in sampling profiler for ``?profile=1``.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, key) -> List[str]:
+        return [f"{name}_total{_labels(labelnames, key)} {_num(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+    def render(self, name, labelnames, key) -> List[str]:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, running = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            le = 'le="' + _num(bound) + '"'
+            lines.append(f"{name}_bucket{_labels(labelnames, key, le)} {running}")
+        lines.append(f"{name}_sum{_labels(labelnames, key)} {_num(total)}")
+        lines.append(f"{name}_count{_labels(labelnames, key)} {running}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class CallbackGauge(_Metric):
+    """Gauge whose value(s) come from `fn` at scrape time.
+
+    `fn` returns a number, or a ``{label values tuple: number}`` dict when the
+    gauge has labels.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, v in sorted(items):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_num(v)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric  # re-registering a name replaces it
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "portfolio_http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status")))
+TEMPLATE_RENDER = REGISTRY.register(Histogram(
+    "portfolio_template_render_seconds", "Jinja template render time", ("template",)))
+DATA_JSON = REGISTRY.register(Histogram(
+    "portfolio_data_json_seconds", "JSON load/dump time of data files", ("file", "op")))
+IMAGE_JOB = REGISTRY.register(Histogram(
+    "portfolio_image_job_seconds", "Image pipeline job duration, submit to finish", ("result",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)))
+EMAIL_SEND = REGISTRY.register(Histogram(
+    "portfolio_email_send_seconds", "Email batch send latency", ("transport", "result")))
+
+RATE_LIMITED = REGISTRY.register(Counter(
+    "portfolio_rate_limited", "Submissions refused by the rate limiter", ("limit",)))
+
+
+@contextmanager
+def timed_json(file: str, op: str):
+    with DATA_JSON.labels(file, op).time():
+        yield
+
+
+def instrument_templates(env) -> None:
+    """Time every top-level ``Template.render`` of the Jinja `env` into TEMPLATE_RENDER."""
+    base = env.template_class
+
+    class TimedTemplate(base):
+        def render(self, *args, **kwargs):
+            with TEMPLATE_RENDER.labels(self.name or "<string>").time():
+                return super().render(*args, **kwargs)
+
+    env.template_class = TimedTemplate
+
+
+def route_label(scope) -> str:
+    """Route template for `scope` after routing (e.g. ``/projects/{slug}``)."""
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is None or app is None:
+        return "unmatched"
+    paths = getattr(app, "_metrics_route_paths", None)
+    if paths is None:
+        paths = {}
+        for route in getattr(app, "routes", ()):
+            target = getattr(route, "endpoint", None) or getattr(route, "app", None)
+            paths.setdefault(target, route.path)
+        app._metrics_route_paths = paths
+    return paths.get(endpoint, "unmatched")
+
+
+PROFILE_SECONDS = 10.0  # default cap on a profiled request; ``&seconds=`` changes it up to the max
+PROFILE_MAX_SECONDS = 60.0
+
+
+def _query(scope) -> dict:
+    return parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+
+def _wants_profile(scope) -> bool:
+    """``?profile=1`` exactly; not ``?noprofile=1`` or ``?profile=10``."""
+    return _query(scope).get("profile", [""])[-1] == "1"
+
+
+def _profile_seconds(scope) -> float:
+    try:
+        seconds = float(_query(scope).get("seconds", [PROFILE_SECONDS])[-1])
+    except ValueError:
+        return PROFILE_SECONDS
+    if math.isnan(seconds):
+        return PROFILE_SECONDS
+    return min(max(seconds, 0.0), PROFILE_MAX_SECONDS)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency histogram, plus ``?profile=1`` for admins.
+
+    `is_admin(scope)` decides who may profile; a profiled request gets collapsed
+    stacks (``frame;frame;frame count``, the input of ``flamegraph.pl`` and
+    speedscope) instead of its normal response. Profiling stops after
+    ``&seconds=`` (default `PROFILE_SECONDS`), so a stream that never ends
+    (SSE) is cut off and its samples so far are returned.
+    """
+
+    def __init__(self, app, is_admin: Optional[Callable] = None, histogram: Histogram = HTTP_LATENCY):
+        self.app = app
+        self.is_admin = is_admin
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.is_admin is not None and _wants_profile(scope) and self.is_admin(scope):
+            await self._profiled(scope, receive, send)
+            return
+        status = 500
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # streaming responses (SSE) are timed until the stream ends
+            self.histogram.labels(scope["method"], route_label(scope), str(status)).observe(time.perf_counter() - t0)
+
+    async def _profiled(self, scope, receive, send):
+        from .profiler import SamplingProfiler
+
+        async def discard(message):
+            pass
+
+        profiler = SamplingProfiler()
+        with profiler:
+            task = asyncio.ensure_future(self.app(scope, receive, discard))
+            try:
+                await asyncio.wait({task}, timeout=_profile_seconds(scope))
+            finally:
+                if not task.done():
+                    task.cancel()  # a stream that outlived the cap (or the client went away)
+                    await asyncio.gather(task, return_exceptions=True)
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        body = profiler.collapsed().encode("utf-8")
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"cache-control", b"no-store")]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,133 @@
+"""Rendered-page cache for the public HTML routes.
+
+Pages are keyed on (route, params, data version) and stored with a strong
+ETag plus gzip (and brotli, if the optional ``brotli`` package is installed)
+precompressed bodies. `respond` answers ``If-None-Match`` with 304 and picks
+the best encoding the client accepts.
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, Optional
+import gzip
+import hashlib
+import threading
+
+from fastapi import Request, Response
+
+try:  # optional dependency
+    import brotli as _brotli
+except Exception:
+    _brotli = None
+
+
+class CachedPage:
+    __slots__ = ("body", "etag", "gzip", "br", "media_type")
+
+    def __init__(self, body: bytes, media_type: str = "text/html; charset=utf-8"):
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+        self.br: Optional[bytes] = _brotli.compress(body) if _brotli is not None else None
+        self.media_type = media_type
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+
+def _qvalues(header: str) -> Dict[str, float]:
+    """``"gzip, br;q=0"`` -> ``{"gzip": 1.0, "br": 0.0}``; malformed q-values count as 0."""
+    out = {}
+    for part in header.lower().split(","):
+        coding, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding.strip():
+            out[coding.strip()] = q
+    return out
+
+
+def pick_encoding(header: str, available: Iterable[str]) -> Optional[str]:
+    """The `available` coding the ``Accept-Encoding`` `header` rates highest (earlier wins ties).
+
+    None when none is acceptable; a coding with ``q=0`` is refused even if ``*`` allows others.
+    """
+    qs = _qvalues(header)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = qs.get(coding, qs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class PageCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages: "OrderedDict[Hashable, CachedPage]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[CachedPage]:
+        """Cached page for `key` (counted as a hit), or None without counting a miss."""
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+            return page
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str],
+                      media_type: str = "text/html; charset=utf-8") -> CachedPage:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+        # render outside the lock; a concurrent miss on the same key just renders twice
+        page = CachedPage(render().encode("utf-8"), media_type)
+        with self._lock:
+            self.misses += 1
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return page
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    @staticmethod
+    def respond(request: Request, page: CachedPage) -> Response:
+        headers = {
+            "ETag": page.etag,
+            "Cache-Control": "no-cache",  # always revalidate; revalidation is a cheap 304
+            "Vary": "Accept-Encoding",
+        }
+        inm = request.headers.get("if-none-match")
+        if inm and _etag_matches(inm, page.etag):
+            return Response(status_code=304, headers=headers)
+        encoding = pick_encoding(request.headers.get("accept-encoding", ""),
+                                 ("br", "gzip") if page.br is not None else ("gzip",))
+        if encoding == "br":
+            return Response(page.br, media_type=page.media_type, headers={**headers, "Content-Encoding": "br"})
+        if encoding == "gzip":
+            return Response(page.gzip, media_type=page.media_type, headers={**headers, "Content-Encoding": "gzip"})
+        return Response(page.body, media_type=page.media_type, headers=headers)
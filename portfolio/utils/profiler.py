@@ -0,0 +1,63 @@
+"""Sampling profiler producing collapsed stacks for flamegraphs.
+
+While active, a background thread snapshots every other thread's stack with
+``sys._current_frames()`` every `interval` seconds and counts identical stacks.
+That covers the event loop and the executor threads a request hands work to,
+at the cost of also sampling whatever else is running at the time.
+"""
+from collections import Counter
+from typing import Optional
+import sys
+import threading
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.001, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="portfolio-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "SamplingProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        names = {}
+        while True:  # always take at least one sample, however short the request
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+            if self._stop.wait(self.interval):
+                break
+
+    def collapsed(self) -> str:
+        """``frame;frame;frame count`` lines, thread name as the root frame."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
@@ -0,0 +1,229 @@
+"""Fan-out of new leads to admin SSE connections.
+
+Each subscriber gets a bounded ring buffer (oldest events are dropped when a
+slow tab falls behind) and an ``asyncio.Event`` to wake it. `LeadHub.publish`
+is thread-safe: it hands events to each subscriber's loop with
+``call_soon_threadsafe``, so sync handlers running in the threadpool can call
+it. With the ``filetail`` backend the hub ignores local publishes and instead
+tails the shared ``leads.jsonl`` log, so leads saved by any uvicorn worker
+reach admins connected to every worker.
+"""
+from collections import deque
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, List, Optional
+import asyncio
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger("portfolio")
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxlen: int):
+        self.loop = loop
+        self.buffer: deque = deque(maxlen=maxlen)
+        self.event = asyncio.Event()
+        self.dropped = 0
+
+    def push(self, item: dict) -> None:
+        """Append an event; must run on `self.loop`."""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(item)
+        self.event.set()
+
+    async def next_batch(self, timeout: float) -> List[dict]:
+        """Wait up to `timeout` seconds for events; [] means the wait timed out."""
+        if not self.buffer:
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        items = list(self.buffer)
+        self.buffer.clear()
+        return items
+
+
+def format_event(entry: dict) -> str:
+    lines = []
+    if entry.get("id") is not None:
+        lines.append(f"id: {entry['id']}")
+    lines.append(f"data: {json.dumps(entry)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class LeadHub:
+    def __init__(self, buffer_size: int = 100, heartbeat: float = 15.0, backend: str = "local",
+                 tail_path: Optional[Path] = None, tail_interval: float = 1.0, executor=None):
+        if backend not in ("local", "filetail"):
+            raise ValueError(f"Unknown hub backend: {backend}")
+        if backend == "filetail" and tail_path is None:
+            raise ValueError("filetail backend needs tail_path")
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.backend = backend
+        self.tail_path = Path(tail_path) if tail_path else None
+        self.tail_interval = tail_interval
+        self.executor = executor  # threads for reading the replay log (None = loop default)
+        self._lock = threading.Lock()
+        self._subs: List[Subscriber] = []
+        self._tailers = {}  # loop -> task
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subs)
+
+    def subscribe(self) -> Subscriber:
+        loop = asyncio.get_running_loop()
+        sub = Subscriber(loop, self.buffer_size)
+        with self._lock:
+            self._subs.append(sub)
+            if self.backend == "filetail" and loop not in self._tailers:
+                self._tailers[loop] = loop.create_task(self._tail(loop))
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            try:
+                self._subs.remove(sub)
+            except ValueError:
+                pass
+            if not any(s.loop is sub.loop for s in self._subs):
+                task = self._tailers.pop(sub.loop, None)
+                if task is not None:
+                    task.cancel()
+
+    def publish(self, entry: dict) -> None:
+        """Called by the process that saved the lead; safe from any thread."""
+        if self.backend == "filetail":
+            return  # the tailer picks it up from the shared log
+        self._dispatch([entry])
+
+    def _dispatch(self, entries: List[dict], loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        with self._lock:
+            subs = [s for s in self._subs if loop is None or s.loop is loop]
+        for sub in subs:
+            for entry in entries:
+                try:
+                    sub.loop.call_soon_threadsafe(sub.push, entry)
+                except RuntimeError:
+                    # loop already closed; the connection is gone
+                    self.unsubscribe(sub)
+                    break
+
+    async def _tail(self, loop: asyncio.AbstractEventLoop) -> None:
+        # (inode, offset) like JsonlLeadStore.scan: a compaction replaces the file (new inode) and
+        # may shrink it; either way we reread from the top but only dispatch ids above `last_id`.
+        # The reads are blocking (a reread covers the whole log), so they run on the executor.
+        ino, pos, last_id = await loop.run_in_executor(self.executor, self._log_end)
+        while True:
+            await asyncio.sleep(self.tail_interval)
+            try:
+                ino, pos, last_id, entries = await loop.run_in_executor(
+                    self.executor, self._read_new, ino, pos, last_id)
+                if entries:
+                    self._dispatch(entries, loop)
+            except Exception:
+                logger.exception("Lead log tail failed")
+
+    def _read_new(self, ino, pos: int, last_id: int):
+        """Leads appended to the tailed log since (`ino`, `pos`) with ids above `last_id`; blocking.
+
+        Returns the new ``(ino, pos, last_id, entries)``.
+        """
+        try:
+            fh = self.tail_path.open("rb")
+        except FileNotFoundError:
+            return ino, pos, last_id, []
+        with fh:
+            st = os.fstat(fh.fileno())
+            if st.st_ino != ino or st.st_size < pos:
+                ino, pos = st.st_ino, 0
+            if st.st_size == pos:
+                return ino, pos, last_id, []
+            fh.seek(pos)
+            data = fh.read(st.st_size - pos)
+        complete = data[:data.rfind(b"\n") + 1]
+        pos += len(complete)
+        entries = []
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and int(entry.get("id") or 0) > last_id:
+                entries.append(entry)
+                last_id = int(entry["id"])
+        return ino, pos, last_id, entries
+
+    def _log_end(self):
+        """(inode, size, id of the last complete lead) of the tailed log right now."""
+        try:
+            fh = self.tail_path.open("rb")
+        except FileNotFoundError:
+            return None, 0, 0
+        with fh:
+            st = os.fstat(fh.fileno())
+            fh.seek(max(0, st.st_size - 65536))
+            lines = fh.read().split(b"\n")[:-1]  # ids only increase, so the last complete line has the highest
+        for line in reversed(lines):
+            try:
+                return st.st_ino, st.st_size, int(json.loads(line).get("id") or 0)
+            except (ValueError, TypeError, AttributeError):
+                continue
+        return st.st_ino, st.st_size, 0
+
+    async def stream(self, is_disconnected: Callable, last_event_id: Optional[str] = None,
+                     replay: Optional[Callable[[int], Iterable[dict]]] = None,
+                     until: Optional[Callable[[dict], bool]] = None) -> AsyncIterator[str]:
+        """SSE body: replays leads after `last_event_id`, then live events and heartbeats.
+
+        The stream ends after the first event for which `until(event)` is true.
+        """
+        sub = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            last_id = 0
+            if last_event_id and replay is not None:
+                try:
+                    after = int(last_event_id)
+                except ValueError:
+                    after = None
+                if after is not None:
+                    # reading the log is blocking disk I/O; keep it off the event loop
+                    missed = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, lambda: deque(replay(after), maxlen=self.buffer_size))
+                    for entry in missed:
+                        last_id = max(last_id, int(entry.get("id") or 0))
+                        yield format_event(entry)
+                        if until is not None and until(entry):
+                            return
+            while True:
+                if await is_disconnected():
+                    break
+                items = await sub.next_batch(self.heartbeat)
+                if not items:
+                    yield ": ping\n\n"
+                    continue
+                for entry in items:
+                    # skip anything already sent during replay
+                    if last_id and int(entry.get("id") or 0) <= last_id:
+                        continue
+                    yield format_event(entry)
+                    if until is not None and until(entry):
+                        return
+        finally:
+            self.unsubscribe(sub)
+
+
+def hub_from_env(tail_path: Optional[Path], executor=None) -> LeadHub:
+    """``LEAD_HUB_BACKEND=local|filetail`` (filetail is for ``uvicorn --workers N``)."""
+    backend = os.environ.get("LEAD_HUB_BACKEND", "local")
+    if backend == "filetail" and (tail_path is None or not Path(tail_path).exists()):
+        logger.warning("filetail lead hub needs the JSONL lead store; using local fan-out")
+        backend = "local"
+    return LeadHub(backend=backend, tail_path=tail_path if backend == "filetail" else None,
+                   heartbeat=float(os.environ.get("SSE_HEARTBEAT", 15)), executor=executor)
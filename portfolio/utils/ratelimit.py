@@ -0,0 +1,160 @@
+"""Token-bucket rate limiting for form submissions.
+
+A `Rate` of ``5/600`` allows a burst of 5 and refills one token every 120
+seconds. `acquire` takes one token from every bucket it is given, or from
+none of them: a request refused because of its email address doesn't also use
+up its IP's allowance.
+
+`MemoryRateLimiter` keeps buckets in the process, which is enough for a single
+uvicorn worker. With ``--workers N`` use `SqliteRateLimiter`
+(``RATE_LIMIT_BACKEND=sqlite``) so every worker draws from the same buckets.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+
+
+class Rate(NamedTuple):
+    capacity: float
+    period: float
+    name: str = ""  # the configured limit ("contact_ip"); a bounded metric label, unlike the key
+
+    @property
+    def per_second(self) -> float:
+        return self.capacity / self.period
+
+
+def parse_rate(text: Optional[str], name: str = "") -> Optional[Rate]:
+    """``"5/600"`` -> Rate(5, 600); empty or ``"off"`` -> None (unlimited)."""
+    if not text or text.strip().lower() == "off":
+        return None
+    count, _, period = text.partition("/")
+    rate = Rate(float(count), float(period or 60), name)
+    if rate.capacity <= 0 or rate.period <= 0:
+        raise ValueError(f"Invalid rate: {text!r}")
+    return rate
+
+
+class RateLimited(Exception):
+    def __init__(self, key: str, retry_after: float, limit: str = ""):
+        super().__init__(f"rate limit exceeded for {key}")
+        self.key = key
+        self.retry_after = retry_after
+        self.limit = limit
+
+
+Bucket = Tuple[float, float]  # (tokens, updated)
+
+
+def _take(buckets: Dict[str, Bucket], limits: List[Tuple[str, Rate]], now: float) -> None:
+    """Take one token from each bucket in `limits`, updating `buckets` only if all have one."""
+    updated = {}
+    for key, rate in limits:
+        tokens, stamp = buckets.get(key, (rate.capacity, now))
+        tokens = min(rate.capacity, tokens + max(0.0, now - stamp) * rate.per_second)
+        if tokens < 1:
+            raise RateLimited(key, (1 - tokens) / rate.per_second, rate.name)
+        updated[key] = (tokens - 1, now)
+    buckets.update(updated)
+
+
+class RateLimiter:
+    # whether acquire() does I/O and should run on an executor
+    blocking = False
+
+    def acquire(self, limits: Iterable[Tuple[str, Optional[Rate]]]) -> None:
+        """Take a token for each ``(key, rate)``; raises RateLimited if any bucket is empty."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryRateLimiter(RateLimiter):
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Bucket] = {}
+        self._longest = 0.0
+
+    def acquire(self, limits: Iterable[Tuple[str, Optional[Rate]]]) -> None:
+        limits = [(k, r) for k, r in limits if r is not None]
+        now = time.monotonic()
+        with self._lock:
+            self._longest = max([self._longest] + [r.period for _, r in limits])
+            _take(self._buckets, limits, now)
+            if len(self._buckets) > self.max_keys:
+                # a bucket untouched for a full period is full again, same as a missing one
+                self._buckets = {k: b for k, b in self._buckets.items() if now - b[1] < self._longest}
+
+
+class SqliteRateLimiter(RateLimiter):
+    """Buckets in a small SQLite table shared by every worker on the host."""
+
+    blocking = True
+
+    def __init__(self, path: Path, prune_every: int = 1000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._longest = 0.0
+        # autocommit mode; acquire() opens its own IMMEDIATE transaction
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def acquire(self, limits: Iterable[Tuple[str, Optional[Rate]]]) -> None:
+        limits = [(k, r) for k, r in limits if r is not None]
+        if not limits:
+            return
+        keys = [k for k, _ in limits]
+        with self._lock:
+            self._longest = max([self._longest] + [r.period for _, r in limits])
+            self._conn.execute("BEGIN IMMEDIATE")  # serialises workers between read and write
+            try:
+                now = time.time()  # wall clock: shared across processes
+                rows = self._conn.execute(
+                    f"SELECT key, tokens, updated FROM buckets WHERE key IN ({','.join('?' * len(keys))})", keys
+                ).fetchall()
+                buckets = {key: (tokens, updated) for key, tokens, updated in rows}
+                _take(buckets, limits, now)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    [(k, *buckets[k]) for k in keys],
+                )
+                self._calls += 1
+                if self.prune_every and self._calls % self.prune_every == 0:
+                    self._conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self._longest,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class NullRateLimiter(RateLimiter):
+    def acquire(self, limits) -> None:
+        pass
+
+
+def limiter_from_env(data_dir: Path, backend: Optional[str] = None) -> RateLimiter:
+    """``RATE_LIMIT_BACKEND=memory|sqlite|off`` (default memory)."""
+    backend = (backend or os.environ.get("RATE_LIMIT_BACKEND", "memory")).lower()
+    if backend == "memory":
+        return MemoryRateLimiter()
+    if backend == "sqlite":
+        return SqliteRateLimiter(Path(data_dir) / "ratelimit.sqlite3")
+    if backend == "off":
+        return NullRateLimiter()
+    raise ValueError(f"Unknown rate limit backend: {backend}")
@@ -0,0 +1,125 @@
+"""Full-text search over projects.
+
+`SearchIndex` tokenizes title, summary, tech tags and details into an inverted
+index (term -> {doc: weighted tf}) and ranks matches with BM25. The last query
+term is prefix-matched against a sorted vocabulary so type-as-you-go queries
+work ("elast" finds "elasticsearch"). Recent results are kept in a small LRU.
+`to_dict()` produces the compact form shipped to the static site.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+import math
+import re
+import threading
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.+#][a-z0-9]+)*[+#]*")
+
+# field -> weight applied to term frequency
+FIELDS = {"title": 3.0, "tech": 2.0, "summary": 1.5, "details": 1.0}
+
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def _doc_text(project: dict, field: str) -> str:
+    value = project.get(field) or ""
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+
+class SearchIndex:
+    def __init__(self, cache_size: int = 128):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, List[int]]" = OrderedDict()
+        self.docs: List[dict] = []
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.lengths: List[float] = []
+        self.vocab: List[str] = []
+        self.avg_len = 0.0
+
+    def build(self, projects: Sequence[dict]) -> None:
+        """(Re)build the index from scratch; the catalog is small so this is cheap."""
+        postings: Dict[str, Dict[int, float]] = {}
+        lengths = []
+        for doc_id, p in enumerate(projects):
+            length = 0.0
+            for field, weight in FIELDS.items():
+                for term in tokenize(_doc_text(p, field)):
+                    row = postings.setdefault(term, {})
+                    row[doc_id] = row.get(doc_id, 0.0) + weight
+                    length += weight
+            lengths.append(length)
+        with self._lock:
+            self.docs = list(projects)
+            self.postings = postings
+            self.lengths = lengths
+            self.vocab = sorted(postings)
+            self.avg_len = (sum(lengths) / len(lengths)) if lengths else 0.0
+            self._cache.clear()
+
+    def _expand(self, term: str, prefix: bool) -> List[str]:
+        if not prefix:
+            return [term] if term in self.postings else []
+        out = []
+        i = bisect_left(self.vocab, term)
+        while i < len(self.vocab) and self.vocab[i].startswith(term):
+            out.append(self.vocab[i])
+            i += 1
+        return out
+
+    def _rank(self, q: str) -> List[int]:
+        terms = tokenize(q)
+        if not terms:
+            return list(range(len(self.docs)))
+        n = len(self.docs)
+        scores: Dict[int, float] = {}
+        matched: Optional[set] = None
+        for i, term in enumerate(terms):
+            # only the term being typed is prefix-matched
+            expansions = self._expand(term, prefix=(i == len(terms) - 1))
+            hits = set()
+            for t in expansions:
+                row = self.postings[t]
+                idf = math.log(1 + (n - len(row) + 0.5) / (len(row) + 0.5))
+                for doc_id, tf in row.items():
+                    norm = tf + K1 * (1 - B + B * self.lengths[doc_id] / (self.avg_len or 1.0))
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / norm
+                    hits.add(doc_id)
+            # every query term has to match (AND semantics)
+            matched = hits if matched is None else matched & hits
+        return sorted(matched or (), key=lambda d: (-scores[d], d))
+
+    def search(self, q: str, limit: Optional[int] = None) -> List[dict]:
+        key = " ".join(tokenize(q))
+        with self._lock:
+            ids = self._cache.get(key)
+            if ids is not None:
+                self._cache.move_to_end(key)
+            else:
+                ids = self._rank(q)
+                self._cache[key] = ids
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            docs = self.docs
+        if limit is not None:
+            ids = ids[:limit]
+        return [docs[i] for i in ids]
+
+    def to_dict(self) -> dict:
+        """Serializable index for the static site's client-side search."""
+        with self._lock:
+            return {
+                "fields": FIELDS,
+                "k1": K1,
+                "b": B,
+                "docs": [p.get("slug") for p in self.docs],
+                "lengths": [round(x, 2) for x in self.lengths],
+                "postings": {t: {str(d): tf for d, tf in row.items()} for t, row in self.postings.items()},
+            }
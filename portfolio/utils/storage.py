@@ -0,0 +1,194 @@
+"""Safe file writes for data shared between uvicorn workers.
+
+- `file_lock(path)` takes an ``fcntl.flock`` advisory lock on a sidecar
+  ``.<name>.lock`` file, so it survives the data file being replaced. Every
+  writer of a data file holds it around its read-modify-write. On platforms
+  without ``fcntl`` it only serialises threads in this process.
+- `atomic_writer` and `atomic_write_text`/`_bytes` write a uniquely named
+  temp file in the same directory, fsync it and ``os.replace`` it into place,
+  so readers see the old or the new file and never half of one. Pass `expected` (a
+  `file_stamp`) to fail with `VersionConflict` if the file changed since it was
+  read, for example from a hand edit, which doesn't take the lock.
+- `truncate_torn_tail` cuts a JSON-lines log back to its last complete line.
+- `recover(data_dir)` runs at startup and undoes what a crash can leave behind:
+  stale temp files, torn log tails and unparseable JSON files.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:  # not available on Windows
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .datasource import file_stamp
+
+logger = logging.getLogger("portfolio")
+
+TMP_PREFIX = "."
+TMP_SUFFIX = ".tmp"
+
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+class VersionConflict(Exception):
+    def __init__(self, path: Path):
+        super().__init__(f"{path} changed since it was read")
+        self.path = path
+
+
+def lock_path(path: Path) -> Path:
+    path = Path(path)
+    return path.with_name(f".{path.name}.lock")
+
+
+@contextmanager
+def file_lock(path: Path, shared: bool = False) -> Iterator[None]:
+    """Hold the advisory lock for `path` (exclusive unless `shared`). Not reentrant."""
+    path = Path(path)
+    if fcntl is None:
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(str(path.resolve()), threading.Lock())
+        with lock:
+            yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # flock locks belong to the open file, so threads of one process exclude each other too
+    fd = os.open(lock_path(path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def _fsync_dir(directory: Path) -> None:
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # e.g. Windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_UNCHECKED = object()
+
+
+@contextmanager
+def atomic_writer(path: Path, expected=_UNCHECKED) -> Iterator[BinaryIO]:
+    """Yield a binary file that replaces `path` atomically and durably when the block exits.
+
+    With `expected` (a `file_stamp`, or None for "must not exist yet"), raise
+    VersionConflict instead if the file's stamp differs at that point. Hold
+    `file_lock(path)` to make the check and the replace one step with respect
+    to other writers. If the block raises, `path` is left untouched.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f"{TMP_PREFIX}{path.name}.", suffix=TMP_SUFFIX, dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            yield fh
+            fh.flush()
+            os.fsync(fh.fileno())
+        if expected is not _UNCHECKED and file_stamp(path) != expected:
+            raise VersionConflict(path)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+
+def atomic_write_bytes(path: Path, data: bytes, expected=_UNCHECKED) -> None:
+    with atomic_writer(path, expected) as fh:
+        fh.write(data)
+
+
+def atomic_write_text(path: Path, text: str, expected=_UNCHECKED) -> None:
+    atomic_write_bytes(path, text.encode("utf-8"), expected)
+
+
+def truncate_torn_tail(path: Path) -> int:
+    """Drop a partial last line left by a crash mid-append. Returns the bytes removed.
+
+    Only call it while holding `file_lock(path)`; otherwise a concurrent
+    append in progress looks exactly like a torn one.
+    """
+    try:
+        fh = Path(path).open("rb+")
+    except FileNotFoundError:
+        return 0
+    with fh:
+        size = fh.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        fh.seek(size - 1)
+        if fh.read(1) == b"\n":
+            return 0
+        # walk back to the previous newline and truncate there
+        pos = size - 1
+        while pos > 0:
+            step = min(4096, pos)
+            fh.seek(pos - step)
+            chunk = fh.read(step)
+            idx = chunk.rfind(b"\n")
+            if idx != -1:
+                pos = pos - step + idx + 1
+                break
+            pos -= step
+        fh.truncate(pos)
+        fh.flush()
+        os.fsync(fh.fileno())
+    logger.warning("Truncated torn tail of %s at byte %d", path, pos)
+    return size - pos
+
+
+def recover(data_dir: Path, stale_after: float = 300.0) -> dict:
+    """Startup check of `data_dir` after a possible crash.
+
+    Removes temp files older than `stale_after` seconds (younger ones may
+    belong to a worker that is writing right now), truncates torn tails of
+    ``*.jsonl`` logs and reports ``*.json`` files that don't parse. A broken
+    JSON file is left in place: its readers keep their defaults or last good
+    copy and log the error, and the next successful write replaces it.
+    """
+    data_dir = Path(data_dir)
+    report = {"removed_tmp": [], "truncated": {}, "unreadable": []}
+    if not data_dir.is_dir():
+        return report
+    now = time.time()
+    for path in data_dir.rglob(f"{TMP_PREFIX}*{TMP_SUFFIX}"):
+        try:
+            if now - path.stat().st_mtime > stale_after:
+                path.unlink()
+                report["removed_tmp"].append(path.name)
+        except FileNotFoundError:
+            pass
+    for path in sorted(data_dir.glob("*.jsonl")):
+        with file_lock(path):
+            removed = truncate_torn_tail(path)
+        if removed:
+            report["truncated"][path.name] = removed
+    for path in sorted(data_dir.glob("*.json")):
+        try:
+            json.loads(path.read_bytes())
+        except ValueError:
+            logger.error("Data file %s is not valid JSON", path)
+            report["unreadable"].append(path.name)
+        except OSError:
+            pass
+    if report["removed_tmp"] or report["truncated"] or report["unreadable"]:
+        logger.warning("Storage recovery in %s: %s", data_dir, report)
+    return report
@@ -0,0 +1,144 @@
+"""Streaming upload storage.
+
+Uploads are copied in fixed-size chunks into a temp file in the destination
+directory while a SHA-256 is computed incrementally and the size limit is
+enforced. Finished files are renamed into place atomically. Content-addressed
+uploads are named ``<stem>.<sha12><ext>`` so identical bytes are stored once.
+
+Starlette parses (and spools to a temp file) the whole multipart body before a
+route runs, so the per-file limit alone can't stop an oversized request.
+`UploadLimitMiddleware` therefore caps the request body itself. It answers
+with a 413 based on ``Content-Length`` before anything is read, and it aborts a
+body that grows past the limit while it arrives (for example when chunked).
+A request can still spool up to its route's limit, so the disk it can use is
+bounded by that limit times the number of concurrent uploads.
+"""
+from pathlib import Path
+from typing import BinaryIO, Callable, NamedTuple, Optional
+import hashlib
+import os
+import tempfile
+
+from starlette.responses import JSONResponse
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+MULTIPART_OVERHEAD = 64 << 10  # headers/boundaries/form fields around the file in a request body
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds {limit} bytes")
+        self.limit = limit
+
+
+class StoredUpload(NamedTuple):
+    path: Path
+    sha256: str
+    size: int
+    deduplicated: bool
+
+
+def max_bytes_from_env(var: str, default_mb: int) -> int:
+    return int(float(os.environ.get(var, default_mb)) * 1024 * 1024)
+
+
+def _copy_to_temp(src: BinaryIO, dest_dir: Path, max_bytes: Optional[int], chunk_size: int):
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(prefix=".upload-", suffix=".tmp", dir=str(dest_dir))
+    tmp = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                h.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return tmp, h.hexdigest(), size
+
+
+def store_upload(src: BinaryIO, dest_dir: Path, filename: str, max_bytes: Optional[int] = None,
+                 chunk_size: int = CHUNK_SIZE) -> StoredUpload:
+    """Stream `src` into `dest_dir` under a content-addressed name, reusing an identical existing file."""
+    dest_dir = Path(dest_dir)
+    name = Path(filename).name
+    stem, suffix = Path(name).stem, Path(name).suffix.lower()
+    tmp, digest, size = _copy_to_temp(src, dest_dir, max_bytes, chunk_size)
+    short = digest[:12]
+    existing = next(iter(sorted(dest_dir.glob(f"*.{short}{suffix}"))), None)
+    if existing is not None:
+        tmp.unlink(missing_ok=True)
+        return StoredUpload(existing, digest, size, True)
+    dest = dest_dir / f"{stem}.{short}{suffix}"
+    os.replace(tmp, dest)
+    return StoredUpload(dest, digest, size, False)
+
+
+def store_upload_as(src: BinaryIO, dest: Path, max_bytes: Optional[int] = None,
+                    chunk_size: int = CHUNK_SIZE) -> StoredUpload:
+    """Stream `src` to the fixed path `dest`, replacing it atomically once complete."""
+    dest = Path(dest)
+    tmp, digest, size = _copy_to_temp(src, dest.parent, max_bytes, chunk_size)
+    os.replace(tmp, dest)
+    return StoredUpload(dest, digest, size, False)
+
+
+class UploadLimitMiddleware:
+    """Reject request bodies larger than `limit_for(path)` bytes (None = no limit) with a 413."""
+
+    def __init__(self, app, limit_for: Callable[[str], Optional[int]]):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            await self._reject(scope, receive, send, limit)
+            return
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge(limit)
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                return  # the app's reaction to the aborted body (usually a 400) is replaced below
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if exceeded and not started:
+            await self._reject(scope, receive, send, limit)
+
+    @staticmethod
+    async def _reject(scope, receive, send, limit: int) -> None:
+        response = JSONResponse({"detail": f"Request body exceeds {limit} bytes"}, status_code=413,
+                                headers={"Connection": "close"})
+        await response(scope, receive, send)
@@ -2,139 +2,314 @@
 
 - Renders templates using the same data files under `portfolio/data/`.
 - Copies images and static assets and generates `docs/index.html`, `docs/styles.css`, and `docs/script.js` at the docs root.
+- Builds the app's fingerprinted assets in `portfolio/static/dist/` (the deploy-time step the app relies on).
 - Rewrites a few dynamic bits (HTMX forms, HTMX attributes) to simple client-side fallbacks where possible.
 
-Run: python scripts/export_static.py
+The build is incremental: every output records a hash of its inputs (templates it
+depends on, the page's own context data, the rewrite rules) in
+`docs/.build-manifest.json`, and only outputs whose hash changed are rebuilt or
+copied. Pages are rendered in a process pool and a timing profile is printed.
+
+Run: python scripts/export_static.py [--force] [--jobs N]
 """
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from concurrent.futures import ProcessPoolExecutor
+from jinja2 import Environment, FileSystemLoader, meta, select_autoescape
 from pathlib import Path
+import argparse
+import hashlib
 import json
-import shutil
+import os
 import re
+import shutil
+import sys
+import time
 
 ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from portfolio.utils.search import SearchIndex  # noqa: E402
+from portfolio.utils.media import MediaManifest  # noqa: E402
+from portfolio.utils.assets import AssetManifest, build_assets, minify_css  # noqa: E402
+from portfolio.utils.images import ImageMetaStore  # noqa: E402
 TEMPLATES = ROOT / 'portfolio' / 'templates'
 STATIC = ROOT / 'portfolio' / 'static'
 DATA = ROOT / 'portfolio' / 'data'
 DOCS = ROOT / 'docs'
+IMAGE_META = DATA / 'image_cache.json'
+MANIFEST = DOCS / '.build-manifest.json'
+
+# bump when the rewrite rules below change so every page is rebuilt
+REWRITE_VERSION = 2
+
+# Post-processing for the static site, applied in a single regex pass. Alternatives
+# are tried left to right at each position, so the more specific ones come first.
+_REWRITES = [
+    # Replace HTMX form for contact with a Formspree placeholder (so the form works as a simple POST)
+    (r'(?i:<form[^>]+hx-post=["][^"]+["][^>]*>)', lambda m: '<form method="POST" action="https://formspree.io/f/YOUR_FORM_ID">'),
+    # Remove HTMX/Alpine/Chart.js includes since we include our combined script
+    (r'(?i:<script[^>]+(?:htmx.org|alpinejs|chart.js)[^<]*</script>\s*)', lambda m: ''),
+    # Remove hx- attributes left on elements (non-functional in static)
+    (r'\s?hx-[a-zA-Z0-9:-]+="[^"]*"', lambda m: ''),
+    # Stylesheet and bundled scripts live at the docs root
+    (r'/static/css/styles\.css', lambda m: 'styles.css'),
+    (r'/static/js/(?:lightbox|admin)\.js', lambda m: 'script.js'),
+    # Make remaining /static/... URLs (src, href, srcset, data-large) relative
+    (r'/static/', lambda m: 'static/'),
+    # Convert project links like /projects/slug to projects/slug/ (so GitHub Pages serves the folder)
+    (r'href="/projects/([^"]+)"', lambda m: f'href="projects/{m.group(1)}/"'),
+    # Internal links point to the generated static pages
+    (r'href="/(about|projects|contact)?"', lambda m: f'href="{m.group(1) or "index"}.html"'),
+]
+_REWRITE_RE = re.compile('|'.join(f'({pattern})' for pattern, _ in _REWRITES))
+# group index of each alternative's outer group, so the callback knows which rule matched
+_GROUP_STARTS = []
+_g = 1
+for _pattern, _ in _REWRITES:
+    _GROUP_STARTS.append(_g)
+    _g += 1 + re.compile(_pattern).groups
+
+
+def rewrite_for_static(html: str) -> str:
+    def repl(m):
+        for start, (pattern, fn) in zip(_GROUP_STARTS, _REWRITES):
+            if m.group(start) is not None:
+                sub = re.fullmatch(pattern, m.group(start))
+                return fn(sub)
+        return m.group(0)
+    return _REWRITE_RE.sub(repl, html)
+
+
+# -- rendering (runs in worker processes) -------------------------------------
+_env = None
+
+
+def _get_env() -> Environment:
+    global _env
+    if _env is None:
+        _env = Environment(loader=FileSystemLoader(str(TEMPLATES)), autoescape=select_autoescape(['html', 'xml']))
+        # plain /static/... URLs; the rewrite rules map them to the docs/ layout
+        _env.globals['static_url'] = AssetManifest().static_url
+        # srcsets/dimensions of uploaded images, as recorded by the app's image pipeline
+        _env.globals['image_meta'] = ImageMetaStore(IMAGE_META).get
+        _env.globals['derivative'] = lambda url: None  # no /img endpoint on a static host
+    return _env
 
-DOCS.mkdir(exist_ok=True)
-
-env = Environment(loader=FileSystemLoader(str(TEMPLATES)), autoescape=select_autoescape(['html','xml']))
-
-profile = json.loads((DATA / 'profile.json').read_text())
-projects = json.loads((DATA / 'projects.json').read_text())
-
-def render_to(path: Path, template_name: str, context: dict):
-    html = env.get_template(template_name).render(**context)
-    # Basic post-processing for static site:
-    # - Replace /static/css/styles.css -> styles.css (use relative paths)
-    html = html.replace('/static/css/styles.css', 'styles.css')
-    # - Replace script includes (remove HTMX/Alpine/Chart.js includes since we'll include our combined script)
-    html = re.sub(r'<script[^>]+htmx.org[^<]*<\/script>\s*', '', html, flags=re.I)
-    html = re.sub(r'<script[^>]+alpinejs[^<]*<\/script>\s*', '', html, flags=re.I)
-    html = re.sub(r'<script[^>]+chart.js[^<]*<\/script>\s*', '', html, flags=re.I)
-    # - Replace references to static JS files with script.js (relative)
-    html = html.replace('/static/js/lightbox.js', 'script.js')
-    html = html.replace('/static/js/admin.js', 'script.js')
-    # - Make image and static URLs relative (remove leading slash for /static/...)
-    html = html.replace('src="/static/', 'src="static/')
-    html = html.replace('href="/static/', 'href="static/')
-    # - Also replace any remaining /static/... occurrences (e.g., in srcset) -> static/...
-    html = html.replace('/static/', 'static/')
-
-    # - Fix internal links so they point to the generated static pages (no leading slash)
-    html = html.replace('href="/"', 'href="index.html"')
-    html = html.replace('href="/about"', 'href="about.html"')
-    html = html.replace('href="/projects"', 'href="projects.html"')
-    html = html.replace('href="/contact"', 'href="contact.html"')
-    # - Convert project links like /projects/slug to projects/slug/ (so GitHub Pages serves the folder)
-    html = re.sub(r'href="/projects/([^"]+)"', r'href="projects/\1/"', html)
-
-    # - Replace HTMX form for contact with a Formspree placeholder (so the form works as a simple POST)
-    html = re.sub(r'<form[^>]+hx-post=[\"\"][^\"]+[\"\"][^>]*>', '<form method="POST" action="https://formspree.io/f/YOUR_FORM_ID">', html, flags=re.I)
-    # - Remove hx- attributes left on elements (non-functional in static)
-    html = re.sub(r'\s?hx-[a-zA-Z0-9:-]+="[^"]*"', '', html)
+
+def render_page(out: str, template_name: str, context: dict) -> tuple:
+    t0 = time.perf_counter()
+    html = _get_env().get_template(template_name).render(**context)
+    t1 = time.perf_counter()
+    html = rewrite_for_static(html)
+    t2 = time.perf_counter()
+    path = Path(out)
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(html)
-    print('Wrote', path)
-
-# Render pages
-context_common = {'profile': profile, 'projects': projects, 'year': 2025}
-# index
-# Build gallery_images from top-level images in STATIC/img (exclude uploads folder)
-img_dir = STATIC / 'img'
-gallery_images = []
-for p in sorted(img_dir.iterdir()):
-    if p.is_file() and p.parent == img_dir and p.suffix.lower() in ('.jpg', '.jpeg', '.png', '.webp', '.svg'):
-        gallery_images.append(f'static/img/{p.name}')
-render_to(DOCS / 'index.html', 'index.html', {**context_common, 'gallery_images': gallery_images})
-# about
-render_to(DOCS / 'about.html', 'about.html', {**context_common})
-# projects list
-# compute tags like in app
-tags = sorted({t for p in projects for t in p.get('tech', [])})
-render_to(DOCS / 'projects.html', 'projects.html', {**context_common, 'tags': tags})
-# project detail pages
-for p in projects:
-    slug = p.get('slug')
-    out = DOCS / 'projects' / slug / 'index.html'
-    render_to(out, 'project_detail.html', {**context_common, 'project': p, 'is_static': True})
-
-# contact
-render_to(DOCS / 'contact.html', 'contact.html', {**context_common})
-
-# copy styles to docs root
-styles_src = STATIC / 'css' / 'styles.css'
-styles_dst = DOCS / 'styles.css'
-shutil.copyfile(styles_src, styles_dst)
-print('Copied', styles_dst)
-
-# Build a single script.js by concatenating lightbox and a small static-site helper
-script_dst = DOCS / 'script.js'
-with script_dst.open('w') as out:
-    # lightbox (if exists)
-    lb = STATIC / 'js' / 'lightbox.js'
-    if lb.exists():
-        out.write('/* lightbox.js (bundled) */\n')
-        out.write(lb.read_text())
-        out.write('\n')
-    # admin.js functionality adapted for static (SSE not used)
-    out.write('/* static-site.js (generated) */\n')
-    out.write('document.addEventListener("DOMContentLoaded", function(){\n')
-    out.write("  // Projects client-side search\n")
-    out.write("  const search = document.querySelector('input[placeholder=\"Search projects...\"]');\n")
-    out.write("  if (search) {\n")
-    out.write("    const list = document.getElementById('projects-list');\n")
-    out.write("    search.addEventListener('input', function(){\n")
-    out.write("      const q = this.value.toLowerCase();\n")
-    out.write("      Array.from(list.querySelectorAll('.project-card')).forEach(function(card){\n")
-    out.write("        const text = card.textContent.toLowerCase();\n")
-    out.write("        card.parentElement.style.display = text.indexOf(q) !== -1 ? '' : 'none';\n")
-    out.write("      });\n")
-    out.write("    });\n")
-    out.write("  }\n")
-    out.write("  // simple contact form fallback: replace form action placeholder note\n")
-    out.write("  const forms = document.querySelectorAll('form[action*=formspree]');\n")
-    out.write("  forms.forEach(f => {\n")
-    out.write("    f.addEventListener('submit', function(){\n")
-    out.write("      // show a quick alert; user should replace YOUR_FORM_ID in HTML with a real ID\n")
-    out.write("      setTimeout(() => alert('Form submitted (static) - configure Formspree with your form ID to actually receive emails.'), 100);\n")
-    out.write("    });\n")
-    out.write("  });\n")
-    out.write('});\n')
-print('Built', script_dst)
-
-# copy images
-img_src = STATIC / 'img'
-img_dst = DOCS / 'static' / 'img'
-if img_dst.exists():
-    shutil.rmtree(img_dst)
-shutil.copytree(img_src, img_dst)
-print('Copied images to', img_dst)
-
-print('\nStatic export complete.\n')
-print('To publish on GitHub Pages:')
-print('1. Commit the `docs/` directory and push to your repo (GitHub Pages -> Source: `docs/` folder).')
-print('2. Replace the placeholder Formspree ID in docs/contact.html if you want working contact forms.')
-print('3. Enable GitHub Pages from repository settings and pick `docs/` as the source.')
+    return out, t1 - t0, t2 - t1, time.perf_counter() - t2
+
+
+# -- dependency tracking --------------------------------------------------------
+def template_deps(name: str, env: Environment, seen=None) -> set:
+    """`name` plus every template it extends/includes/imports, transitively."""
+    seen = set() if seen is None else seen
+    if name in seen:
+        return seen
+    seen.add(name)
+    source = env.loader.get_source(env, name)[0]
+    for ref in meta.find_referenced_templates(env.parse(source)):
+        if ref:
+            template_deps(ref, env, seen)
+    return seen
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open('rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Build:
+    def __init__(self, out_dir: Path, force: bool = False):
+        self.out_dir = out_dir
+        self.force = force
+        try:
+            self.old = json.loads(MANIFEST.read_text()) if not force else {}
+        except Exception:
+            self.old = {}
+        self.new = {'outputs': {}, 'sources': {}}
+        self.timings = {}
+        self.stats = {'rebuilt': 0, 'skipped': 0, 'copied': 0, 'removed': 0}
+        self._file_hashes = {}
+
+    def timed(self, phase: str):
+        build = self
+
+        class _Timer:
+            def __enter__(self):
+                self.t0 = time.perf_counter()
+
+            def __exit__(self, *exc):
+                build.timings[phase] = build.timings.get(phase, 0.0) + time.perf_counter() - self.t0
+        return _Timer()
+
+    def source_hash(self, path: Path) -> str:
+        """Content hash of a source file, reusing the previous hash when size+mtime are unchanged."""
+        key = str(path.relative_to(ROOT))
+        if key in self._file_hashes:
+            return self._file_hashes[key]
+        st = path.stat()
+        stamp = [st.st_size, st.st_mtime_ns]
+        prev = self.old.get('sources', {}).get(key)
+        digest = prev['sha256'] if prev and prev.get('stamp') == stamp else file_hash(path)
+        self.new['sources'][key] = {'stamp': stamp, 'sha256': digest}
+        self._file_hashes[key] = digest
+        return digest
+
+    def is_fresh(self, out: Path, key: str) -> bool:
+        rel = str(out.relative_to(self.out_dir))
+        self.new['outputs'][rel] = key
+        return out.exists() and self.old.get('outputs', {}).get(rel) == key
+
+    def save(self) -> None:
+        MANIFEST.write_text(json.dumps(self.new, indent=1, sort_keys=True))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--force', action='store_true', help='ignore the build manifest and rebuild everything')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='render processes (1 = render inline)')
+    args = parser.parse_args(argv)
+
+    DOCS.mkdir(exist_ok=True)
+    build = Build(DOCS, force=args.force)
+    started = time.perf_counter()
+
+    with build.timed('load data'):
+        profile = json.loads((DATA / 'profile.json').read_text())
+        projects = json.loads((DATA / 'projects.json').read_text())
+        # Build gallery_images from top-level images in STATIC/img (exclude uploads folder),
+        # using the same manifest the app serves the home page from
+        gallery_images = MediaManifest(STATIC / 'img', 'static/img').urls()
+
+    # Render pages: (output, template, page context)
+    context_common = {'profile': profile, 'year': 2025}
+    tags = sorted({t for p in projects for t in p.get('tech', [])})
+    pages = [
+        (DOCS / 'index.html', 'index.html', {**context_common, 'projects': projects, 'gallery_images': gallery_images}),
+        (DOCS / 'about.html', 'about.html', {**context_common}),
+        (DOCS / 'projects.html', 'projects.html', {**context_common, 'projects': projects, 'tags': tags}),
+        (DOCS / 'contact.html', 'contact.html', {**context_common}),
+    ]
+    for p in projects:
+        out = DOCS / 'projects' / p.get('slug') / 'index.html'
+        pages.append((out, 'project_detail.html', {**context_common, 'project': p, 'is_static': True}))
+
+    with build.timed('plan'):
+        env = _get_env()
+        dirty = []
+        for out, template_name, context in pages:
+            h = hashlib.sha256(f'rewrite:{REWRITE_VERSION}'.encode())
+            if IMAGE_META.exists():
+                h.update(build.source_hash(IMAGE_META).encode())
+            for dep in sorted(template_deps(template_name, env)):
+                h.update(dep.encode())
+                h.update(build.source_hash(TEMPLATES / dep).encode())
+            h.update(json.dumps(context, sort_keys=True, default=str).encode())
+            if build.is_fresh(out, h.hexdigest()):
+                build.stats['skipped'] += 1
+            else:
+                dirty.append((str(out), template_name, context))
+
+    render_profile = []
+    with build.timed('render'):
+        if args.jobs > 1 and len(dirty) > 1:
+            with ProcessPoolExecutor(max_workers=min(args.jobs, len(dirty))) as pool:
+                render_profile = list(pool.map(render_page, *zip(*dirty)))
+        else:
+            render_profile = [render_page(*job) for job in dirty]
+    for out, *_ in render_profile:
+        print('Wrote', out)
+    build.stats['rebuilt'] += len(render_profile)
+
+    with build.timed('assets'):
+        # minified styles at docs root
+        styles_src = STATIC / 'css' / 'styles.css'
+        styles_dst = DOCS / 'styles.css'
+        if not build.is_fresh(styles_dst, 'min2:' + build.source_hash(styles_src)):
+            styles_dst.write_text(minify_css(styles_src.read_text()))
+            build.stats['rebuilt'] += 1
+            print('Built', styles_dst)
+
+        # Build a single script.js by concatenating lightbox and the static-site helper
+        script_dst = DOCS / 'script.js'
+        parts = [STATIC / 'js' / 'lightbox.js', STATIC / 'js' / 'static-site.js']
+        key = 'concat:' + ':'.join(build.source_hash(p) for p in parts if p.exists())
+        if not build.is_fresh(script_dst, key):
+            with script_dst.open('w') as out:
+                # lightbox (if exists)
+                if parts[0].exists():
+                    out.write('/* lightbox.js (bundled) */\n')
+                    out.write(parts[0].read_text())
+                # admin.js functionality adapted for static (SSE not used)
+                out.write('/* static-site.js (bundled) */\n')
+                out.write(parts[1].read_text())
+            build.stats['rebuilt'] += 1
+            print('Built', script_dst)
+
+        # fingerprinted/precompressed assets for the app itself (static/dist); the app never builds them
+        build_assets(STATIC)
+
+        # search index used by static-site.js instead of scanning card text
+        index_dst = DOCS / 'search-index.json'
+        key = hashlib.sha256(json.dumps(projects, sort_keys=True).encode()).hexdigest()
+        if not build.is_fresh(index_dst, key):
+            search_index = SearchIndex()
+            search_index.build(projects)
+            index_dst.write_text(json.dumps(search_index.to_dict(), separators=(',', ':')))
+            build.stats['rebuilt'] += 1
+            print('Wrote', index_dst)
+
+    with build.timed('images'):
+        # mirror static/img into docs/static/img, copying only changed files
+        img_src = STATIC / 'img'
+        img_dst = DOCS / 'static' / 'img'
+        wanted = set()
+        for src in sorted(img_src.rglob('*')):
+            if not src.is_file():
+                continue
+            rel = src.relative_to(img_src)
+            dst = img_dst / rel
+            wanted.add(rel)
+            if build.is_fresh(dst, build.source_hash(src)):
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(src, dst)
+            build.stats['copied'] += 1
+        if img_dst.exists():
+            for dst in sorted(img_dst.rglob('*'), reverse=True):
+                if dst.is_file() and dst.relative_to(img_dst) not in wanted:
+                    dst.unlink()
+                    build.stats['removed'] += 1
+        print('Synced images to', img_dst)
+
+    build.save()
+    total = time.perf_counter() - started
+
+    print('\nBuild profile:')
+    for phase, secs in build.timings.items():
+        print(f'  {phase:<10} {secs * 1000:8.1f} ms')
+    for out, render_s, rewrite_s, write_s in sorted(render_profile, key=lambda r: -r[1]):
+        print(f'    {Path(out).relative_to(DOCS)!s:<45} render {render_s * 1000:6.1f} ms  rewrite {rewrite_s * 1000:5.1f} ms  write {write_s * 1000:5.1f} ms')
+    print(f'  {"total":<10} {total * 1000:8.1f} ms  '
+          f'({build.stats["rebuilt"]} rebuilt, {build.stats["skipped"]} pages up to date, '
+          f'{build.stats["copied"]} copied, {build.stats["removed"]} removed)')
+
+    print('\nStatic export complete.\n')
+    print('To publish on GitHub Pages:')
+    print('1. Commit the `docs/` directory and push to your repo (GitHub Pages -> Source: `docs/` folder).')
+    print('2. Replace the placeholder Formspree ID in docs/contact.html if you want working contact forms.')
+    print('3. Enable GitHub Pages from repository settings and pick `docs/` as the source.')
+
+
+if __name__ == '__main__':
+    main()